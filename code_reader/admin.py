@@ -1,5 +1,5 @@
 from django.contrib import admin
-from code_reader.models import File, Project
+from code_reader.models import File, Project, Job
 from code_reader.utils import run_code_reader, run_file_summarizer
 
 
@@ -28,5 +28,10 @@ class ProjectAdmin(admin.ModelAdmin):
     search_fields = ('repo_path', 'name')
     actions = [start_reading_code]
 
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'project', 'kind', 'status', 'updated_at')
+    list_filter = ('kind', 'status')
+
 admin.site.register(File, FileAdmin)
 admin.site.register(Project, ProjectAdmin)
+admin.site.register(Job, JobAdmin)
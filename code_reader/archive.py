@@ -0,0 +1,169 @@
+# code_reader/archive.py
+
+import os
+import posixpath
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+# Directories never extracted from an uploaded archive
+IGNORED_ARCHIVE_DIRS = {
+    'node_modules', '.git', '__MACOSX', '__pycache__', '.next', '.idea', 'venv', 'venv2', 'venv3', '.venv',
+    'dist', 'build', 'postgres_data',
+}
+BINARY_EXTENSIONS = {
+    '.png', '.jpg', '.jpeg', '.gif', '.bmp', '.ico', '.webp', '.tiff', '.psd',
+    '.mp3', '.mp4', '.wav', '.avi', '.mov', '.mkv', '.ogg',
+    '.ttf', '.otf', '.woff', '.woff2', '.eot',
+    '.zip', '.tar', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.jar', '.war', '.whl',
+    '.pyc', '.pyo', '.so', '.dll', '.dylib', '.exe', '.bin', '.o', '.a', '.class',
+    '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx',
+    '.sqlite3', '.db',
+}
+CHUNK_SIZE = 1024 * 1024
+
+
+class ArchiveLimitError(ValueError):
+    """Raised when an uploaded archive goes over the configured size or member limits."""
+
+
+def is_ignored_member(name):
+    parts = name.split('/')
+    if any(part in IGNORED_ARCHIVE_DIRS for part in parts[:-1]):
+        return True
+    filename = parts[-1]
+    return filename == '.DS_Store' or os.path.splitext(filename)[1].lower() in BINARY_EXTENSIONS
+
+
+def is_unsafe_member(name):
+    """Absolute paths and '..' components would escape the extraction directory."""
+    normalized = posixpath.normpath(name)
+    return name.startswith('/') or normalized == '..' or normalized.startswith('../') or ':' in name.split('/')[0]
+
+
+def archive_members(zip_ref, max_total_size=None, max_members=None):
+    """
+    Returns the members of the archive to extract, skipping directories, ignored paths and binaries
+    before anything touches the disk. Limits are enforced on the sizes declared in the archive,
+    extract_member enforces them again on the bytes actually decompressed.
+    """
+    max_total_size = max_total_size or settings.CODE_READER_ARCHIVE_MAX_BYTES
+    max_members = max_members or settings.CODE_READER_ARCHIVE_MAX_MEMBERS
+
+    members = []
+    total_size = 0
+    for info in zip_ref.infolist():
+        if info.is_dir() or is_unsafe_member(info.filename) or is_ignored_member(info.filename):
+            continue
+        members.append(info)
+        total_size += info.file_size
+        if len(members) > max_members:
+            raise ArchiveLimitError(f"Archive has more than {max_members} files.")
+        if total_size > max_total_size:
+            raise ArchiveLimitError(f"Archive is bigger than {max_total_size} bytes uncompressed.")
+    return members
+
+
+def archive_root(members):
+    """The single top-level directory shared by every member, if there is one (a zipped project folder)."""
+    roots = {info.filename.split('/', 1)[0] for info in members}
+    if len(roots) == 1 and all('/' in info.filename for info in members):
+        return roots.pop()
+    return ''
+
+
+def decode_content(data):
+    """Decodes a text member the same way utils.read_file_content reads files, None for binary data."""
+    if b'\0' in data[:8192]:
+        return None
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        return data.decode('latin-1')
+
+
+def extract_member(zip_ref, info, destination, budget):
+    """
+    Streams one member to disk in chunks, counting them against the shared budget.
+    Returns its bytes, or None when it is too big to be handed to the indexing.
+    """
+    target = os.path.join(destination, *info.filename.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    keep = info.file_size <= settings.CODE_READER_ARCHIVE_MAX_INDEXED_FILE_BYTES
+    data = bytearray()
+    with zip_ref.open(info) as source, open(target, 'wb') as output:
+        while True:
+            chunk = source.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            budget.consume(len(chunk))
+            output.write(chunk)
+            if keep:
+                data.extend(chunk)
+    return target, bytes(data) if keep else None
+
+
+class _ByteBudget:
+    """Thread-safe count of the decompressed bytes, guards against archives lying about their sizes."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def consume(self, size):
+        with self._lock:
+            self.used += size
+            if self.used > self.limit:
+                raise ArchiveLimitError(f"Archive is bigger than {self.limit} bytes uncompressed.")
+
+
+def extract_archive(zip_path, destination, workers=None, max_total_size=None, max_members=None):
+    """
+    Extracts the uploaded project archive into destination and reads the text files on the way,
+    so the indexing does not need a second os.walk pass over the extracted tree.
+
+    Members are decompressed in parallel, every worker thread reading through its own ZipFile handle
+    (zlib releases the GIL while inflating).
+
+    Returns:
+    tuple: (repo_path, file_contents) where repo_path is the project root inside destination
+    (the single top-level folder of the archive when there is one) and file_contents is
+    absolute path -> content for the text files.
+    """
+    workers = workers or settings.CODE_READER_ARCHIVE_WORKERS
+    max_total_size = max_total_size or settings.CODE_READER_ARCHIVE_MAX_BYTES
+    with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+        members = archive_members(zip_ref, max_total_size, max_members)
+
+    os.makedirs(destination, exist_ok=True)
+    budget = _ByteBudget(max_total_size)
+    local = threading.local()
+    handles = []
+    handles_lock = threading.Lock()
+
+    def extract(info):
+        if not hasattr(local, 'zip_ref'):
+            local.zip_ref = zipfile.ZipFile(zip_path, 'r')
+            with handles_lock:
+                handles.append(local.zip_ref)
+        return extract_member(local.zip_ref, info, destination, budget)
+
+    file_contents = {}
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for target, data in pool.map(extract, members):
+                # empty members are kept, they get fingerprinted like any other file
+                content = decode_content(data) if data is not None else None
+                if content is not None:
+                    file_contents[target] = content
+    finally:
+        for handle in handles:
+            handle.close()
+
+    root = archive_root(members)
+    repo_path = os.path.join(destination, root) if root else destination
+    print(f"extracted {len(members)} files ({budget.used} bytes) from the archive into {repo_path}")
+    return repo_path, file_contents
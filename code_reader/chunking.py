@@ -0,0 +1,151 @@
+# code_reader/chunking.py
+
+import ast
+import os
+import re
+
+from code_reader.models import FileChunk
+
+MAX_CHUNK_LINES = 120
+MIN_CHUNK_LINES = 8
+
+# kinds of chunks
+MODULE = 'module'
+CLASS = 'class'
+FUNCTION = 'function'
+BLOCK = 'block'
+
+# top-level definitions of the usual languages, used when the file is not Python
+DEFINITION_RE = re.compile(
+    r'^(?:export\s+)?(?:default\s+)?(?:abstract\s+|public\s+|private\s+|protected\s+|static\s+|async\s+|pub\s+)*'
+    r'(?P<keyword>function\*?|class|interface|type|enum|const|let|var|def|func|fn|struct|impl|trait|module)\s+'
+    r'(?P<name>[A-Za-z_$][\w$]*)'
+)
+
+
+def _chunk(lines, start, end, kind, symbol=''):
+    """Chunk dict for the 1-based inclusive line range."""
+    return {"symbol": symbol, "kind": kind, "start_line": start, "end_line": end,
+            "content": '\n'.join(lines[start - 1:end])}
+
+
+def _split_large(lines, chunk):
+    """Windows of MAX_CHUNK_LINES for chunks too big to be useful in a prompt."""
+    if chunk["end_line"] - chunk["start_line"] < MAX_CHUNK_LINES:
+        return [chunk]
+    parts = []
+    for start in range(chunk["start_line"], chunk["end_line"] + 1, MAX_CHUNK_LINES):
+        end = min(start + MAX_CHUNK_LINES - 1, chunk["end_line"])
+        parts.append(_chunk(lines, start, end, chunk["kind"], chunk["symbol"]))
+    return parts
+
+
+def _fill_gaps(lines, chunks):
+    """Module-level code between the definitions becomes MODULE chunks, blank gaps are dropped."""
+    ranges = sorted(chunks, key=lambda chunk: chunk["start_line"])
+    result = []
+    cursor = 1
+    for chunk in ranges + [None]:
+        gap_end = (chunk["start_line"] - 1) if chunk else len(lines)
+        if gap_end >= cursor and any(line.strip() for line in lines[cursor - 1:gap_end]):
+            result.append(_chunk(lines, cursor, gap_end, MODULE))
+        if chunk:
+            result.append(chunk)
+            cursor = max(cursor, chunk["end_line"] + 1)
+    return result
+
+
+def _definition_start(node):
+    return min([node.lineno] + [decorator.lineno for decorator in getattr(node, 'decorator_list', [])])
+
+
+def chunk_python(content):
+    """Top-level functions and classes with ast; classes too big for one chunk are split per method."""
+    tree = ast.parse(content)
+    lines = content.splitlines()
+    chunks = []
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            chunks.append(_chunk(lines, _definition_start(node), node.end_lineno, FUNCTION, node.name))
+        elif isinstance(node, ast.ClassDef):
+            start, end = _definition_start(node), node.end_lineno
+            methods = [child for child in node.body if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef))]
+            if end - start < MAX_CHUNK_LINES or not methods:
+                chunks.append(_chunk(lines, start, end, CLASS, node.name))
+                continue
+            # class header (docstring, attributes) up to the first method, then one chunk per method
+            first_method = _definition_start(methods[0])
+            if first_method > start:
+                chunks.append(_chunk(lines, start, first_method - 1, CLASS, node.name))
+            previous_end = first_method - 1
+            for method in methods:
+                method_start = max(_definition_start(method), previous_end + 1)
+                chunks.append(_chunk(lines, method_start, method.end_lineno, FUNCTION, f"{node.name}.{method.name}"))
+                previous_end = method.end_lineno
+            if end > previous_end and any(line.strip() for line in lines[previous_end:end]):
+                chunks.append(_chunk(lines, previous_end + 1, end, CLASS, node.name))
+    return _fill_gaps(lines, chunks)
+
+
+def chunk_generic(content):
+    """
+    Lightweight splitting for the other languages: a chunk starts at every top-level definition
+    (a matching line with no indentation) and runs until the next one. Tiny neighbours are merged.
+    """
+    lines = content.splitlines()
+    starts = []
+    for number, line in enumerate(lines, start=1):
+        match = DEFINITION_RE.match(line)
+        if match:
+            keyword = match.group('keyword')
+            kind = CLASS if keyword in ('class', 'interface', 'struct', 'trait', 'impl') else FUNCTION
+            starts.append((number, kind, match.group('name')))
+    if not starts:
+        return [_chunk(lines, 1, len(lines), BLOCK)] if lines else []
+
+    chunks = []
+    if starts[0][0] > 1:
+        chunks.append(_chunk(lines, 1, starts[0][0] - 1, MODULE))
+    for index, (start, kind, name) in enumerate(starts):
+        end = starts[index + 1][0] - 1 if index + 1 < len(starts) else len(lines)
+        previous = chunks[-1] if chunks else None
+        if previous and previous["end_line"] - previous["start_line"] + 1 < MIN_CHUNK_LINES \
+                and end - previous["start_line"] < MAX_CHUNK_LINES:
+            # e.g. a run of one-line const declarations
+            merged_symbol = ', '.join(filter(None, [previous["symbol"], name]))
+            chunks[-1] = _chunk(lines, previous["start_line"], end, previous["kind"], merged_symbol)
+        else:
+            chunks.append(_chunk(lines, start, end, kind, name))
+    return chunks
+
+
+def chunk_file(path, content):
+    """Function / class level chunks of a file, none of them longer than MAX_CHUNK_LINES."""
+    if not content or not content.strip():
+        return []
+    chunks = None
+    if os.path.splitext(path)[1] == '.py':
+        try:
+            chunks = chunk_python(content)
+        except (SyntaxError, ValueError):
+            chunks = None
+    if chunks is None:
+        chunks = chunk_generic(content)
+    lines = content.splitlines()
+    return [part for chunk in chunks for part in _split_large(lines, chunk) if part["content"].strip()]
+
+
+def replace_file_chunks(files):
+    """
+    Rewrites the chunks of the given files.
+
+    Args:
+    files (list): (file_id, path, content) tuples.
+    """
+    if not files:
+        return
+    FileChunk.objects.filter(file_id__in=[file_id for file_id, _, _ in files]).delete()
+    FileChunk.objects.bulk_create(
+        [FileChunk(file_id=file_id, **chunk) for file_id, path, content in files for chunk in chunk_file(path, content)],
+        batch_size=500
+    )
@@ -0,0 +1,100 @@
+# code_reader/conversations.py
+
+from django.conf import settings
+from django.db import transaction
+
+from conversation.models import Conversation, Messages
+from code_reader import routing
+from code_reader.prompts import count_tokens
+from code_reader.utils import chat_completion
+
+
+def render_message(message):
+    return f"User: {message.user_message}\nAssistant: {message.ai_response}"
+
+
+def unsummarized_messages(conversation):
+    """Messages of the conversation not folded into its summary yet, oldest first."""
+    return list(Messages.objects.filter(conversation=conversation,
+                                        id__gt=conversation.state.get("summarized_through", 0)).order_by('id'))
+
+
+def recent_window(messages, max_tokens):
+    """The newest of messages (oldest first) fitting in max_tokens, at least the last one."""
+    window = []
+    tokens = 0
+    for message in reversed(messages):
+        tokens += count_tokens(render_message(message))
+        if window and tokens > max_tokens:
+            break
+        window.insert(0, message)
+    return window
+
+
+def conversation_history(conversation):
+    """
+    The conversation as put in the prompts: the summary of its older messages, then the latest
+    messages as they are, up to CODE_READER_CONVERSATION_WINDOW_TOKENS. No model call.
+    """
+    summary = conversation.state.get("summary") or "nothing till now"
+    window = recent_window(unsummarized_messages(conversation), settings.CODE_READER_CONVERSATION_WINDOW_TOKENS)
+    if not window:
+        return f"Summary of the conversation: {summary}"
+    recent = "\n\n".join(render_message(message) for message in window)
+    return f"Summary of the earlier conversation: {summary}\n\nLatest messages:\n{recent}"
+
+
+def record_exchange(conversation, user_message, ai_response):
+    """
+    Saves the question and answer. Once the messages not summarized yet outgrow the window, their
+    summarization is queued for after the commit, off the request.
+    """
+    message = Messages.objects.create(conversation=conversation, user_message=user_message, ai_response=ai_response)
+    pending = unsummarized_messages(conversation)
+    if sum(count_tokens(render_message(item)) for item in pending) > settings.CODE_READER_CONVERSATION_WINDOW_TOKENS:
+        transaction.on_commit(lambda: queue_summarization(conversation.id))
+    return message
+
+
+def queue_summarization(conversation_id):
+    """
+    Queues summarize_conversation. Best effort: the answer is already there, so an unreachable broker is
+    only logged, the messages stay in the window and are summarized with a later exchange.
+    """
+    from .tasks import summarize_conversation
+    try:
+        summarize_conversation.delay(conversation_id)
+    except Exception as e:
+        print(f"Could not queue the summary of conversation {conversation_id}: {e}")
+
+
+def summarize_older_messages(conversation):
+    """
+    Folds the unsummarized messages beyond half of the window into the summary, with one model call.
+    Keeping half a window of messages as they are leaves room for the next ones before another call.
+
+    Returns:
+        int: The number of messages folded into the summary.
+    """
+    pending = unsummarized_messages(conversation)
+    kept = recent_window(pending, settings.CODE_READER_CONVERSATION_WINDOW_TOKENS // 2)
+    older = pending[:len(pending) - len(kept)]
+    if not older:
+        return 0
+    summarized_through = conversation.state.get("summarized_through", 0)
+    prompt = (
+        f"Summary of the conversation so far:\n##{conversation.state.get('summary') or 'nothing till now'}##\n\n"
+        "Messages that followed:\n##" + "\n\n".join(render_message(message) for message in older) + "##\n\n"
+        "Update the summary with these messages. Keep what the user asked for, the decisions taken, "
+        "the files and commands mentioned and what is still open; drop the rest. Answer with the summary only."
+    )
+    summary = chat_completion(prompt, system_prompt="You summarize conversations.\n", route=routing.SUMMARIZATION)
+    with transaction.atomic():
+        conversation = Conversation.objects.select_for_update().get(id=conversation.id)
+        if conversation.state.get("summarized_through", 0) != summarized_through:
+            # summarized by another task meanwhile
+            return 0
+        conversation.state = {"summary": summary, "summarized_through": older[-1].id}
+        conversation.conversation_summary = str({'history': summary})
+        conversation.save(update_fields=['state', 'conversation_summary'])
+    return len(older)
@@ -1,17 +1,22 @@
 # executor/agent_functions.py
 
-import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import TypedDict, Optional, List, Union, Literal
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.agents import create_tool_calling_agent, AgentExecutor
-from langchain.memory import ConversationSummaryBufferMemory
 from langgraph.graph import END
+from django.conf import settings
+from django.db import connection
 
 from code_reader.executor.outputparser import PlannerResponse
 
 from code_reader.executor.tools import code_editor, terminal_executor, need_user_input, update_file_summary, read_file_content, \
     search_web_browser, update_project_root_dir_and_tree_structure, starting_new_tmux_session_for_running_service, wait_for_some_time
-from code_reader.executor.utils import llm, invoke_model
+from code_reader import routing
+from code_reader.executor.utils import invoke_model
+from code_reader.executor.context import ExecutionContext, use_context
+from code_reader.executor.assessment import ToolCallRecorder, assess_step, needs_feedback
 from code_reader.models import Project
 
 
@@ -28,14 +33,14 @@ class AgentState(TypedDict):
     project_id: str
     project_summary: str
     reference_file: str
-
-# Initialize memory
-summary_memory = ConversationSummaryBufferMemory(
-    llm=llm,
-    max_token_limit=300,
-)
-summary_memory.output_key = "Executor"
-summary_memory.input_key = "Planner"
+    # indexes of the plan steps the executor ran last, together, and their results
+    current_batch: List[int]
+    batch_results: List[str]
+    # why steps of the last batch need the feedback analyzer, and steps run since it last ran
+    step_issues: List[str]
+    steps_since_feedback: int
+    # working directory, tmux session, output and memory of this run
+    context: ExecutionContext
 
 
 #  - need_user_input: Use this when you need the user to provide additional information or clarification.
@@ -48,7 +53,9 @@ tools_info = """
       If there is any uncertainty about the file location or the filepath, 
       either infer the correct path from context or ask the user for clarification.\n
 
-    - terminal_executor: Use this to execute terminal commands. Input should be the command to run.\n
+    - terminal_executor: Use this to execute terminal commands. Input should be the command to run,
+      and optionally a timeout in seconds for commands expected to take long (installs, builds).
+      It returns once the command finished, with its real exit code.\n
 
     - search_web_browser: Use this tool when you need to browse the web for current or detailed information.
      Provide a well-crafted, specific query as a parameter to ensure accurate results. 
@@ -97,14 +104,17 @@ def planner(state: AgentState) -> AgentState:
         "2. Each step should be described in simple, clear language without omitting any crucial information.\n"
         "3. If the user query references specific files or paths, use these exact paths in the steps.\n"
         "4. Ensure the steps are detailed enough so that the executor agent, using its available tools, "
-        "can follow them without additional assumptions.\n\n"
+        "can follow them without additional assumptions.\n"
+        "5. Number the steps from 1 in `id` and list in `depends_on` the earlier steps each one needs. "
+        "Steps with no dependency on each other, like writing unrelated files, are executed in parallel; "
+        "terminal commands and anything relying on the output of another step must depend on it.\n\n"
         "Available tools for execution (for reference):\n"
         f"{tools_info}\n\n"
         "Additional context:\n"
         f"**Project Summary:** {project_summary}\n\n"
     )
 
-    response = invoke_model(prompt, PlannerResponse)
+    response = invoke_model(prompt, PlannerResponse, route=routing.PLANNING)
     # response = invoke_model(prompt, PlannerResponse)
     response_dict = response.model_dump()
 
@@ -145,23 +155,122 @@ def planner(state: AgentState) -> AgentState:
     })
     return state
 
+EXECUTOR_TOOLS = [code_editor, terminal_executor, need_user_input, update_project_root_dir_and_tree_structure,
+                  update_file_summary, search_web_browser, starting_new_tmux_session_for_running_service,
+                  wait_for_some_time, read_file_content]
+
+# Updated tool descriptions in the system prompt
+executor_prompt = ChatPromptTemplate.from_messages([
+    (
+        "system",
+        "I am an AI assistant that helps execute steps provided by the user using the tools available to me.\n\n"
+        "I always keep in mind the initial user request: ``{user_query}``\n"
+        "Until now, the summary of the previous execution is:\n##{summary}##\n"
+        "Project's current working directory: ``{current_directory}``\n"
+        "Project's tree structure: \n``{tree_structure}``\n"
+        "Current's project id: ``{project_id}``\n"
+        "Available tools:\n``{tools_info}``\n"
+        "My goal is to successfully execute the given steps by appropriately using these tools.\n"
+        "When the user provides a step description, determine the necessary actions and use the tools to perform them.\n"
+        "**Important:** I always carefully verify the correct relative paths when using the code_editor tool. "
+        "If I will be unsure about the file location or name, i ll ask the user for clarification before making any changes.\n"
+        "Will also provide a clear explanation for each action I take.\n"
+        "Also stop asking user, what else can be done. just reply with execution results and what happened.\n\n"
+    ),
+    ("human", "{input}"),
+    MessagesPlaceholder(variable_name="agent_scratchpad")
+]).partial(tools_info=tools_info)
+
+
+@lru_cache(maxsize=None)
+def get_agent_executor(escalated=False):
+    """
+    The tool calling agent of the executor steps, built once per process and model: the model of the
+    step route, or the escalation model. It holds no run data: the step, summary, directory and tree
+    are prompt variables given to invoke(), the tools find the run through current_context().
+    """
+    agent = create_tool_calling_agent(routing.route_chat_model(routing.STEP, escalated=escalated),
+                                      EXECUTOR_TOOLS, executor_prompt)
+    # the tool results come back in intermediate_steps, for assess_step
+    return AgentExecutor(agent=agent, tools=EXECUTOR_TOOLS, verbose=True, return_intermediate_steps=True)
+
+
+def next_batch(plan, start, max_size=None):
+    """
+    Indexes of the plan steps to execute together from start on: the consecutive steps that do not
+    depend on one another. A step without depends_on waits for the one before it, so a plain linear
+    plan runs one step at a time.
+    """
+    max_size = max_size or settings.CODE_READER_EXECUTOR_MAX_PARALLEL_STEPS
+    if start >= len(plan):
+        return []
+    batch = [start]
+    ids = {plan[start].get("id")}
+    for index in range(start + 1, min(len(plan), start + max_size)):
+        depends_on = plan[index].get("depends_on")
+        if depends_on is None or ids.intersection(depends_on):
+            break
+        batch.append(index)
+        ids.add(plan[index].get("id"))
+    return batch
+
+
+def continuation_input(step_input, tool_calls):
+    """The step input for the escalation model, with the tool calls the first attempt already made."""
+    calls = "\n".join(f"- {action.tool}({action.tool_input}) -> {str(observation)[:1000]}"
+                      for action, observation in tool_calls)
+    return (f"{step_input}\n\n"
+            "A first attempt at this step already made these tool calls, their effects (files written, commands run, "
+            "services started) are in place:\n"
+            f"{calls}\n"
+            "Do not repeat them. Check the current state where needed and continue the step from where it stopped.")
+
+
+def execute_step(context, inputs):
+    """
+    Runs one plan step through the agent; the tools find the run's directory and session through current_context().
+    A step the routed model fails, or gives up on at the iteration limit, goes to the escalation model: from
+    scratch when no tool was called yet, otherwise continuing after the tool calls already made, which are
+    never run twice.
+    """
+    with use_context(context):
+        if not routing.can_escalate(routing.STEP):
+            return get_agent_executor().invoke(inputs)
+        # the tool calls of the attempt, known even when it raises
+        recorder = ToolCallRecorder()
+        try:
+            result = get_agent_executor().invoke(inputs, config={"callbacks": [recorder]})
+            if not result['output'].startswith("Agent stopped due to"):
+                return result
+            print(f"Step stopped before finishing on {routing.route_model(routing.STEP)}, escalating")
+        except Exception as e:
+            print(f"Step failed on {routing.route_model(routing.STEP)}, escalating: {e}")
+        routing.route_metrics.escalated(routing.STEP)
+        done = recorder.steps
+        escalated_inputs = {**inputs, "input": continuation_input(inputs["input"], done)} if done else inputs
+        result = get_agent_executor(escalated=True).invoke(escalated_inputs)
+        # both attempts count for assess_step, the step stays the one of the plan
+        result["intermediate_steps"] = done + list(result.get("intermediate_steps") or [])
+        result["input"] = inputs["input"]
+        return result
+
+
+def execute_step_in_thread(context, inputs):
+    try:
+        return execute_step(context, inputs)
+    finally:
+        # the thread's own database connection, opened by the tools
+        connection.close()
+
+
 def executor(state: AgentState) -> AgentState:
     plan = state["plan"]
     current_step = state["current_step"]
 
-    if current_step < len(plan):
-        step_description = plan[current_step]
-        print(f"\nExecuting Step {current_step + 1}/{len(plan)}: {str(step_description)}\n")
-
-        tools = [code_editor, terminal_executor, need_user_input, update_project_root_dir_and_tree_structure,
-                 update_file_summary, search_web_browser, starting_new_tmux_session_for_running_service,
-                 wait_for_some_time, read_file_content]
-
-        summary_var = summary_memory.load_memory_variables({})
-        if 'history' in summary_var:
-            summary = summary_var.get('history')
-        else:
-            summary = str(summary_var)
+    batch = next_batch(plan, current_step)
+    if batch:
+        context = state["context"]
+        summary = context.memory_summary()
 
         # print("summary =========================>")
         # print(summary)
@@ -169,46 +278,49 @@ def executor(state: AgentState) -> AgentState:
         tree_structure = "not available right now in db, will be updated soon."
         if len(project.tree_structure) > 5:
             tree_structure = project.tree_structure
-        # Updated tool descriptions in the system prompt
-        prompt = ChatPromptTemplate.from_messages([
-            (
-                "system",
-                "I am an AI assistant that helps execute steps provided by the user using the tools available to me.\n\n"
-                "I always keep in mind the initial user request: ``{user_query}``\n"
-                "Until now, the summary of the previous execution is:\n##{summary}##\n"
-                "Project's current working directory: ``" + state['current_directory'] + "``\n"
-                "Project's tree structure: \n``" + tree_structure + "``\n"
-                "Current's project id: ``" + state['project_id'] + "``\n"
-                "Available tools:\n``" + tools_info + "``\n"
-                "My goal is to successfully execute the given steps by appropriately using these tools.\n"
-                "When the user provides a step description, determine the necessary actions and use the tools to perform them.\n"
-                "**Important:** I always carefully verify the correct relative paths when using the code_editor tool. "
-                "If I will be unsure about the file location or name, i ll ask the user for clarification before making any changes.\n"
-                "Will also provide a clear explanation for each action I take.\n"
-                "Also stop asking user, what else can be done. just reply with execution results and what happened.\n\n"
-            ),
-            ("human", "{input}"),
-            MessagesPlaceholder(variable_name="agent_scratchpad")
-        ])
-
-        agent = create_tool_calling_agent(llm, tools, prompt)
-        agent_executor = AgentExecutor(agent=agent, tools=tools, verbose=True)
-        result = agent_executor.invoke(
-            {"input": f"{str(step_description)}", "summary": summary, "user_query": state["user_query"]}
-        )
-        print("Agent Result:", result['output'])
-        # print("Current working directory", os.getcwd())
+
+        inputs = []
+        for index in batch:
+            step_description = plan[index]
+            print(f"\nExecuting Step {index + 1}/{len(plan)}: {str(step_description)}\n")
+            inputs.append({
+                "input": f"{str(step_description)}", "summary": summary, "user_query": state["user_query"],
+                "current_directory": state['current_directory'], "tree_structure": tree_structure,
+                "project_id": state['project_id']
+            })
+        if len(batch) == 1:
+            results = [execute_step(context, inputs[0])]
+        else:
+            # independent steps, e.g. edits of unrelated files, run at the same time
+            with ThreadPoolExecutor(max_workers=len(batch)) as pool:
+                results = list(pool.map(lambda step_inputs: execute_step_in_thread(context, step_inputs), inputs))
+
+        issues = []
+        for index, result in zip(batch, results):
+            print("Agent Result:", result['output'])
+            # exit codes and errors of the tools, the tool results themselves stay out of the prompts
+            issue = assess_step(result)
+            result.pop("intermediate_steps", None)
+            if issue:
+                issues.append(f"Step {index + 1}: {issue}")
+            if len(state["feedback"]) > 4:
+                state["feedback"] = (state["feedback"][:4] +
+                                     [{f"Step_{index}": result['input'], "execution_result_by_agent": result['output']}])
+            else:
+                state["feedback"].append({f"step_{index}": result['input'], "execution_result_by_agent": result['output']})
+            context.memory.save_context({"Planner": f"{plan[index]['title']}"}, {"Executor": result['output']})
+        # print("Current working directory", context.working_directory)
         # Store the execution result in the state
-        execution_result = result
-        if len(state["feedback"]) > 4:
-            state["feedback"] = (state["feedback"][:4] +
-                                 [{f"Step_{current_step}": result['input'], "execution_result_by_agent": result['output']}])
+        if len(batch) == 1:
+            state['execution_result'] = str(results[0])
         else:
-            state["feedback"].append({f"step_{current_step}": result['input'], "execution_result_by_agent": result['output']})
-        state['execution_result'] = str(execution_result)
-        state['current_directory'] = os.getcwd()
-
-        summary_memory.save_context({"Planner": f"{step_description['title']}"}, {"Executor": execution_result['output']})
+            state['execution_result'] = "\n\n".join(
+                f"Step {index + 1}: {result}" for index, result in zip(batch, results)
+            )
+        state['current_batch'] = batch
+        state['step_issues'] = issues
+        state['batch_results'] = [result['output'] for result in results]
+        state['current_directory'] = context.working_directory
     else:
         print("All steps have been executed.")
     return state
@@ -218,23 +330,34 @@ def feedback_analyzer(state: AgentState) -> AgentState:
     execution_result = state.get("execution_result", "")
     current_step = state.get("current_step", 0)
     plan = state.get("plan", [])
+    # the steps executed last, analyzed together
+    batch = state.get("current_batch") or [current_step]
+    batch_end = batch[-1] + 1
 
     if not execution_result:
         execution_result = "No execution result available."
         # Decide whether to halt or proceed; for now, proceed to the next step
-        state["current_step"] = current_step + 1
+        state["current_step"] = batch_end
         return state
 
+    issues = state.get("step_issues") or []
+    steps_since_feedback = state.get("steps_since_feedback", 0) + len(batch)
+    if not needs_feedback(issues, steps_since_feedback, batch_end, len(plan)):
+        # the tools all reported success, the plan goes on as it is
+        print(f"Steps {[index + 1 for index in batch]} succeeded, plan kept without analysis")
+        state["steps_since_feedback"] = steps_since_feedback
+        state["current_step"] = batch_end
+        return state
+    state["steps_since_feedback"] = 0
+
     # Retrieve the step description
-    if current_step < len(plan):
+    if len(batch) > 1:
+        step_description = [plan[index] for index in batch]
+    elif current_step < len(plan):
         step_description = plan[current_step]
     else:
         step_description = "Unknown step."
-    summary_var = summary_memory.load_memory_variables({})
-    if 'history' in summary_var:
-        summary = summary_var.get('history')
-    else:
-        summary = str(summary_var)
+    summary = state["context"].memory_summary()
     # print("summary =========================>")
     # print(summary)
 
@@ -248,11 +371,11 @@ def feedback_analyzer(state: AgentState) -> AgentState:
         f"Current Working Directory: ``{state['current_directory']}``\n\n"
         "Please analyze the following details to assess whether the current task step was successfully completed:\n\n"
         f"**Previous Steps Descriptions:** ##{str(plan_titles[:current_step])}##\n"
-        f"Request and results of few Previous Executions:\n##{str(state['feedback'])}##\n\n"
         f"**Current Step Description:** ##{step_description}##\n"
-        f"**Current Step Execution done by Agent:** ##{execution_result}##\n\n"
+        f"**Current Step Execution done by Agent:** ##{execution_result}##\n"
+        f"**Issues found in the tool results:** ##{issues or 'none'}##\n\n"
         "After reviewing the current step, consider the upcoming steps:\n"
-        f"##{str(plan[current_step + 1:])}##\n\n"
+        f"##{str(plan[batch_end:])}##\n\n"
         "Your goal:\n"
         "1. Determine if the current step has been successfully completed, also check based on the last executing what we are going to do next is right or not.\n"
         "2. If additional actions or modifications are needed before proceeding, propose new steps or modifications.\n\n"
@@ -262,6 +385,8 @@ def feedback_analyzer(state: AgentState) -> AgentState:
         "- Do not use tool for updating file information before committing changes based on the user input, unless the user query explicitly requests it.\n"
         "- If you are stuck in some problem and you are not able to solve it,try using search_web_browser tool to find solution.\n"
         "- If user want you to stop the execution of the plan, then remove all the steps and pass empty plan.\n"
+        "- Number the steps of the rewritten plan from 1 in `id`, and set `depends_on` as the planner does, "
+        "so that independent steps can run in parallel.\n"
         
         # "- Always check if user was asked whether to git commit the changes in the end atleast once.\n\n"
         "\n\n"
@@ -270,7 +395,8 @@ def feedback_analyzer(state: AgentState) -> AgentState:
         "Please provide a clear, logically reasoned assessment and, if necessary, an updated plan."
     )
 
-    response = invoke_model(prompt, PlannerResponse)
+    # a cheap model unsure of its assessment hands it over to the escalation model
+    response = invoke_model(prompt, PlannerResponse, route=routing.FEEDBACK, escalate_if=routing.low_confidence)
     print("Feedback Analyzer Response:", response.model_dump())
 
     further_steps = response.model_dump().get("steps", [])
@@ -278,10 +404,10 @@ def feedback_analyzer(state: AgentState) -> AgentState:
     print("\n".join(get_plan_title_array(further_steps)))
     if further_steps:
         # Insert the additional steps into the plan after the current step
-        plan = plan[:current_step + 1] + further_steps
+        plan = plan[:batch_end] + further_steps
         state["plan"] = plan
 
-    state["current_step"] = current_step + 1
+    state["current_step"] = batch_end
     return state
 
 def completion_check(state: AgentState) -> Union[str, Literal[END]]:
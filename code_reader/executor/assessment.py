@@ -0,0 +1,82 @@
+# executor/assessment.py
+
+from langchain_core.agents import AgentAction
+from langchain_core.callbacks import BaseCallbackHandler
+from django.conf import settings
+
+# prefix of the error strings the tools return instead of raising
+TOOL_ERROR_PREFIX = "An error occurred"
+# tools whose use changes what the rest of the plan should be, whatever their result
+REPLANNING_TOOLS = {"need_user_input", "update_project_root_dir_and_tree_structure"}
+
+
+class ToolCallRecorder(BaseCallbackHandler):
+    """
+    The tool calls of one agent run as (AgentAction, observation) pairs, like its intermediate_steps,
+    but also kept when the run raises before returning them.
+    """
+
+    def __init__(self):
+        self.steps = []
+        self._pending = {}
+
+    def on_tool_start(self, serialized, input_str, *, run_id, inputs=None, **kwargs):
+        self._pending[run_id] = AgentAction(tool=(serialized or {}).get("name", ""), tool_input=inputs or input_str, log="")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        action = self._pending.pop(run_id, None)
+        if action:
+            self.steps.append((action, output))
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        action = self._pending.pop(run_id, None)
+        if action:
+            self.steps.append((action, f"{TOOL_ERROR_PREFIX}: {error}"))
+
+
+def tool_issue(tool, observation):
+    """Why the result of one tool call needs a look from the feedback analyzer, None if it plainly worked."""
+    if tool in REPLANNING_TOOLS:
+        return f"{tool} was used"
+    if isinstance(observation, dict):
+        # terminal_executor: the exit code is null when the command was still running at its timeout
+        exit_code = observation.get("exit_code")
+        if exit_code is None:
+            return f"{tool} command did not finish"
+        if exit_code != 0:
+            return f"{tool} command exited with code {exit_code}"
+        return None
+    observation = str(observation)
+    if observation.startswith(TOOL_ERROR_PREFIX) or "is not a valid tool" in observation:
+        return f"{tool} failed: {observation[:200]}"
+    if tool == "starting_new_tmux_session_for_running_service" and "exited with code" in observation:
+        return f"{tool}: the service exited"
+    return None
+
+
+def assess_step(result):
+    """
+    Checks the outcome of an executor step from its tool results (the agent's intermediate steps).
+
+    Returns:
+        str: Why the feedback analyzer should look at the step, None when it clearly succeeded.
+    """
+    if result.get("output", "").startswith("Agent stopped due to"):
+        return "the agent stopped before finishing the step"
+    actions = result.get("intermediate_steps") or []
+    if not actions:
+        return "no tool was used"
+    for action, observation in actions:
+        issue = tool_issue(action.tool, observation)
+        if issue:
+            return issue
+    return None
+
+
+def needs_feedback(issues, steps_since_feedback, batch_end, plan_length):
+    """
+    Whether the feedback analyzer (an LLM call) should run after a batch of steps: when one of them had
+    an issue, every CODE_READER_FEEDBACK_EVERY_STEPS steps, and after the last step of the plan.
+    """
+    every = settings.CODE_READER_FEEDBACK_EVERY_STEPS
+    return bool(issues) or every <= 1 or steps_since_feedback >= every or batch_end >= plan_length
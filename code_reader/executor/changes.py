@@ -0,0 +1,146 @@
+# executor/changes.py
+
+import os
+import threading
+
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from code_reader.ignore import walk_repo
+from code_reader.utils import get_ignore_matcher
+
+try:
+    from watchdog.observers.inotify_c import Inotify, InotifyConstants
+
+    # what changes the content of the repo, not the opens and reads of the commands
+    WATCHED_EVENTS = (InotifyConstants.IN_CREATE | InotifyConstants.IN_DELETE | InotifyConstants.IN_MODIFY
+                      | InotifyConstants.IN_CLOSE_WRITE | InotifyConstants.IN_MOVED_FROM
+                      | InotifyConstants.IN_MOVED_TO)
+except Exception:
+    # not on Linux, the platform observer of watchdog is used
+    Inotify = None
+
+
+class ChangeTracker(FileSystemEventHandler):
+    """
+    Paths created, modified, moved or deleted during an executor run: recorded by the tools that write
+    files, and by watching the repo for what the terminal commands do. Ignored paths (node_modules,
+    venv, .git...) are dropped as they come so an install does not flood it.
+
+    On Linux one inotify instance watches the directories kept by the ignore rules, each without
+    recursion, and new directories get a watch as they appear: ignored trees are never walked nor
+    watched, so they cost no inotify watches. Elsewhere a recursive watchdog observer is used, the
+    platform APIs there watch a tree with a single handle.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.realpath(root)
+        self.matcher = get_ignore_matcher(self.root)
+        self.paths = set()
+        self._lock = threading.Lock()
+        self._observer = None
+        self._inotify = None
+        self._reader = None
+        self.watched = set()
+
+    def record(self, path):
+        path = os.path.realpath(path)
+        if not path.startswith(self.root + os.sep):
+            return
+        if self.matcher.is_ignored_path(os.path.relpath(path, self.root).replace(os.sep, '/')):
+            return
+        with self._lock:
+            self.paths.add(path)
+
+    def on_any_event(self, event):
+        if event.is_directory and event.event_type not in ('deleted', 'moved'):
+            # a directory mtime bump or creation, the files in it have their own events (watchdog also
+            # emits them for a directory moved in from outside), recording the directory would
+            # refresh its whole subtree
+            return
+        if event.event_type in ('opened', 'closed_no_write'):
+            return
+        self.record(event.src_path)
+        if getattr(event, 'dest_path', ''):
+            self.record(event.dest_path)
+
+    def watch_tree(self, directory):
+        """
+        Adds a watch on directory and on its directories kept by the ignore rules.
+
+        Returns:
+            list: The files already in them.
+        """
+        files = []
+        for path, _, _, file_names in walk_repo(self.root, self.matcher, directory):
+            try:
+                self._inotify.add_watch(os.fsencode(path))
+            except OSError as e:
+                # e.g. the inotify watch limit is reached, the files written by the tools are still tracked
+                print(f"Could not watch {path} for changes: {e}")
+                return files
+            self.watched.add(path)
+            files.extend(os.path.join(path, name) for name in file_names)
+        return files
+
+    def on_inotify_event(self, event):
+        path = os.fsdecode(event.src_path)
+        if event.is_directory:
+            if event.is_create:
+                # the files created before the new watch was in place have no event of their own
+                for file in self.watch_tree(path):
+                    self.record(file)
+            elif event.is_moved_to:
+                # the moved directory stands for the files under it
+                self.watch_tree(path)
+                self.record(path)
+            elif event.is_delete or event.is_moved_from:
+                self.record(path)
+            return
+        self.record(path)
+
+    def _read_events(self, inotify):
+        # stop() closes the instance, read_events then returns with nothing
+        while self._inotify is inotify:
+            try:
+                events = inotify.read_events()
+            except Exception as e:
+                print(f"Stopped watching {self.root} for changes: {e}")
+                return
+            for event in events:
+                self.on_inotify_event(event)
+
+    def start(self):
+        if Inotify is not None:
+            try:
+                self._inotify = Inotify(os.fsencode(self.root), event_mask=WATCHED_EVENTS)
+                self.watch_tree(self.root)
+                self._reader = threading.Thread(target=self._read_events, args=(self._inotify,),
+                                                name="change-tracker", daemon=True)
+                self._reader.start()
+            except Exception as e:
+                print(f"Could not watch {self.root} for changes: {e}")
+                self._inotify = None
+            return self
+        try:
+            self._observer = Observer()
+            self._observer.schedule(self, self.root, recursive=True)
+            self._observer.start()
+        except Exception as e:
+            # the files written by the tools are still tracked
+            print(f"Could not watch {self.root} for changes: {e}")
+            self._observer = None
+        return self
+
+    def stop(self):
+        """Stops watching and returns the changed paths, sorted."""
+        if self._inotify is not None:
+            inotify, self._inotify = self._inotify, None
+            inotify.close()
+            self._reader.join(timeout=5)
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
+        with self._lock:
+            return sorted(self.paths)
@@ -0,0 +1,85 @@
+# executor/context.py
+
+import contextvars
+import os
+import threading
+from contextlib import contextmanager
+
+from langchain.memory import ConversationSummaryBufferMemory
+
+from code_reader import routing
+from code_reader.executor.tailer import OutputBuffer
+from code_reader.executor.changes import ChangeTracker
+
+
+class ExecutionContext:
+    """
+    Everything one executor run works on: its working directory, its tmux session and the output
+    captured from it, and the memory of the steps executed so far. Runs never share one, so several
+    can go on in parallel threads of the same process.
+    """
+
+    def __init__(self, project_id, working_directory, on_event=None):
+        self.project_id = str(project_id)
+        self.working_directory = os.path.abspath(working_directory)
+        self.session_name = None
+        # filled by the tailer of the session, drained by the terminal tools
+        self.output_buffer = OutputBuffer()
+        # steps executed in parallel share the session, their commands take turns
+        self.terminal_lock = threading.Lock()
+        # sessions started by the run to keep a service up: name -> output buffer
+        self.service_sessions = {}
+        # files changed by the run, refreshed in the index once it is over
+        self.changes = ChangeTracker(self.working_directory)
+        self.memory = ConversationSummaryBufferMemory(llm=routing.route_chat_model(routing.SUMMARIZATION),
+                                                      max_token_limit=300)
+        self.memory.output_key = "Executor"
+        self.memory.input_key = "Planner"
+        # on_event(event, data) of call_executor, for progress reported from inside the tools
+        self.on_event = on_event
+        self._event_lock = threading.Lock()
+
+    def resolve(self, path):
+        """Absolute path of a path relative to the working directory of the run."""
+        return os.path.abspath(os.path.join(self.working_directory, os.path.expanduser(path)))
+
+    def change_directory(self, path):
+        self.working_directory = self.resolve(path)
+        return self.working_directory
+
+    def take_output(self, buffer=None):
+        """Output captured since the last call, cleared."""
+        return (self.output_buffer if buffer is None else buffer).drain()
+
+    def emit(self, event, data):
+        if self.on_event:
+            # parallel steps report from their own threads
+            with self._event_lock:
+                self.on_event(event, data)
+
+    def memory_summary(self):
+        summary_var = self.memory.load_memory_variables({})
+        if 'history' in summary_var:
+            return summary_var.get('history')
+        return str(summary_var)
+
+
+_current_context = contextvars.ContextVar('execution_context', default=None)
+
+
+def current_context():
+    """The ExecutionContext of the run the calling tool belongs to."""
+    context = _current_context.get()
+    if context is None:
+        raise RuntimeError("No executor run in progress.")
+    return context
+
+
+@contextmanager
+def use_context(context):
+    """Makes context the current_context() of the code run inside the block (tools included)."""
+    token = _current_context.set(context)
+    try:
+        yield context
+    finally:
+        _current_context.reset(token)
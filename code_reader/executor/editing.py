@@ -0,0 +1,55 @@
+# executor/editing.py
+
+import difflib
+
+
+class EditConflict(ValueError):
+    """A search block of an edit that is not found in the code, or found more than once."""
+
+
+def find_block(content, search):
+    """
+    Start and end offsets of the only occurrence of search in content. When the exact text is not there,
+    lines are compared without their trailing whitespace, which models tend to get wrong.
+    """
+    count = content.count(search)
+    if count == 1:
+        start = content.index(search)
+        return start, start + len(search)
+    if count > 1:
+        raise EditConflict(f"search block found {count} times: {search[:200]!r}")
+
+    lines = content.splitlines(keepends=True)
+    wanted = [line.rstrip() for line in search.strip('\n').splitlines()]
+    if not wanted:
+        raise EditConflict("empty search block")
+    stripped = [line.rstrip() for line in lines]
+    matches = [i for i in range(len(lines) - len(wanted) + 1) if stripped[i:i + len(wanted)] == wanted]
+    if len(matches) != 1:
+        raise EditConflict(f"search block found {len(matches)} times: {search[:200]!r}")
+    start = sum(len(line) for line in lines[:matches[0]])
+    end = start + sum(len(line) for line in lines[matches[0]:matches[0] + len(wanted)])
+    if lines[matches[0] + len(wanted) - 1].endswith('\n') and not search.endswith('\n'):
+        # keep the line break the search block did not include
+        end -= 1
+    return start, end
+
+
+def apply_edits(content, edits):
+    """
+    Applies search / replace blocks ({"search", "replace"} dicts) one after the other.
+
+    Raises:
+        EditConflict: If a search block does not match exactly one place; nothing is applied then.
+    """
+    for edit in edits:
+        if not edit["search"]:
+            raise EditConflict("empty search block")
+        start, end = find_block(content, edit["search"])
+        content = content[:start] + edit["replace"] + content[end:]
+    return content
+
+
+def unified_diff(path, before, after):
+    return ''.join(difflib.unified_diff(before.splitlines(keepends=True), after.splitlines(keepends=True),
+                                        fromfile=path, tofile=path))
@@ -2,34 +2,24 @@
 
 import os
 import platform
+from functools import lru_cache
 from langgraph.graph import StateGraph, END
 from dotenv import load_dotenv
 load_dotenv()
 
-from code_reader.executor.agent_functions import planner, executor, feedback_analyzer, completion_check, AgentState
+from code_reader.executor.agent_functions import planner, executor, feedback_analyzer, completion_check, AgentState, \
+    next_batch
 from code_reader.executor.utils import start_tmux_session_with_logging, kill_tmux_session
+from code_reader.executor.context import ExecutionContext
 
 
 
-def call_executor(directory, user_request, project_obj, BASE_DIR, reference_file=''):
-    WORKING_DIRECTORY = directory
-    print("project_obj: ")
-    print(project_obj)
-    try:
-        os.chdir(WORKING_DIRECTORY)
-        print(f"Changed working directory to: {os.getcwd()}")
-    except Exception as e:
-        print(f"Failed to change directory: {e}")
-        exit(1)
-
-    # if platform.system() != 'Darwin':
-    #     print("This script uses AppleScript to open a new Terminal window and is only compatible with macOS.")
-    #     return
-
-    # Set the working directory
-    directory = WORKING_DIRECTORY
-    _, session_name = start_tmux_session_with_logging(directory, project_obj.name)
-
+@lru_cache(maxsize=1)
+def get_graph():
+    """
+    The planner / executor workflow, compiled once per process. Runs differ only by the state they
+    start from, their ExecutionContext included.
+    """
     # === Create and Compile Workflow ===
     workflow = StateGraph(AgentState)
     workflow.set_entry_point("planner")
@@ -50,7 +40,48 @@ def call_executor(directory, user_request, project_obj, BASE_DIR, reference_file
         }
     )
     # Compile the graph
-    graph = workflow.compile()
+    return workflow.compile()
+
+
+def report_progress(on_event, node, state):
+    """Turns the state returned by a graph node into progress events: plan created, steps started / finished."""
+    plan = state.get("plan", [])
+    current_step = state.get("current_step", 0)
+    if node == "planner":
+        on_event("plan_created", {"steps": [step.get("title") for step in plan]})
+    elif node == "executor":
+        for index, result in zip(state.get("current_batch", []), state.get("batch_results", [])):
+            on_event("step_finished", {
+                "step": index + 1, "title": plan[index].get("title") if index < len(plan) else None,
+                "result": str(result)[:2000]
+            })
+        return
+    for index in next_batch(plan, current_step):
+        on_event("step_started", {"step": index + 1, "of": len(plan), "title": plan[index].get("title")})
+
+
+def call_executor(directory, user_request, project_obj, reference_file='', on_event=None):
+    """
+    Runs the planner / executor graph on the user request in a tmux session opened in directory.
+    The run keeps its state in its own ExecutionContext (the process cwd is left alone), so several
+    runs can go on in parallel.
+    on_event(event, data), when given, is called with the progress of the run.
+    """
+    print("project_obj: ")
+    print(project_obj)
+    if not os.path.isdir(directory):
+        raise ValueError(f"Working directory {directory} does not exist.")
+
+    # if platform.system() != 'Darwin':
+    #     print("This script uses AppleScript to open a new Terminal window and is only compatible with macOS.")
+    #     return
+
+    context = ExecutionContext(project_obj.id, directory, on_event=on_event)
+    _, session_name = start_tmux_session_with_logging(directory, project_obj.name, context.output_buffer)
+    context.session_name = session_name
+    context.changes.start()
+
+    graph = get_graph()
 
     # User query
     user_query = f"""
@@ -106,36 +137,35 @@ def call_executor(directory, user_request, project_obj, BASE_DIR, reference_file
         session_name=session_name,
         project_id=str(project_obj.id),
         project_summary=project_obj.summary,
-        reference_file=reference_file
+        reference_file=reference_file,
+        current_batch=[],
+        batch_results=[],
+        step_issues=[],
+        steps_since_feedback=0,
+        context=context
     )
 
-    # Run the state graph
+    # Run the state graph, node by node so that progress can be reported
     try:
-        graph.invoke(initial_state, config={"recursion_limit": 100})
+        for update in graph.stream(initial_state, config={"recursion_limit": 100}, stream_mode="updates"):
+            for node, state in update.items():
+                if on_event and state:
+                    report_progress(on_event, node, state)
     except Exception as e:
         print(f"Error during workflow execution: {e}")
-    print("finished with graph\n\n\n")
-
-
-    try:
-        os.chdir(BASE_DIR)
-        print(f"Changed working directory to: {os.getcwd()}")
-    except Exception as e:
-        print(f"Failed to change directory: {e}")
-        exit(1)
-
-
-    # flag = True
-    # while flag:
-    #     user_input = input(f"Do you want to kill the tmux session '{session_name}'? (yes/no): ").strip().lower()
-    #     if user_input in ["yes", "y"]:
-    #         killed = kill_tmux_session(session_name)
-    #         flag = not killed
-    #     elif user_input in ["no", "n"]:
-    #         print(f"The tmux session '{session_name}' was not killed.")
-    #         flag = False
-    #     else:
-    #         print("Invalid input. Please enter 'yes' or 'no'.")
-    kill_tmux_session(session_name)
+        if on_event:
+            on_event("executor_error", {"error": str(e)})
+        # the job is marked failed by its task
+        raise
+    finally:
+        print("finished with graph\n\n\n")
+        # the session and the file watcher go away whether the run went through or not
+        kill_tmux_session(session_name)
+
+        # what the run wrote is summarized, chunked and embedded in the background
+        changed_paths = context.changes.stop()
+        if changed_paths:
+            print(f"{len(changed_paths)} files changed during the run, refreshing them")
+            project_obj.refresh_files(changed_paths)
 
     return "done"
\ No newline at end of file
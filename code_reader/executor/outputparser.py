@@ -1,24 +1,42 @@
 from pydantic import BaseModel, Field
-from typing import List
+from typing import List, Optional
 
 class CommandResponse(BaseModel):
     command: str = Field(description="The terminal command to be executed.")
     explanation: str = Field(description="Max 5-line explanation of why the command is needed.")
 
 class Step(BaseModel):
+    id: int = Field(default=0, description="number of the step in this plan, starting at 1")
     title: str = Field(description="summarizing the step in 1-2 lines")
     detailed_description: str = Field(description="=`detailed_description` with all necessary details.")
     psuedo_code: str = Field(description="`psuedo_code` field outlining the flow if code writing is involved.")
     code_snippet: str = Field(description="`code_snippet` field with a concrete code example if code writing is involved.")
+    depends_on: Optional[List[int]] = Field(
+        default=None,
+        description="ids of the earlier steps of this plan that must be done before this one. "
+                    "[] if it needs none of them, e.g. editing a file no other pending step touches, "
+                    "so that it can run in parallel with them. null when unsure: it then waits for the step before it."
+    )
 
 class PlannerResponse(BaseModel):
     steps: List[Step] = Field(description="A list of detailed steps explaining what needs to be done without missing any details. "
                                           "If code is not relevant for a particular step, leave `psuedo_code` and `code_snippet` fields empty."
                                           "Make sure no essential details are missed. Provide a comprehensive, logically ordered plan.")
+    confidence: float = Field(default=1.0, description="from 0 to 1, how sure you are that this plan, and the assessment "
+                                                       "of the steps executed so far if any, are right.")
 
 class CodeUpdateResponse(BaseModel):
     updated_code: str = Field(description="The updated or new code generated based on the feedback.")
 
+class CodeEdit(BaseModel):
+    search: str = Field(description="exact lines of the current code to replace, copied verbatim with their indentation, "
+                                    "with enough surrounding lines to appear only once in the file.")
+    replace: str = Field(description="the lines that replace them, empty to delete them.")
+
+class CodeEditResponse(BaseModel):
+    edits: List[CodeEdit] = Field(description="search / replace blocks applied to the current code in order. "
+                                              "Only the changed parts, never the whole file.")
+
 class FeedbackResponse(BaseModel):
     feedback: str = Field(description="Feedback on whether the task was successfully executed or not.")
 
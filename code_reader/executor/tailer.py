@@ -0,0 +1,174 @@
+# executor/tailer.py
+
+import codecs
+import collections
+import os
+import select
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from django.conf import settings
+
+
+class OutputBuffer:
+    """
+    Output of a tmux session, appended by its tailer and drained by the tools. Holds at most max_chars characters:
+    the oldest output is dropped first, so a chatty service left running cannot grow it without bound.
+    """
+
+    def __init__(self, max_chars=None):
+        self.max_chars = max_chars or settings.CODE_READER_SESSION_OUTPUT_MAX_CHARS
+        self._chunks = collections.deque()
+        self.size = 0
+        self.dropped_chars = 0
+        self._lock = threading.Lock()
+        self._appended = threading.Condition(self._lock)
+
+    def append(self, text):
+        with self._lock:
+            self._chunks.append(text)
+            self.size += len(text)
+            while self.size > self.max_chars and len(self._chunks) > 1:
+                dropped = self._chunks.popleft()
+                self.size -= len(dropped)
+                self.dropped_chars += len(dropped)
+            if self.size > self.max_chars:
+                # a single chunk over the cap keeps its tail
+                text = self._chunks.pop()
+                self._chunks.append(text[-self.max_chars:])
+                self.dropped_chars += len(text) - self.max_chars
+                self.size = self.max_chars
+            self._appended.notify_all()
+
+    def drain(self):
+        """Output appended since the last call, cleared."""
+        with self._lock:
+            output = ''.join(self._chunks)
+            self._chunks.clear()
+            self.size = 0
+        return output
+
+    def wait(self, timeout):
+        """Blocks until there is output to drain or timeout seconds have passed."""
+        with self._lock:
+            return self._appended.wait_for(lambda: self._chunks, timeout)
+
+    def __len__(self):
+        return self.size
+
+
+class LogTailer:
+    """
+    Reads the pane output of a tmux session through a FIFO given to `tmux pipe-pane`: the thread blocks
+    in select() until output or stop() comes, nothing is polled and no log file grows on disk.
+    Complete lines are appended to the buffer as they come, a trailing partial line (a prompt waiting
+    for input) once the pane stayed quiet for PARTIAL_LINE_DELAY seconds.
+    """
+
+    PARTIAL_LINE_DELAY = 0.2
+    # while idle, how often to check that the session still exists, in case it was killed outside of us
+    LIVENESS_INTERVAL = 30
+
+    def __init__(self, session_name, output_buffer):
+        self.session_name = session_name
+        self.output_buffer = output_buffer
+        self._directory = tempfile.mkdtemp(prefix='tmux-pane-')
+        self._fifo_path = os.path.join(self._directory, 'pane.fifo')
+        os.mkfifo(self._fifo_path)
+        # opened read-write so that the FIFO never reports EOF between the writers tmux starts
+        self._fifo = os.open(self._fifo_path, os.O_RDWR | os.O_NONBLOCK)
+        self._stop_read, self._stop_write = os.pipe()
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._thread = threading.Thread(target=self.run, name=f'tailer-{session_name}', daemon=True)
+        self._closed = False
+        self._close_lock = threading.Lock()
+
+    def start(self):
+        subprocess.run(['tmux', 'pipe-pane', '-o', '-t', self.session_name, f'cat >> {self._fifo_path}'], check=True)
+        self._thread.start()
+        return self
+
+    def run(self):
+        partial = ''
+        try:
+            while True:
+                timeout = self.PARTIAL_LINE_DELAY if partial else self.LIVENESS_INTERVAL
+                readable, _, _ = select.select([self._fifo, self._stop_read], [], [], timeout)
+                if self._stop_read in readable:
+                    break
+                if not readable:
+                    if partial:
+                        self.emit(partial)
+                        partial = ''
+                    elif not session_exists(self.session_name):
+                        print(f"Session '{self.session_name}' is gone, stopping its tailer")
+                        break
+                    continue
+                try:
+                    data = os.read(self._fifo, 65536)
+                except BlockingIOError:
+                    continue
+                text = partial + self._decoder.decode(data)
+                lines, _, partial = text.rpartition('\n')
+                if lines:
+                    self.emit(lines + '\n')
+            if partial:
+                self.emit(partial)
+        finally:
+            self.close()
+
+    def emit(self, text):
+        print(text, end='')  # Print the output to the console
+        self.output_buffer.append(text)
+
+    def stop(self):
+        """Ends the thread; it closes the FIFO and removes it on its way out."""
+        with self._close_lock:
+            if not self._closed:
+                os.write(self._stop_write, b'x')
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout=5)
+
+    def close(self):
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            for fd in (self._fifo, self._stop_read, self._stop_write):
+                os.close(fd)
+        shutil.rmtree(self._directory, ignore_errors=True)
+        with _tailers_lock:
+            if _tailers.get(self.session_name) is self:
+                del _tailers[self.session_name]
+
+
+def session_exists(session_name):
+    return subprocess.run(['tmux', 'has-session', '-t', session_name], capture_output=True).returncode == 0
+
+
+# session name -> its LogTailer, one per session
+_tailers = {}
+_tailers_lock = threading.Lock()
+
+
+def start_log_tailer(session_name, output_buffer):
+    tailer = LogTailer(session_name, output_buffer)
+    with _tailers_lock:
+        previous = _tailers.pop(session_name, None)
+        _tailers[session_name] = tailer
+    if previous:
+        previous.stop()
+    try:
+        return tailer.start()
+    except Exception:
+        tailer.close()
+        raise
+
+
+def stop_log_tailer(session_name):
+    with _tailers_lock:
+        tailer = _tailers.get(session_name)
+    if tailer:
+        tailer.stop()
@@ -5,48 +5,80 @@ import time
 from langchain_core.tools import tool
 from langchain_community.utilities import SerpAPIWrapper
 from typing import Dict, Any
-from code_reader.executor.utils import send_command_to_tmux, invoke_model, start_tmux_session_with_logging
-from code_reader.executor.outputparser import CodeUpdateResponse
+from code_reader import routing
+from code_reader.executor.utils import run_command_in_tmux, invoke_model, start_tmux_session_with_logging
+from code_reader.executor.context import current_context
+from code_reader.executor.tailer import OutputBuffer
+from code_reader.executor.outputparser import CodeUpdateResponse, CodeEditResponse
+from code_reader.executor.editing import EditConflict, apply_edits, unified_diff
 from code_reader.models import Project
 from code_reader.utils import run_file_summarizer, get_filtered_tree
+from code_reader.tree import tree_cache
 from django.conf import settings
 
 
+class CommandOutputReporter:
+    """
+    Passes the output of a running command on to the progress of the run as 'command_output' events,
+    at most one per interval so that a chatty command does not save the job on every line. Each event
+    carries the last tail_size characters of the output so far; the job keeps only the latest one.
+    """
+
+    def __init__(self, context, command, interval=1.0, tail_size=4000):
+        self.context = context
+        self.command = command
+        self.interval = interval
+        self.tail_size = tail_size
+        self.tail = ''
+        self.changed = False
+        self.last_sent_at = 0
+
+    def __call__(self, text):
+        self.tail = (self.tail + text)[-self.tail_size:]
+        self.changed = True
+        if time.monotonic() - self.last_sent_at >= self.interval:
+            self.flush()
+
+    def flush(self):
+        if self.changed:
+            self.context.emit("command_output", {"command": self.command[:200], "output": self.tail})
+            self.changed = False
+        self.last_sent_at = time.monotonic()
+
+
 @tool
-def terminal_executor(command: str) -> Dict[str, Any]:
+def terminal_executor(command: str, timeout: int = settings.CODE_READER_COMMAND_TIMEOUT) -> Dict[str, Any]:
     """
     Execute a shell command and return its output, error message, and exit code.
+    The command is waited for until it finishes or timeout seconds have passed, in which case it is left
+    running, its output so far is returned and the exit code is null.
     """
     try:
-        from code_reader.executor.utils import get_output_buffer, get_session_name
-        # Safely split the command into arguments
-        output_buffer = get_output_buffer()
-        session_name = get_session_name()
-
-        send_command_to_tmux(command=command, session_name=session_name)
-
-        print(f"Waiting for command '{command}' to complete...")
-        time.sleep(5)  # Adjust based on expected command duration
-        # Collect output for analysis
-        output = ''.join(output_buffer)
-        output_buffer.clear()
-
-        if command.startswith("cd "):
-            if "No such file or directory" not in output:
-                # Extract the path from the command
-                new_dir = command.split(" ", 3)[1].strip()
-
-                # Construct the full path relative to the current working directory
-                full_path = os.path.abspath(os.path.join(os.getcwd(), new_dir))
-
-                # Change the current working directory
-                os.chdir(full_path)
-                print(f"Changed working directory to: {os.getcwd()}")
-            else:
-                print(f"Failed to change directory: {output}")
+        context = current_context()
+
+        with context.terminal_lock:
+            reporter = CommandOutputReporter(context, command)
+            result = run_command_in_tmux(context.session_name, command, context.output_buffer, timeout=timeout,
+                                         on_output=reporter)
+            reporter.flush()
+            output = result["output"]
+
+            if command.startswith("cd "):
+                if result["exit_code"] == 0:
+                    # Extract the path from the command
+                    new_dir = command.split(" ", 3)[1].strip()
+
+                    # Follow the shell in the run's working directory, the process cwd is shared by every run
+                    context.change_directory(new_dir)
+                    print(f"Changed working directory to: {context.working_directory}")
+                else:
+                    print(f"Failed to change directory: {output}")
+        if not result["finished"]:
+            output += f"\n[command still running after {timeout} seconds]"
         return {
             "message": output,
-            "exit_code": 0
+            "exit_code": result["exit_code"],
+            "seconds": result["seconds"]
         }
 
     except Exception as e:
@@ -76,8 +108,7 @@ def read_file_content(filepath: str) -> str:
     """
     try:
         # Resolve the absolute path
-        absolute_filepath = os.path.join(os.getcwd(), filepath)
-        absolute_filepath = os.path.abspath(absolute_filepath)
+        absolute_filepath = current_context().resolve(filepath)
 
         # Ensure the directory exists
         directory = os.path.dirname(absolute_filepath)
@@ -106,8 +137,8 @@ def code_editor(filepath: str, instructions: str) -> str:
     """
     try:
         # Resolve the absolute path
-        absolute_filepath = os.path.join(os.getcwd(), filepath)
-        absolute_filepath = os.path.abspath(absolute_filepath)
+        context = current_context()
+        absolute_filepath = context.resolve(filepath)
 
         # Ensure the directory exists
         directory = os.path.dirname(absolute_filepath)
@@ -122,6 +153,18 @@ def code_editor(filepath: str, instructions: str) -> str:
         else:
             code_status = "No existing code found at the specified path."
 
+        if existing_code.count('\n') >= settings.CODE_READER_EDIT_BLOCKS_MIN_LINES:
+            # only the changed blocks come back instead of the whole file
+            try:
+                updated_code = edit_with_blocks(existing_code, instructions)
+                with open(absolute_filepath, 'w') as file:
+                    file.write(updated_code)
+                context.changes.record(absolute_filepath)
+                return (f"File '{absolute_filepath}' was updated with the changes:\n"
+                        f"``{unified_diff(filepath, existing_code, updated_code)}``\n")
+            except EditConflict as e:
+                print(f"Edit blocks for '{absolute_filepath}' did not apply ({e}), rewriting the whole file")
+
         prompt = (
             f"{code_status}\n```\n{existing_code}\n```\n\n"
             f"Instructions:\n{instructions}\n\n"
@@ -130,18 +173,41 @@ def code_editor(filepath: str, instructions: str) -> str:
             "and try to change what you need to change, and nothing extra."
         )
 
-        updated_code_response = invoke_model(prompt, CodeUpdateResponse)
+        updated_code_response = invoke_model(prompt, CodeUpdateResponse, route=routing.CODE_EDIT)
         updated_code = updated_code_response.updated_code.strip()
 
         # Optional: Validate the updated code (e.g., syntax check)
 
         with open(absolute_filepath, 'w') as file:
             file.write(updated_code)
+        context.changes.record(absolute_filepath)
+        if not existing_code:
+            tree_cache.file_added(absolute_filepath)
 
         return f"File '{absolute_filepath}' was updated to: \n ``{updated_code}``\n"
     except Exception as e:
         return f"An error occurred while updating the file: {str(e)}"
 
+
+def edit_with_blocks(existing_code, instructions):
+    """
+    Asks the model for search / replace blocks implementing the instructions and applies them to the code.
+
+    Raises:
+        EditConflict: If the model returned no edits or one of them does not match the code.
+    """
+    prompt = (
+        f"The current code is:\n```\n{existing_code}\n```\n\n"
+        f"Instructions:\n{instructions}\n\n"
+        "Return only the changes, as search / replace blocks: each `search` is copied verbatim from the current "
+        "code, including indentation, and long enough to match a single place; `replace` is what it becomes. "
+        "Change what you need to change, and nothing extra. Never return the whole file."
+    )
+    response = invoke_model(prompt, CodeEditResponse, route=routing.CODE_EDIT)
+    if not response.edits:
+        raise EditConflict("no edits returned")
+    return apply_edits(existing_code, [edit.model_dump() for edit in response.edits])
+
 @tool
 def update_file_summary(project_id: str, absolute_file_path: str) -> str:
     """
@@ -150,7 +216,10 @@ def update_file_summary(project_id: str, absolute_file_path: str) -> str:
     """
     print(">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>")
     print(f"Updating summary for project {project_id} and path {absolute_file_path}")
-    file_obj = run_file_summarizer(int(project_id), absolute_file_path)
+    try:
+        file_obj = run_file_summarizer(int(project_id), absolute_file_path)
+    except Exception as e:
+        return f"An error occurred while updating the file summary: {str(e)}"
     return file_obj.summary
 
 @tool
@@ -194,17 +263,19 @@ def starting_new_tmux_session_for_running_service(project_id, command):
     :param command: command to run the server:
     :return:
     """
-    from code_reader.executor.utils import get_output_buffer
-    output_buffer = get_output_buffer()
+    context = current_context()
     project = Project.objects.get(id=int(str(project_id)))
 
-    directory, ses_name = start_tmux_session_with_logging(project.repo_path, project.name)
-    send_command_to_tmux(ses_name, command)
-    print(f"Waiting for command '{command}' to complete...")
-    time.sleep(5)  # Adjust based on expected command duration
-    # Collect output for analysis
-    output = ''.join(output_buffer)
-    output_buffer.clear()
+    # the service gets its own session and output, the run keeps using its main session
+    output_buffer = OutputBuffer()
+    directory, ses_name = start_tmux_session_with_logging(project.repo_path, project.name, output_buffer)
+    context.service_sessions[ses_name] = output_buffer
+    # a service does not exit, so wait for its startup output to settle; finishing means it failed to start
+    result = run_command_in_tmux(ses_name, command, output_buffer, timeout=settings.CODE_READER_SERVICE_STARTUP_TIMEOUT,
+                                 idle_timeout=settings.CODE_READER_SERVICE_IDLE_SECONDS)
+    output = result["output"]
+    if result["finished"]:
+        return f" at the directory: {directory}, the service command: {command} in tmux session {ses_name} exited with code {result['exit_code']} resulting the output in terminal: {output}"
 
     return f" at the directory: {directory}, new tmux session has been on with name: {ses_name} and is running the service using command: {command} resulting the output in terminal: {output}"
 
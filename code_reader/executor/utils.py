@@ -1,24 +1,27 @@
 # executor/utils.py
 
 import os
-import json
 import platform
 import re
 import time
 import threading
-import tempfile
+import uuid
 import subprocess
 import shlex
 from typing import Union, Type, List
 from langchain.schema import HumanMessage
 from langchain.output_parsers import PydanticOutputParser
 from dotenv import load_dotenv
-from pydantic import BaseModel
+from pydantic import BaseModel, create_model
 
 
-from langchain_openai import ChatOpenAI
 from django.conf import settings
 
+from code_reader.llm_cache import llm_cache, cache_key
+from code_reader import routing
+from code_reader.llm import chat_model
+from code_reader.executor.tailer import start_log_tailer, stop_log_tailer
+
 # Function to check if tmux is installed
 
 # def check_tmux_installed():
@@ -35,49 +38,74 @@ OPENAI_API_KEY = settings.OPEN_AI_KEY
 if not OPENAI_API_KEY:
     raise ValueError("Please set the OPENAI_API_KEY environment variable.")
 
-# Initialize LLM
-llm = ChatOpenAI(
-    api_key=OPENAI_API_KEY,
-    temperature=0.7,
-    model_name='gpt-4o',
-)
-smarter_llm = ChatOpenAI(
-    api_key=OPENAI_API_KEY,
-    model_name='o1-preview',
-    temperature=1
-)
-
-SESSION_NAME = None
-output_buffer = []
-def get_session_name() -> str:
-    return SESSION_NAME
-
-def get_output_buffer() -> []:
-    return output_buffer
+# Initialize LLM, on the pooled client of code_reader.llm; the other calls take the model of their route
+smarter_llm = chat_model('o1-preview', 1)
 
 def generate_session_name(project_name):
-    global SESSION_NAME
     """
-    Generates a 6-digit code based on the current time.
+    Name of a new tmux session of the project, unique even for runs started in the same second.
 
     Returns:
-        int: A 6-digit code.
+        str: "<project_name>-<6 hex characters>".
     """
-    # Get the current time in seconds since the epoch
-    current_time = int(time.time())
+    return f"{project_name}-{uuid.uuid4().hex[:6]}"
+STRUCTURED_OUTPUT_COUNTERS = ("calls", "cache_hits", "parse_failures", "repair_retries", "repaired", "failures")
+_structured_output_counters = dict.fromkeys(STRUCTURED_OUTPUT_COUNTERS, 0)
+_structured_output_lock = threading.Lock()
+
+
+def count_structured_output(name):
+    with _structured_output_lock:
+        _structured_output_counters[name] += 1
+
+
+def structured_output_stats():
+    """Counters of invoke_model in this process: answers that did not validate, repair calls and their outcome."""
+    with _structured_output_lock:
+        return dict(_structured_output_counters)
+
 
-    # Modulo operation to ensure a 6-digit number
-    code = current_time % 1000000
-    SESSION_NAME = f"{project_name}-{code:06d}"
-    # Ensure the code is zero-padded to 6 digits
-    return SESSION_NAME
-def invoke_model(prompt: str, response_model: Type[BaseModel], is_list: bool = False, intelligence: str ="medium", image="") -> Union[BaseModel, List[BaseModel]]:
+def response_format(response_model):
+    """The JSON schema of response_model as an OpenAI structured output response_format."""
+    return {"type": "json_schema", "json_schema": {"name": response_model.__name__,
+                                                   "schema": response_model.model_json_schema()}}
+
+
+def parse_structured_output(content, response_model):
+    """Validates a JSON answer against response_model, tolerating the ```json fence some models still add."""
+    content = content.strip()
+    fenced = re.match(r"^```(?:json)?\s*(.*?)\s*```$", content, flags=re.DOTALL)
+    if fenced:
+        content = fenced.group(1)
+    return response_model.model_validate_json(content)
+
+
+def invoke_model(prompt: str, response_model: Type[BaseModel], is_list: bool = False, intelligence: str ="medium", image="",
+                 use_cache: bool = True, route: str = routing.ANSWER, escalate_if=None) -> Union[BaseModel, List[BaseModel]]:
     """
     Utility to invoke the language model and parse the response with the specified response model.
+    The model answers in its structured output mode, the schema goes in response_format instead of format
+    instructions in the prompt. An answer that does not validate is sent back with its validation error
+    alone, up to CODE_READER_STRUCTURED_OUTPUT_RETRIES times.
+    The model is the one of the route (see code_reader.routing). The call is asked again to the escalation
+    model when the routed one gives no valid answer, or when escalate_if(result) is true, e.g. low_confidence.
+    Responses that validated are kept in llm_cache, use_cache=False forces a new call.
     """
     try:
-        parser = PydanticOutputParser(pydantic_object=response_model)
-        final_prompt = prompt + "\nOnly provide the output in JSON as specified. Do not add any text before or after.\n" + parser.get_format_instructions()
+        schema_model = create_model(f"{response_model.__name__}List", items=(List[response_model], ...)) \
+            if is_list else response_model
+        if intelligence == "medium" or image:
+            models = [routing.route_chat_model(route)]
+            if routing.can_escalate(route):
+                models.append(routing.route_chat_model(route, escalated=True))
+            instructions = ""
+        else:
+            print("trying to invoke o1-preview")
+            # o1-preview has no structured output mode (nor image input), the schema goes in the prompt
+            models = [smarter_llm]
+            instructions = ("\nOnly provide the output in JSON as specified. Do not add any text before or after.\n"
+                            + PydanticOutputParser(pydantic_object=schema_model).get_format_instructions())
+        final_prompt = prompt + instructions
         if image:
             message_content = [
                 {"type": "text", "text": final_prompt},
@@ -87,26 +115,70 @@ def invoke_model(prompt: str, response_model: Type[BaseModel], is_list: bool = F
         else:
             message = HumanMessage(content=final_prompt)
 
-        if intelligence == "medium" or image:
-            response = llm.invoke([message])
-        elif intelligence == "high":
-            print("trying to invoke o1-preview")
-            # o1-preview cant handle file data
-            response = smarter_llm.invoke([HumanMessage(content=final_prompt)])
-
-        response_content = response.content.strip()
-        match = re.search(r"(?:\w+\n)?(.*)", response_content, flags=re.DOTALL)
-        if match:
-            response_content = match.group(1).strip()
-
-        if is_list:
-            response_json = json.loads(response_content)
-            return [response_model.parse_obj(item) for item in response_json]
+        count_structured_output("calls")
+        # the answer is cached under the routed model, escalated or not
+        key = cache_key(models[0].model_name, models[0].temperature, message.content,
+                        {"schema": schema_model.model_json_schema()})
+        response_content = llm_cache.get(key, bypass=not use_cache)
+        if response_content is not None:
+            count_structured_output("cache_hits")
+            result = parse_structured_output(response_content, schema_model)
         else:
-            return parser.parse(response_content)
+            for attempt, model in enumerate(models):
+                last = attempt == len(models) - 1
+                structured_llm = model.bind(response_format=response_format(schema_model)) if not instructions else model
+                try:
+                    response_content = structured_llm.invoke([message]).content
+                    result = repair_structured_output(structured_llm, response_content, schema_model, instructions)
+                except ValueError as e:
+                    if last:
+                        raise
+                    print(f"{model.model_name} gave no valid {response_model.__name__} on route {route}, escalating: {e}")
+                    routing.route_metrics.escalated(route)
+                    continue
+                if last or not (escalate_if and escalate_if(result)):
+                    break
+                print(f"{model.model_name} is unsure of its {response_model.__name__} on route {route}, escalating")
+                routing.route_metrics.escalated(route)
+            # only responses that validated are worth replaying
+            llm_cache.set(key, result.model_dump_json(), bypass=not use_cache)
+        return result.items if is_list else result
     except Exception as e:
         raise RuntimeError(f"Error invoking model: {e}")
 
+
+def repair_structured_output(structured_llm, content, response_model, instructions=""):
+    """
+    Parses the answer, asking the model to correct it while it does not validate. The repair prompt holds
+    the invalid answer and the validation error only, not the original prompt.
+
+    Raises:
+        ValueError: If the answer still does not validate after the retries.
+    """
+    for attempt in range(settings.CODE_READER_STRUCTURED_OUTPUT_RETRIES + 1):
+        try:
+            result = parse_structured_output(content, response_model)
+            if attempt:
+                count_structured_output("repaired")
+            return result
+        except ValueError as e:
+            count_structured_output("parse_failures")
+            error = e
+            print(f"{response_model.__name__} answer did not validate (attempt {attempt + 1}): {e}")
+        if attempt == settings.CODE_READER_STRUCTURED_OUTPUT_RETRIES:
+            break
+        count_structured_output("repair_retries")
+        repair_prompt = (
+            f"This JSON answer does not match its schema:\n{content}\n\n"
+            f"Validation error:\n{error}\n\n"
+            "Return the corrected JSON only, keeping everything the error does not mention."
+            + instructions
+        )
+        content = structured_llm.invoke([HumanMessage(content=repair_prompt)]).content
+    count_structured_output("failures")
+    raise error
+
+
 def start_tmux_session(session_name, directory):
     try:
         print("system platform: ", platform.system())
@@ -133,49 +205,121 @@ def start_tmux_session(session_name, directory):
         print(f"Failed to start tmux session '{session_name}' in directory '{directory}'. Error: {e}")
 
 
-def send_command_to_tmux(session_name, command, delay=0.1):
+# commands longer than this, or spanning several lines, go through a tmux paste buffer
+PASTE_BUFFER_THRESHOLD = 512
+
+
+def send_command_to_tmux(session_name, command):
     """
-    Sends a command to the specified tmux session.
+    Sends a command to the specified tmux session and presses Enter: one `send-keys -l` (literal, so
+    nothing in the command is read as a key name) for short commands, a load-buffer / paste-buffer
+    pair for long or multi-line ones.
+
+    Returns:
+        float: Seconds spent dispatching the command, also logged.
     """
+    started = time.monotonic()
     try:
-        for char in command:
-            subprocess.run(['tmux', 'send-keys', '-t', session_name, char])
-            time.sleep(delay)  # Delay between each character
-        subprocess.run(['tmux', 'send-keys', '-t', session_name, 'C-m'])
+        if len(command) > PASTE_BUFFER_THRESHOLD or '\n' in command:
+            method = 'paste-buffer'
+            buffer_name = f"cmd-{session_name}"
+            subprocess.run(['tmux', 'load-buffer', '-b', buffer_name, '-'], input=command, text=True, check=True)
+            subprocess.run(['tmux', 'paste-buffer', '-d', '-b', buffer_name, '-t', session_name], check=True)
+        else:
+            method = 'send-keys'
+            subprocess.run(['tmux', 'send-keys', '-t', session_name, '-l', '--', command], check=True)
+        subprocess.run(['tmux', 'send-keys', '-t', session_name, 'C-m'], check=True)
     except subprocess.CalledProcessError as e:
         print(f"Failed to send command to tmux session '{session_name}'. Command: {command}. Error: {e}")
+        return time.monotonic() - started
+    elapsed = time.monotonic() - started
+    print(f"Sent {len(command)} characters to tmux session '{session_name}' with {method} in {elapsed * 1000:.1f}ms")
+    return elapsed
 
 
-def create_tmux_pane_logger(session_name, log_file):
+# the longest wait for output between two checks of the timeouts
+COMMAND_POLL_INTERVAL = 0.5
+COMMAND_MARKER_PREFIX = "__CMD_DONE_"
+
+
+def with_sentinel(command, marker):
     """
-    Pipes the tmux pane output to a log file.
+    The command followed by an echo of the marker and its exit status, `<marker>:<status>`. The echo
+    goes on its own line, so whatever ends the command (`;`, `&`, a comment, a heredoc terminator)
+    cannot swallow it. A dangling line continuation is dropped, it would join the echo to the command.
     """
-    try:
-        subprocess.run(['tmux', 'pipe-pane', '-o', '-t', session_name, f'cat >> {log_file}'])
-    except subprocess.CalledProcessError as e:
-        print(f"Failed to create tmux pane logger for session '{session_name}'. Log file: {log_file}. Error: {e}")
+    command = command.rstrip()
+    if (len(command) - len(command.rstrip('\\'))) % 2:
+        command = command[:-1].rstrip()
+    return f'{command}\necho "{marker}:$?"'
 
 
-def monitor_log_file(log_file, output_buffer_arr):
-    """
-    Monitors the log file for output.
+def strip_markers(output):
+    """Output without the lines of the completion markers: the echoed commands and the markers themselves."""
+    return '\n'.join(line for line in output.split('\n') if COMMAND_MARKER_PREFIX not in line)
+
+
+def run_command_in_tmux(session_name, command, output_buffer, timeout=60, idle_timeout=None, on_output=None):
     """
-    with open(log_file, 'r') as f:
-        # Move to the end of the file
-        f.seek(0, os.SEEK_END)
-        while True:
-            line = f.readline()
-            if line:
-                print(line, end='')  # Print the output to the console
-                output_buffer_arr.append(line)
-            else:
-                time.sleep(0.1)
+    Runs a command in the tmux session and waits for it to finish instead of sleeping a fixed time:
+    the command is followed by the echo of a unique marker with its exit status, which shows up in
+    the pane output once it is done.
 
+    Args:
+        output_buffer (OutputBuffer): Output of the session, filled by its tailer.
+        timeout (float): Seconds after which the command is left running and its output so far returned.
+        idle_timeout (float): Also return once the command printed something and then stayed quiet that
+            long, e.g. for a server that never exits.
+        on_output (callable): Called with every new piece of output as it arrives.
 
-def start_tmux_session_with_logging(directory, project_name):
-    global output_buffer
-    output_buffer = []
-    # Set the working directory
+    Returns:
+        dict: {"output", "exit_code" (None while still running), "finished", "seconds"}
+    """
+    marker = f"{COMMAND_MARKER_PREFIX}{uuid.uuid4().hex[:12]}__"
+    pattern = re.compile(re.escape(marker) + r":(\d+)")
+    stale = output_buffer.drain()
+    if stale:
+        print(f"Discarding {len(stale)} characters of earlier output of '{session_name}'")
+
+    started = time.monotonic()
+    send_command_to_tmux(session_name, with_sentinel(command, marker))
+    output = ''
+    exit_code = None
+    last_output_at = None
+    while True:
+        text = output_buffer.drain()
+        if text:
+            search_from = max(len(output) - len(marker) - 8, 0)
+            output += text
+            last_output_at = time.monotonic()
+            if on_output and strip_markers(text):
+                on_output(strip_markers(text))
+            match = pattern.search(output, search_from)
+            if match:
+                exit_code = int(match.group(1))
+                output = output[:match.start()]
+                break
+        now = time.monotonic()
+        if now - started > timeout:
+            break
+        if idle_timeout and last_output_at and now - last_output_at > idle_timeout:
+            break
+        output_buffer.wait(COMMAND_POLL_INTERVAL)
+
+    # late markers of earlier commands that timed out are dropped as well
+    output = strip_markers(output)
+    seconds = round(time.monotonic() - started, 3)
+    print(f"Command '{command[:80]}' in '{session_name}': exit code {exit_code} after {seconds}s")
+    return {"output": output, "exit_code": exit_code, "finished": exit_code is not None, "seconds": seconds}
+
+
+def start_tmux_session_with_logging(directory, project_name, output_buffer):
+    """
+    Starts a tmux session in directory whose pane output is appended to output_buffer (an OutputBuffer).
+
+    Returns:
+        tuple: (directory, session_name)
+    """
     session_name = generate_session_name(project_name)
     # Start the tmux session
     try:
@@ -186,16 +330,8 @@ def start_tmux_session_with_logging(directory, project_name):
 
     time.sleep(2)  # Give some time for tmux session to start
 
-    # Create a temporary log file to capture the pane output
-    log_file = tempfile.NamedTemporaryFile(delete=False)
-    log_file.close()
-
-    # Start logging the tmux pane output
-    create_tmux_pane_logger(SESSION_NAME, log_file.name)
-
-    # Start monitoring the log file in a separate thread
-    monitor_thread = threading.Thread(target=monitor_log_file, args=(log_file.name, output_buffer), daemon=True)
-    monitor_thread.start()
+    # Tail the pane output into the buffer, until the session is killed
+    start_log_tailer(session_name, output_buffer)
 
     return directory, session_name
 
@@ -209,6 +345,7 @@ def kill_tmux_session(session_name):
     Returns:
         bool: True if the session was killed successfully, False otherwise.
     """
+    stop_log_tailer(session_name)
     try:
         # Check if the session exists
         result = subprocess.run(["tmux", "has-session", "-t", session_name], stderr=subprocess.PIPE, text=True)
@@ -0,0 +1,157 @@
+# code_reader/ignore.py
+
+import os
+import re
+
+# Always ignored when reading a project, on top of its .gitignore / .dockerignore
+DEFAULT_IGNORE_PATTERNS = [
+    '*.png', 'static', 'staticFiles', '__MACOSX/', '*.json', '__pycache__', 'db.sqlite3', '.idea', '*.xlsx',
+    'venv*', '.env', '.idea/', '.git', '*.txt', '*.mp3', '/static/', '/postgres_data/', 'public/',
+    '.DS_Store', 'node_modules', '.next', '*.ttf', '*.jpeg', '*.svg', '*.ico', '*.woff', '*.d.ts'
+]
+
+
+def glob_to_regex(pattern):
+    """Translates a gitignore glob to a regex: '*' and '?' stop at '/', '**' crosses directories."""
+    regex = ''
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+            continue
+        if pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+            continue
+        if char == '*':
+            regex += '[^/]*'
+        elif char == '?':
+            regex += '[^/]'
+        elif char == '[':
+            end = pattern.find(']', i + 1)
+            if end == -1:
+                regex += re.escape(char)
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                regex += f'[{body}]'
+                i = end
+        elif char == '\\' and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        else:
+            regex += re.escape(char)
+        i += 1
+    return regex
+
+
+def parse_rule(line):
+    """
+    Returns (regex, negated, directory_only, anchored) for one ignore line, or None for blanks and comments.
+    Patterns with a '/' before the last character are anchored and match the path relative to the repo
+    root, the others match a file or directory name at any depth.
+    """
+    line = line.rstrip('\n').rstrip()
+    if not line or line.startswith('#'):
+        return None
+    negated = line.startswith('!')
+    if negated:
+        line = line[1:]
+    directory_only = line.endswith('/')
+    line = line.rstrip('/')
+    if not line:
+        return None
+    anchored = '/' in line
+    return glob_to_regex(line.lstrip('/')), negated, directory_only, anchored
+
+
+def _combine(regexes):
+    return re.compile('|'.join(f'(?:{regex})' for regex in regexes) + r'\Z') if regexes else None
+
+
+class IgnoreMatcher:
+    """
+    Gitignore semantics over paths relative to the repo root: the last matching rule wins and a
+    '!' rule re-includes. Consecutive rules with the same outcome are compiled into one regex over
+    the name and one over the relative path, so a path is tested against a handful of regexes
+    instead of every pattern.
+    """
+
+    def __init__(self, patterns):
+        # runs of consecutive rules sharing (negated, directory_only), in file order
+        groups = []
+        for pattern in patterns:
+            rule = parse_rule(pattern)
+            if rule is None:
+                continue
+            regex, negated, directory_only, anchored = rule
+            key = (negated, directory_only)
+            if not groups or groups[-1][0] != key:
+                groups.append((key, [], []))
+            groups[-1][2 if anchored else 1].append(regex)
+        self.compiled = [(negated, directory_only, _combine(name_regexes), _combine(path_regexes))
+                         for (negated, directory_only), name_regexes, path_regexes in groups]
+
+    def matches(self, relative_path, is_dir=False):
+        """Whether the path itself is ignored, its parent directories are not looked at."""
+        name = relative_path.rsplit('/', 1)[-1]
+        for negated, directory_only, name_regex, path_regex in reversed(self.compiled):
+            if directory_only and not is_dir:
+                continue
+            if (name_regex and name_regex.match(name)) or (path_regex and path_regex.match(relative_path)):
+                return not negated
+        return False
+
+    def is_ignored_path(self, relative_path):
+        """Whether a file is ignored, either itself or through one of its parent directories."""
+        parts = relative_path.split('/')
+        for depth in range(1, len(parts)):
+            if self.matches('/'.join(parts[:depth]), is_dir=True):
+                return True
+        return self.matches(relative_path)
+
+
+def walk_repo(repo_path, matcher, directory=None):
+    """
+    os.walk-like top-down walk built on os.scandir that prunes ignored directories as it goes,
+    so trees like node_modules or .git are never listed.
+    directory restricts the walk to that directory of the repo, nothing is yielded when it is ignored.
+
+    Yields:
+    tuple: (directory, relative_directory, dir_names, file_names) with the ignored entries removed,
+    names sorted. relative_directory is '' for the repo root.
+    """
+    if directory is None or os.path.realpath(directory) == os.path.realpath(repo_path):
+        stack = [(repo_path, '')]
+    else:
+        relative_directory = os.path.relpath(directory, repo_path).replace(os.sep, '/')
+        if matcher.is_ignored_path(relative_directory) or matcher.matches(relative_directory, is_dir=True):
+            return
+        stack = [(directory, relative_directory)]
+    while stack:
+        directory, relative_directory = stack.pop()
+        dir_names = []
+        file_names = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    relative_path = f'{relative_directory}/{entry.name}' if relative_directory else entry.name
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if matcher.matches(relative_path, is_dir=is_dir):
+                        continue
+                    (dir_names if is_dir else file_names).append(entry.name)
+        except OSError as e:
+            print(f"Skipping directory {directory}: {e}")
+            continue
+        dir_names.sort()
+        file_names.sort()
+        yield directory, relative_directory, dir_names, file_names
+        for name in reversed(dir_names):
+            stack.append((os.path.join(directory, name),
+                          f'{relative_directory}/{name}' if relative_directory else name))
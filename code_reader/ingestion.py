@@ -0,0 +1,326 @@
+# code_reader/ingestion.py
+
+import asyncio
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import as_completed
+
+from openai import RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
+from django.conf import settings
+from django.db import transaction
+
+from code_reader.chunking import replace_file_chunks
+from code_reader.llm import run_async
+from code_reader.models import File
+
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+# summary of an empty file, no model call needed
+EMPTY_FILE_SUMMARY = "Empty file."
+
+
+def estimate_tokens(text, completion_tokens=500):
+    """Rough token estimate (~4 chars per token) plus room for the completion."""
+    return len(text) // 4 + completion_tokens
+
+
+class RateLimiter:
+    """
+    Sliding one minute window over requests and tokens, shared by all the summarizer workers.
+    acquire() blocks until the request fits in both budgets, acquire_async() waits for it without
+    blocking the event loop.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute, window=60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self._events = deque()
+        self._tokens_in_window = 0
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._events and now - self._events[0][0] >= self.window:
+            _, tokens = self._events.popleft()
+            self._tokens_in_window -= tokens
+
+    def _try_acquire(self, tokens):
+        """Takes the budget of the request if it fits, otherwise returns how long to wait before trying again."""
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            fits_requests = len(self._events) < self.requests_per_minute
+            # a single request bigger than the whole budget is let through on an empty window
+            fits_tokens = not self._events or self._tokens_in_window + tokens <= self.tokens_per_minute
+            if fits_requests and fits_tokens:
+                self._events.append((now, tokens))
+                self._tokens_in_window += tokens
+                return None
+            return max(self.window - (now - self._events[0][0]), 0.01)
+
+    def acquire(self, tokens):
+        while (wait := self._try_acquire(tokens)) is not None:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens):
+        while (wait := self._try_acquire(tokens)) is not None:
+            await asyncio.sleep(wait)
+
+
+def backoff_delay(attempt, error=None, base_delay=1.0, max_delay=60.0):
+    """Full-jitter exponential backoff, honouring the retry-after header when the API sends one."""
+    response = getattr(error, 'response', None)
+    retry_after = response.headers.get('retry-after') if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after) + random.uniform(0, base_delay)
+        except ValueError:
+            pass
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def call_with_retries(func, *args, max_retries=None, **kwargs):
+    """Calls func, retrying rate limit / transient OpenAI errors with jittered backoff."""
+    max_retries = settings.CODE_READER_MAX_RETRIES if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            if attempt >= max_retries:
+                raise
+            delay = backoff_delay(attempt, e)
+            print(f"{type(e).__name__} from OpenAI, retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+async def acall_with_retries(func, *args, max_retries=None, **kwargs):
+    """call_with_retries for a coroutine function, the backoff does not block the event loop."""
+    max_retries = settings.CODE_READER_MAX_RETRIES if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        try:
+            return await func(*args, **kwargs)
+        except RETRYABLE_ERRORS as e:
+            if attempt >= max_retries:
+                raise
+            delay = backoff_delay(attempt, e)
+            print(f"{type(e).__name__} from OpenAI, retry {attempt + 1}/{max_retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+def summarize_files(file_contents, tree_output, summarize, max_workers=None,
+                    requests_per_minute=None, tokens_per_minute=None, on_summary=None):
+    """
+    Fans the per-file summaries out as coroutines on the event loop of the async client (llm.run_async),
+    max_workers of them at a time. The calls in flight still count against the per-model limits of
+    the gateway, shared with the sync callers.
+
+    Args:
+    file_contents (dict): path -> content of the files to summarize.
+    tree_output (str): tree structure of the project, passed to every summary prompt.
+    summarize (coroutine function): summarize(path, content, tree_output) -> str,
+        e.g. utils.asummarize_file_content.
+    on_summary (callable): optional on_summary(path, summary), called on the calling thread as each
+        summary completes, e.g. FileBatchWriter.add.
+
+    Returns:
+    tuple: (summaries, stats) where summaries is path -> summary for the files that succeeded and
+    stats holds the files/sec throughput of the run.
+    """
+    max_workers = max_workers or settings.CODE_READER_CONCURRENCY
+    limiter = RateLimiter(
+        requests_per_minute or settings.CODE_READER_REQUESTS_PER_MINUTE,
+        tokens_per_minute or settings.CODE_READER_TOKENS_PER_MINUTE,
+    )
+
+    slots = asyncio.Semaphore(max_workers)
+
+    async def attempt(path, content):
+        # every attempt, retries included, is a request against the per-minute budgets
+        await limiter.acquire_async(estimate_tokens(content) + estimate_tokens(tree_output, completion_tokens=0))
+        return await summarize(path, content, tree_output)
+
+    async def summarize_one(path, content):
+        if not content.strip():
+            return EMPTY_FILE_SUMMARY
+        async with slots:
+            return await acall_with_retries(attempt, path, content)
+
+    summaries = {}
+    failed = []
+    started = time.monotonic()
+    futures = {run_async(summarize_one(path, content)): path for path, content in file_contents.items()}
+    for future in as_completed(futures):
+        path = futures[future]
+        try:
+            summaries[path] = future.result()
+            print(f"summarized {path} ({len(summaries)}/{len(futures)})")
+        except Exception as e:
+            failed.append(path)
+            print(f"Failed to summarize {path}: {e}")
+            continue
+        if on_summary:
+            on_summary(path, summaries[path])
+
+    elapsed = time.monotonic() - started
+    stats = {
+        "files": len(summaries),
+        "failed": len(failed),
+        "seconds": round(elapsed, 2),
+        "files_per_sec": round(len(summaries) / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    print(f"summarized {stats['files']} files in {stats['seconds']}s "
+          f"({stats['files_per_sec']} files/sec, {stats['failed']} failed, {max_workers} workers)")
+    return summaries, stats
+
+
+# Statuses yielded by diff_files
+ADDED = 'added'
+CHANGED = 'changed'
+TOUCHED = 'touched'  # mtime moved but the content hash is the same, only the fingerprint needs saving
+DELETED = 'deleted'
+
+
+def content_hash(content):
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def file_fingerprint(path, content):
+    """Fingerprint stored on File: sha256 of the content plus the size and mtime from the filesystem."""
+    stat = os.stat(path)
+    return {"content_hash": content_hash(content), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+def load_fingerprints(project):
+    """All the fingerprints of a project in a single query, without transferring any content."""
+    return {
+        path: (digest, size, mtime)
+        for path, digest, size, mtime in File.objects.filter(project=project).values_list(
+            'path', 'content_hash', 'size', 'mtime')
+    }
+
+
+def diff_files(paths, fingerprints, read_content):
+    """
+    Compares the files on disk against the stored fingerprints.
+
+    A file whose size and mtime match is skipped without being read. Otherwise it is read and hashed,
+    so a touched but unmodified file does not get summarized again. Empty files are fingerprinted like
+    the others, so they are not read again on every run either.
+
+    Yields:
+    tuple: (status, path, content, fingerprint). content is None for TOUCHED and DELETED,
+    fingerprint is None for DELETED. Deleted paths are yielded last.
+    """
+    seen = set()
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        known = fingerprints.get(path)
+        if known and known[1] == stat.st_size and known[2] == stat.st_mtime:
+            seen.add(path)
+            continue
+
+        content = read_content(path)
+        if content is None:
+            # unreadable, e.g. binary
+            continue
+        seen.add(path)
+        fingerprint = {"content_hash": content_hash(content), "size": stat.st_size, "mtime": stat.st_mtime}
+        if known is None:
+            yield ADDED, path, content, fingerprint
+        elif known[0] != fingerprint["content_hash"]:
+            yield CHANGED, path, content, fingerprint
+        else:
+            yield TOUCHED, path, None, fingerprint
+
+    for path in fingerprints:
+        if path not in seen:
+            yield DELETED, path, None, None
+
+
+class FileBatchWriter:
+    """
+    Accumulates the File rows produced by the ingestion and writes them one transaction per chunk of
+    chunk_size rows, instead of an update_or_create (and a transaction) per file.
+    New rows go out with bulk_create. Existing rows are updated with one UPDATE per row inside the chunk
+    transaction: on SQLite that is several times faster than bulk_update's CASE WHEN statements.
+    Call close() (or use it as a context manager) to flush the last partial chunk.
+    """
+
+    def __init__(self, project, chunk_size=None):
+        self.project = project
+        self.chunk_size = chunk_size or settings.CODE_READER_WRITE_CHUNK_SIZE
+        self.existing_ids = dict(File.objects.filter(project=project).values_list('path', 'id'))
+        self._created = []
+        self._updated = []
+        self._touched = []
+        self.rows_written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _pending(self):
+        return len(self._created) + len(self._updated) + len(self._touched)
+
+    def add(self, path, summary, content, fingerprint):
+        """Queues a summarized file, created or updated depending on whether the path is already indexed."""
+        fields = {"summary": summary, "analysis": summary, "content": content, **fingerprint}
+        if path in self.existing_ids:
+            self._updated.append((self.existing_ids[path], path, fields))
+        else:
+            self._created.append(File(project=self.project, path=path, **fields))
+        if self._pending() >= self.chunk_size:
+            self.flush()
+
+    def touch(self, path, fingerprint):
+        """Queues a fingerprint-only update for a file whose content did not change."""
+        if path not in self.existing_ids:
+            return
+        self._touched.append((self.existing_ids[path], fingerprint))
+        if self._pending() >= self.chunk_size:
+            self.flush()
+
+    def delete(self, paths):
+        paths = list(paths)
+        with transaction.atomic():
+            for start in range(0, len(paths), self.chunk_size):
+                File.objects.filter(project=self.project, path__in=paths[start:start + self.chunk_size]).delete()
+        for path in paths:
+            self.existing_ids.pop(path, None)
+
+    def flush(self):
+        if not self._pending():
+            return
+        with transaction.atomic():
+            chunked = []
+            if self._created:
+                for file_obj in File.objects.bulk_create(self._created, batch_size=self.chunk_size):
+                    if file_obj.id is not None:
+                        self.existing_ids[file_obj.path] = file_obj.id
+                        chunked.append((file_obj.id, file_obj.path, file_obj.content))
+            for file_id, path, fields in self._updated:
+                File.objects.filter(id=file_id).update(**fields)
+                chunked.append((file_id, path, fields["content"]))
+            for file_id, fields in self._touched:
+                File.objects.filter(id=file_id).update(**fields)
+            # content changed, so do the function / class chunks retrieved into the prompts
+            replace_file_chunks(chunked)
+        print(f"flushed {len(self._created)} created, {len(self._updated)} updated, "
+              f"{len(self._touched)} touched files")
+        self.rows_written += self._pending()
+        self._created, self._updated, self._touched = [], [], []
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,397 @@
+# code_reader/llm.py
+
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+import httpx
+from openai import OpenAI, AsyncOpenAI
+from langchain_openai import ChatOpenAI
+from django.conf import settings
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised without calling the API while the circuit of a model is open. Not an httpx or OpenAI error,
+    so neither the SDK nor ingestion.call_with_retries take it for a transient failure to retry.
+    """
+
+
+class CircuitBreaker:
+    """
+    Opens after `threshold` consecutive failures (connection errors, timeouts, 5xx, 429) and rejects calls for
+    `cooldown` seconds. Then one trial call goes through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                # half open: this call is the trial, the others wait for another cooldown
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        return 'closed' if self.opened_at is None else 'open'
+
+
+class SharedSemaphore:
+    """
+    Counting semaphore acquired by threads (acquire) and by asyncio tasks of any event loop
+    (acquire_async) from the same budget. Freed slots go to the waiters in arrival order.
+    """
+
+    def __init__(self, value):
+        self._value = value
+        self._waiters = deque()  # threading.Event of a thread, (loop, future) of a task
+        self._lock = threading.Lock()
+
+    def _take(self):
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return True
+        return False
+
+    def acquire(self, timeout=None):
+        with self._lock:
+            if self._take():
+                return True
+            event = threading.Event()
+            self._waiters.append(event)
+        if event.wait(timeout):
+            return True
+        with self._lock:
+            if event in self._waiters:
+                self._waiters.remove(event)
+                return False
+        # the slot was handed over as the wait timed out
+        return True
+
+    async def acquire_async(self, timeout=None):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._take():
+                return True
+            future = loop.create_future()
+            waiter = (loop, future)
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(future, timeout)
+            return True
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                queued = waiter in self._waiters
+                if queued:
+                    self._waiters.remove(waiter)
+            if not queued and future.done() and not future.cancelled():
+                # given a slot it will not use
+                self.release()
+            # otherwise the hand over is on its way and passes the slot on, see _hand_over
+            if isinstance(e, asyncio.TimeoutError):
+                return False
+            raise
+
+    def _hand_over(self, future):
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(True)
+
+    def release(self):
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                loop, future = waiter
+                try:
+                    loop.call_soon_threadsafe(self._hand_over, future)
+                    return
+                except RuntimeError:
+                    # the loop of the waiting task is closed
+                    continue
+            self._value += 1
+
+
+def parse_concurrency(value):
+    """'gpt-4o=8,gpt-4o-mini=16' -> {'gpt-4o': 8, 'gpt-4o-mini': 16}"""
+    limits = {}
+    for item in value.split(','):
+        if '=' in item:
+            model, limit = item.split('=', 1)
+            limits[model.strip()] = int(limit)
+    return limits
+
+
+class ModelGate:
+    """
+    Concurrency limit and circuit breaker of one model, shared by every client of the process:
+    sync and async calls take their slot from the same semaphore.
+    """
+
+    def __init__(self, model, limit):
+        self.model = model
+        self.limit = limit
+        self.semaphore = SharedSemaphore(limit)
+        self.breaker = CircuitBreaker(settings.CODE_READER_LLM_BREAKER_THRESHOLD,
+                                      settings.CODE_READER_LLM_BREAKER_COOLDOWN)
+        self.in_flight = 0
+        self.calls = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def check(self):
+        if not self.breaker.allow():
+            with self._lock:
+                self.rejected += 1
+            raise CircuitOpenError(f"Circuit open for {self.model} after {self.breaker.failures} consecutive failures")
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+            self.calls += 1
+
+    def finished(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def stats(self):
+        return {"limit": self.limit, "in_flight": self.in_flight, "calls": self.calls, "rejected": self.rejected,
+                "circuit": self.breaker.state, "consecutive_failures": self.breaker.failures}
+
+
+_gates = {}
+_gates_lock = threading.Lock()
+
+
+def get_gate(model):
+    with _gates_lock:
+        if model not in _gates:
+            limits = parse_concurrency(settings.CODE_READER_LLM_MODEL_CONCURRENCY)
+            _gates[model] = ModelGate(model, limits.get(model, settings.CODE_READER_LLM_DEFAULT_CONCURRENCY))
+        return _gates[model]
+
+
+def gateway_stats():
+    """Per model concurrency and circuit state of this process."""
+    with _gates_lock:
+        gates = list(_gates.values())
+    return {gate.model: gate.stats() for gate in gates}
+
+
+def request_model(request):
+    try:
+        return json.loads(request.content).get('model') or 'default'
+    except (ValueError, AttributeError, httpx.RequestNotRead):
+        return 'default'
+
+
+def record_response(gate, response):
+    # rate limited counts as failing: an open circuit stops hammering the API
+    if response.status_code >= 500 or response.status_code == 429:
+        gate.breaker.record_failure()
+    elif response.status_code < 400:
+        gate.breaker.record_success()
+    # other 4xx are the request's fault, they neither open nor close the circuit
+
+
+class ReleasingStream(httpx.SyncByteStream):
+    """Response body that gives the model slot back once read or closed, streamed answers included."""
+
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if not self._released:
+                self._released = True
+                self._release()
+
+
+class AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, release):
+        self._stream = stream
+        self._release = release
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._release()
+
+
+class GatewayTransport(httpx.BaseTransport):
+    """
+    Pooled transport of the shared client: every request waits for a slot of its model (the 'model' of
+    the JSON body). Failures feed the circuit breaker, the open circuit is enforced by GatewayOpenAI.
+    """
+
+    def __init__(self, **kwargs):
+        self._transport = httpx.HTTPTransport(**kwargs)
+
+    def handle_request(self, request):
+        gate = get_gate(request_model(request))
+        if not gate.semaphore.acquire(timeout=settings.CODE_READER_LLM_TIMEOUT):
+            raise httpx.PoolTimeout(f"No free slot for {gate.model} within {settings.CODE_READER_LLM_TIMEOUT}s")
+        gate.started()
+
+        def release():
+            gate.finished()
+            gate.semaphore.release()
+
+        try:
+            response = self._transport.handle_request(request)
+        except httpx.TransportError:
+            gate.breaker.record_failure()
+            release()
+            raise
+        record_response(gate, response)
+        if response.is_closed:
+            # the body is in memory already, e.g. from an in-process transport, nothing will close the stream
+            release()
+        else:
+            response.stream = ReleasingStream(response.stream, release)
+        return response
+
+    def close(self):
+        self._transport.close()
+
+
+class AsyncGatewayTransport(httpx.AsyncBaseTransport):
+    """GatewayTransport of the async client, same gates and circuits."""
+
+    def __init__(self, **kwargs):
+        self._transport = httpx.AsyncHTTPTransport(**kwargs)
+
+    async def handle_async_request(self, request):
+        gate = get_gate(request_model(request))
+        if not await gate.semaphore.acquire_async(timeout=settings.CODE_READER_LLM_TIMEOUT):
+            raise httpx.PoolTimeout(f"No free slot for {gate.model} within {settings.CODE_READER_LLM_TIMEOUT}s")
+        gate.started()
+
+        def release():
+            gate.finished()
+            gate.semaphore.release()
+
+        try:
+            response = await self._transport.handle_async_request(request)
+        except httpx.TransportError:
+            gate.breaker.record_failure()
+            release()
+            raise
+        record_response(gate, response)
+        if response.is_closed:
+            # the body is in memory already, e.g. from an in-process transport, nothing will close the stream
+            release()
+        else:
+            response.stream = AsyncReleasingStream(response.stream, release)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+def http_timeout():
+    return httpx.Timeout(settings.CODE_READER_LLM_TIMEOUT, connect=settings.CODE_READER_LLM_CONNECT_TIMEOUT)
+
+
+def http_limits():
+    return httpx.Limits(max_connections=settings.CODE_READER_LLM_MAX_CONNECTIONS,
+                        max_keepalive_connections=settings.CODE_READER_LLM_MAX_CONNECTIONS)
+
+
+# one connection pool for the whole process, every OpenAI call goes through it
+http_client = httpx.Client(transport=GatewayTransport(limits=http_limits()), timeout=http_timeout())
+async_http_client = httpx.AsyncClient(transport=AsyncGatewayTransport(limits=http_limits()), timeout=http_timeout())
+
+
+
+class GatewayOpenAI(OpenAI):
+    """
+    OpenAI client refusing the calls of a model whose circuit is open. The check is done in the request
+    hook of the SDK, which runs before each attempt and outside of its retry handling: a rejected call
+    fails at once instead of being retried, and retries stop as soon as the circuit opens.
+    """
+
+    def _prepare_request(self, request):
+        super()._prepare_request(request)
+        get_gate(request_model(request)).check()
+
+
+class GatewayAsyncOpenAI(AsyncOpenAI):
+    """GatewayOpenAI of the async client."""
+
+    async def _prepare_request(self, request):
+        await super()._prepare_request(request)
+        get_gate(request_model(request)).check()
+
+
+client = GatewayOpenAI(api_key=settings.OPEN_AI_KEY, base_url=settings.OPEN_AI_BASE_URL, http_client=http_client,
+                       timeout=http_timeout())
+async_client = GatewayAsyncOpenAI(api_key=settings.OPEN_AI_KEY, base_url=settings.OPEN_AI_BASE_URL,
+                                  http_client=async_http_client, timeout=http_timeout())
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def run_async(coro):
+    """
+    Schedules coro on the event loop of the async client and returns a concurrent.futures.Future.
+    The pooled connections of async_http_client belong to the loop that opened them, so every async
+    call of the process runs on this one loop, in its own daemon thread.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-event-loop", daemon=True).start()
+    return asyncio.run_coroutine_threadsafe(coro, _loop)
+
+
+@lru_cache(maxsize=None)
+def chat_model(model='gpt-4o', temperature=0.7):
+    """The LangChain chat model of model / temperature, one instance per process, on the shared clients."""
+    return ChatOpenAI(model=model, temperature=temperature, api_key=settings.OPEN_AI_KEY,
+                      base_url=settings.OPEN_AI_BASE_URL, root_client=client, client=client.chat.completions,
+                      root_async_client=async_client, async_client=async_client.chat.completions,
+                      timeout=http_timeout())
@@ -0,0 +1,217 @@
+# code_reader/llm_cache.py
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+
+def cache_key(model, temperature, messages, schema=None):
+    """Hash of everything that determines a response: model, temperature, messages and response schema."""
+    payload = json.dumps({"model": model, "temperature": temperature, "messages": messages, "schema": schema},
+                         sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryCache:
+    """In-process LRU, for tests and single process setups."""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, created_at = entry
+            if self.ttl and time.time() - created_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache:
+    """
+    Responses in a SQLite file shared by the web and worker processes of a host.
+    Expired rows are dropped when read, the least recently read rows once max_entries is reached.
+    """
+
+    def __init__(self, ttl, max_entries, path=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.path = str(path or settings.CODE_READER_LLM_CACHE_PATH)
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    def _connection(self):
+        # sqlite3 connections cannot be shared between threads
+        if getattr(self._local, 'connection', None) is None:
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return self._local.connection
+
+    def get(self, key):
+        now = time.time()
+        with self._connection() as connection:
+            row = connection.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if self.ttl and now - row[1] > self.ttl:
+                connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key, value):
+        now = time.time()
+        with self._connection() as connection:
+            connection.execute("INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) "
+                               "VALUES (?, ?, ?, ?)", (key, value, now, now))
+            (count,) = connection.execute("SELECT COUNT(*) FROM responses").fetchone()
+            if count > self.max_entries:
+                connection.execute("DELETE FROM responses WHERE key IN "
+                                   "(SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+                                   (count - self.max_entries,))
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM responses")
+
+
+class RedisCache:
+    """
+    Responses in Redis, shared by every host. Keys expire with the TTL, a sorted set of access times
+    evicts the least recently read ones once max_entries is reached.
+    """
+    PREFIX = 'llm_cache:'
+    ACCESS_KEY = 'llm_cache:accessed'
+
+    def __init__(self, ttl, max_entries, url=None):
+        import redis
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.redis = redis.Redis.from_url(url or settings.CODE_READER_LLM_CACHE_REDIS_URL)
+
+    def get(self, key):
+        value = self.redis.get(self.PREFIX + key)
+        if value is None:
+            self.redis.zrem(self.ACCESS_KEY, key)
+            return None
+        self.redis.zadd(self.ACCESS_KEY, {key: time.time()})
+        return value.decode('utf-8')
+
+    def set(self, key, value):
+        pipeline = self.redis.pipeline()
+        pipeline.set(self.PREFIX + key, value, ex=self.ttl or None)
+        pipeline.zadd(self.ACCESS_KEY, {key: time.time()})
+        pipeline.zcard(self.ACCESS_KEY)
+        count = pipeline.execute()[-1]
+        if count > self.max_entries:
+            evicted = [key.decode('utf-8') for key, _ in self.redis.zpopmin(self.ACCESS_KEY, count - self.max_entries)]
+            if evicted:
+                self.redis.delete(*[self.PREFIX + key for key in evicted])
+
+    def clear(self):
+        keys = [self.PREFIX + key.decode('utf-8') for key in self.redis.zrange(self.ACCESS_KEY, 0, -1)]
+        if keys:
+            self.redis.delete(*keys)
+        self.redis.delete(self.ACCESS_KEY)
+
+
+BACKENDS = {'memory': MemoryCache, 'sqlite': SQLiteCache, 'redis': RedisCache}
+
+
+class ResponseCache:
+    """
+    LLM response cache with hit / miss counters. A backend failure is logged and treated as a miss,
+    the cache never breaks a call. backend=None disables caching.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.counters = {"hits": 0, "misses": 0, "bypassed": 0, "errors": 0}
+        self._lock = threading.Lock()
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def get(self, key, bypass=False):
+        if bypass or self.backend is None:
+            self._count("bypassed")
+            return None
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            print(f"LLM cache read failed: {e}")
+            self._count("errors")
+            return None
+        self._count("hits" if value is not None else "misses")
+        return value
+
+    def set(self, key, value, bypass=False):
+        if bypass or self.backend is None or value is None:
+            return
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            print(f"LLM cache write failed: {e}")
+            self._count("errors")
+
+    def get_or_call(self, key, call, bypass=False):
+        """Cached response for key, or call() stored under it."""
+        value = self.get(key, bypass)
+        if value is None:
+            value = call()
+            self.set(key, value, bypass)
+        return value
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters["hits"] + counters["misses"]
+        counters["hit_rate"] = round(counters["hits"] / lookups, 3) if lookups else 0.0
+        counters["backend"] = type(self.backend).__name__ if self.backend else None
+        return counters
+
+
+def create_backend(name=None):
+    name = settings.CODE_READER_LLM_CACHE if name is None else name
+    if not name:
+        return None
+    try:
+        return BACKENDS[name](settings.CODE_READER_LLM_CACHE_TTL, settings.CODE_READER_LLM_CACHE_MAX_ENTRIES)
+    except Exception as e:
+        print(f"LLM cache '{name}' unavailable, responses are not cached: {e}")
+        return None
+
+
+llm_cache = ResponseCache(create_backend())
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from code_reader.executor.agent_functions import get_agent_executor
+from code_reader.executor.main import get_graph
+
+
+class Command(BaseCommand):
+    help = ("Compares the per-run graph compilation and per-step agent construction the executor used to do "
+            "against the cached graph and agent. No LLM is called.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='runs / steps to time')
+
+    def timed(self, label, iterations, build):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            build()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.stdout.write(f"{label:<34} {elapsed_ms / iterations:8.3f} ms per call")
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        # what every run and every step paid before: a new graph / agent each time
+        self.timed('compile graph per run', iterations, get_graph.__wrapped__)
+        self.timed('build agent executor per step', iterations, get_agent_executor.__wrapped__)
+        get_graph()
+        get_agent_executor()
+        self.timed('cached graph', iterations, get_graph)
+        self.timed('cached agent executor', iterations, get_agent_executor)
@@ -0,0 +1,56 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from code_reader.ingestion import FileBatchWriter, content_hash
+from code_reader.models import File, Project
+
+
+class Command(BaseCommand):
+    help = "Compares rows/sec of the per-file update_or_create path against FileBatchWriter on a synthetic project."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='number of synthetic files')
+        parser.add_argument('--chunk-size', type=int, default=None, help='FileBatchWriter chunk size')
+
+    def synthetic_files(self, rows):
+        for i in range(rows):
+            content = f"def function_{i}():\n    return {i}\n" * 20
+            fingerprint = {"content_hash": content_hash(content), "size": len(content), "mtime": float(i)}
+            yield f"/synthetic/pkg_{i // 100}/module_{i}.py", f"summary of module {i}", content, fingerprint
+
+    def per_file(self, project, rows):
+        for path, summary, content, fingerprint in self.synthetic_files(rows):
+            File.objects.update_or_create(
+                path=path,
+                project=project,
+                defaults={'analysis': summary, "summary": summary, "content": content, **fingerprint}
+            )
+            project.save()
+
+    def batched(self, project, rows, chunk_size):
+        with FileBatchWriter(project, chunk_size=chunk_size) as writer:
+            for path, summary, content, fingerprint in self.synthetic_files(rows):
+                writer.add(path, summary, content, fingerprint)
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        user, _ = User.objects.get_or_create(username='benchmark-file-writes')
+        try:
+            for label, run in (('update_or_create per file', lambda p: self.per_file(p, rows)),
+                               ('FileBatchWriter', lambda p: self.batched(p, rows, options['chunk_size']))):
+                # first pass creates every row, second pass updates them
+                for phase in ('create', 'update'):
+                    project = Project.objects.get_or_create(
+                        user=user, name=f'benchmark {label}',
+                        defaults={'repo_path': '/synthetic', 'summary_output_path': '', 'summary': '',
+                                  'tree_structure': ''}
+                    )[0]
+                    started = time.perf_counter()
+                    run(project)
+                    elapsed = time.perf_counter() - started
+                    self.stdout.write(f"{label:<28} {phase:<7} {rows} rows in {elapsed:.2f}s "
+                                      f"({rows / elapsed:.0f} rows/sec)")
+        finally:
+            user.delete()
@@ -0,0 +1,61 @@
+import fnmatch
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from code_reader.ignore import DEFAULT_IGNORE_PATTERNS
+from code_reader.utils import list_files_in_repo, read_ignore_patterns
+
+
+def legacy_list_files(repo_path):
+    """The walk run_code_reader used before: list everything, then test every pattern on every file."""
+    ignore_patterns = read_ignore_patterns(repo_path) + DEFAULT_IGNORE_PATTERNS
+    repo_files = []
+    for root, dirs, files in os.walk(repo_path):
+        for file in files:
+            repo_files.append(os.path.join(root, file))
+    return [
+        file for file in repo_files
+        if not any(fnmatch.fnmatch(file, pattern) or pattern in file for pattern in ignore_patterns)
+    ]
+
+
+class Command(BaseCommand):
+    help = "Times the repository walk before/after the compiled ignore matcher, on a repo with a large node_modules."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='walk an existing repo instead of generating one')
+        parser.add_argument('--node-modules-files', type=int, default=50000,
+                            help='files generated under node_modules for the synthetic repo')
+        parser.add_argument('--source-files', type=int, default=2000, help='source files of the synthetic repo')
+
+    def generate_repo(self, root, node_modules_files, source_files):
+        for i in range(node_modules_files):
+            package = os.path.join(root, 'node_modules', f'package_{i // 50}', 'lib')
+            os.makedirs(package, exist_ok=True)
+            open(os.path.join(package, f'index_{i}.js'), 'w').close()
+        for i in range(source_files):
+            directory = os.path.join(root, 'src', f'module_{i // 20}')
+            os.makedirs(directory, exist_ok=True)
+            open(os.path.join(directory, f'file_{i}.py'), 'w').close()
+        with open(os.path.join(root, '.gitignore'), 'w') as gitignore:
+            gitignore.write("node_modules/\n*.log\n/dist\n")
+
+    def handle(self, *args, **options):
+        repo_path = options['path']
+        generated = None
+        if not repo_path:
+            generated = repo_path = tempfile.mkdtemp(prefix='benchmark-walk-')
+            self.generate_repo(repo_path, options['node_modules_files'], options['source_files'])
+        try:
+            for label, walk in (('os.walk + fnmatch', legacy_list_files), ('pruned scandir walk', list_files_in_repo)):
+                started = time.perf_counter()
+                files = walk(repo_path)
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f"{label:<20} {len(files)} files kept in {elapsed:.3f}s")
+        finally:
+            if generated:
+                shutil.rmtree(generated)
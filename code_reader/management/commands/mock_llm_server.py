@@ -0,0 +1,127 @@
+import hashlib
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+def instance_of(schema, definitions=None):
+    """Smallest JSON value matching a JSON schema: required properties only, empty arrays, placeholder strings."""
+    definitions = definitions if definitions is not None else schema.get('$defs', {})
+    if '$ref' in schema:
+        return instance_of(definitions[schema['$ref'].split('/')[-1]], definitions)
+    if 'anyOf' in schema:
+        return instance_of(schema['anyOf'][0], definitions)
+    if 'default' in schema:
+        return schema['default']
+    kind = schema.get('type')
+    if kind == 'object':
+        properties = schema.get('properties', {})
+        return {name: instance_of(properties[name], definitions) for name in schema.get('required', properties)}
+    if kind == 'array':
+        return []
+    if kind == 'string':
+        return 'mock'
+    if kind in ('integer', 'number'):
+        return 0
+    if kind == 'boolean':
+        return False
+    return None
+
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    """OpenAI compatible chat completions (plain, streamed, json_schema) and embeddings, answered locally."""
+
+    delay = 0.0
+    failure_rate = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(self.delay)
+        if random.random() < self.failure_rate:
+            return self.send_json(500, {"error": {"message": "mock failure", "type": "server_error"}})
+        if self.path.endswith('/embeddings'):
+            return self.embeddings(body)
+        if self.path.endswith('/chat/completions'):
+            return self.chat_completion(body)
+        self.send_json(404, {"error": {"message": f"unknown path {self.path}", "type": "invalid_request_error"}})
+
+    def embeddings(self, body):
+        texts = body['input'] if isinstance(body['input'], list) else [body['input']]
+        data = []
+        for index, text in enumerate(texts):
+            seed = hashlib.sha256(str(text).encode()).digest()
+            data.append({"object": "embedding", "index": index,
+                         "embedding": [(byte - 128) / 128 for byte in seed * 48][:1536]})
+        self.send_json(200, {"object": "list", "data": data, "model": body['model'],
+                             "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+
+    def chat_completion(self, body):
+        response_format = body.get('response_format') or {}
+        if response_format.get('type') == 'json_schema':
+            content = json.dumps(instance_of(response_format['json_schema']['schema']))
+        else:
+            last = body['messages'][-1]['content']
+            if isinstance(last, list):
+                last = ' '.join(part.get('text', '') for part in last)
+            content = f"mock answer to {len(last)} characters"
+        # rough token counts, about 4 characters a token
+        prompt_tokens = len(json.dumps(body['messages'])) // 4
+        completion_tokens = len(content) // 4
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        if body.get('stream'):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.end_headers()
+            for token in content.split(' '):
+                chunk = {"id": "mock", "object": "chat.completion.chunk", "created": 0, "model": body['model'],
+                         "choices": [{"index": 0, "delta": {"content": token + ' '}, "finish_reason": None}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            if (body.get('stream_options') or {}).get('include_usage'):
+                chunk = {"id": "mock", "object": "chat.completion.chunk", "created": 0, "model": body['model'],
+                         "choices": [], "usage": usage}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+        self.send_json(200, {
+            "id": "mock", "object": "chat.completion", "created": 0, "model": body['model'],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        })
+
+
+class Command(BaseCommand):
+    help = ("Serves a local OpenAI compatible mock for development and tests, "
+            "use it with OPEN_AI_BASE_URL=http://127.0.0.1:<port>/v1.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--delay', type=float, default=0.0, help='seconds before every answer')
+        parser.add_argument('--failure-rate', type=float, default=0.0, help='share of requests answered with a 500')
+
+    def handle(self, *args, **options):
+        handler = type('Handler', (MockLLMHandler,), {"delay": options['delay'],
+                                                      "failure_rate": options['failure_rate']})
+        server = ThreadingHTTPServer(('127.0.0.1', options['port']), handler)
+        self.stdout.write(f"Mock LLM server on http://127.0.0.1:{options['port']}/v1")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,49 @@
+# Generated by Django 5.1.4 on 2026-10-18 04:29
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_content_hash(apps, schema_editor):
+    # hash the stored content so existing rows are not summarized again on the next read
+    File = apps.get_model('code_reader', 'File')
+    batch = []
+    for file in File.objects.only('id', 'content').iterator(chunk_size=500):
+        file.content_hash = hashlib.sha256(file.content.encode('utf-8')).hexdigest()
+        batch.append(file)
+        if len(batch) >= 500:
+            File.objects.bulk_update(batch, ['content_hash'])
+            batch = []
+    if batch:
+        File.objects.bulk_update(batch, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('code_reader', '0003_project_files_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='file',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='mtime',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['project', 'path'], name='code_reader_project_09327b_idx'),
+        ),
+        migrations.RunPython(backfill_content_hash, migrations.RunPython.noop),
+    ]
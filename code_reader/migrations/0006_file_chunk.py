@@ -0,0 +1,29 @@
+# Generated by Django 5.1.4 on 2026-10-18 04:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('code_reader', '0005_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('symbol', models.CharField(blank=True, default='', max_length=500)),
+                ('kind', models.CharField(max_length=16)),
+                ('start_line', models.PositiveIntegerField()),
+                ('end_line', models.PositiveIntegerField()),
+                ('content', models.TextField()),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='code_reader.file')),
+            ],
+            options={
+                'ordering': ['file', 'start_line'],
+            },
+        ),
+    ]
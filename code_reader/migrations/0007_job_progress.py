@@ -0,0 +1,23 @@
+# Generated by Django 5.1.4 on 2026-10-18 04:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('code_reader', '0006_file_chunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='progress',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('ingestion', 'Ingestion'), ('executor', 'Executor')], max_length=32),
+        ),
+    ]
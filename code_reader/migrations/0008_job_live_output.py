@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('code_reader', '0007_job_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='live_output',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
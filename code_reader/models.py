@@ -1,8 +1,5 @@
-import os
-import zipfile
-
-from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 from django.contrib.auth.models import User
 
 class Project(models.Model):
@@ -20,35 +17,35 @@ class Project(models.Model):
         self._original_zip_file = self.zip_file
 
     def save(self, *args, **kwargs):
-        from .tasks import start_code_reading
-        # Check if a new zip file has been uploaded
-        if self.zip_file and self.zip_file != self._original_zip_file:
-            # Create a directory for the project in the media root
-            new_repo_path = os.path.join(settings.MEDIA_ROOT, self.name)
-            os.makedirs(new_repo_path, exist_ok=True)
-
-            # Extract the zip file into the new directory
-            with zipfile.ZipFile(self.zip_file, 'r') as zip_ref:
-                zip_ref.extractall(new_repo_path)
-
-            # Check if the extraction resulted in a single directory
-            files = os.listdir(new_repo_path)
-            if len(files) == 1 and os.path.isdir(os.path.join(new_repo_path, files[0])):
-                new_repo_path = os.path.join(new_repo_path, files[0])
-            if len(files) == 2 and os.path.isdir(os.path.join(new_repo_path, '__MACOSX')):
-                new_repo_path = os.path.join(new_repo_path, files[0] if files[0] != '__MACOSX' else files[1])
-
-            # Update the repo_path field
-            self.repo_path = new_repo_path
-
-            # Start the code reading task
-            print("starting the code reader start_code_reading")
-            start_code_reading.delay(self.id)
-
+        # a project created with its zip file has the upload as _original_zip_file already
+        zip_file_changed = self.zip_file and (self._state.adding or self.zip_file != self._original_zip_file)
         # Call the parent class save method
         super().save(*args, **kwargs)
         # Update the original zip file reference after saving
         self._original_zip_file = self.zip_file
+        # A new zip file has been uploaded, extract and read it in the background
+        if zip_file_changed:
+            self.ingestion_job = self.start_ingestion()
+
+    def start_ingestion(self):
+        """Creates the job extracting and reading the uploaded archive, queued once the transaction commits."""
+        from .tasks import ingest_project_archive
+        job = Job.objects.create(project=self, kind=Job.INGESTION)
+        print("starting the code reader ingest_project_archive")
+        transaction.on_commit(lambda: ingest_project_archive.delay(job.id))
+        return job
+
+    def start_executor(self, user_request, reference_file=''):
+        """Creates the job running the executor on the request, queued once the transaction commits."""
+        from .tasks import run_executor_job
+        job = Job.objects.create(project=self, kind=Job.EXECUTOR)
+        transaction.on_commit(lambda: run_executor_job.delay(job.id, user_request, reference_file))
+        return job
+
+    def refresh_files(self, paths):
+        """Queues the incremental refresh of files changed outside of the code reader, e.g. by the executor."""
+        from .tasks import refresh_project_files
+        transaction.on_commit(lambda: refresh_project_files.delay(self.id, list(paths)))
 
 class File(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
@@ -56,9 +53,79 @@ class File(models.Model):
     summary = models.TextField()
     content = models.TextField()
     analysis = models.TextField()
+    # fingerprint used to skip unchanged files when the project is read again
+    content_hash = models.CharField(max_length=64, blank=True, default='')
+    size = models.BigIntegerField(default=0)
+    mtime = models.FloatField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['project', 'path'])]
+
+class FileChunk(models.Model):
+    """A function, class or module-level block of a File, the unit retrieved into the prompts."""
+    file = models.ForeignKey(File, on_delete=models.CASCADE, related_name='chunks')
+    symbol = models.CharField(max_length=500, blank=True, default='')
+    kind = models.CharField(max_length=16)
+    start_line = models.PositiveIntegerField()
+    end_line = models.PositiveIntegerField()
+    content = models.TextField()
+
+    class Meta:
+        ordering = ['file', 'start_line']
 
 class ImageUpload(models.Model):
     project = models.ForeignKey(Project, on_delete=models.CASCADE)
     image = models.ImageField(upload_to='images/')
     extracted_content = models.TextField()
-    uploaded_at = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    uploaded_at = models.DateTimeField(auto_now_add=True)
+
+
+class Job(models.Model):
+    """Background work started by an API call, polled by the client through its id."""
+    INGESTION = 'ingestion'
+    EXECUTOR = 'executor'
+    KIND_CHOICES = [(INGESTION, 'Ingestion'), (EXECUTOR, 'Executor')]
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (SUCCEEDED, 'Succeeded'), (FAILED, 'Failed')]
+
+    # frequent events of which only the latest matters, e.g. the output tail of a running command
+    LIVE_EVENTS = {'command_output'}
+
+    project = models.ForeignKey(Project, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=PENDING)
+    result = models.JSONField(null=True, blank=True)
+    # events reported while running, e.g. the executor plan and steps: [{"event", "data", "at"}]
+    progress = models.JSONField(default=list, blank=True)
+    # latest of the LIVE_EVENTS, replaced as they come instead of piling up in progress: {"event", "data", "at"}
+    live_output = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def mark_running(self):
+        self.status = self.RUNNING
+        self.save(update_fields=['status', 'updated_at'])
+
+    def add_progress(self, event, data=None):
+        item = {"event": event, "data": data, "at": timezone.now().isoformat()}
+        if event in self.LIVE_EVENTS:
+            self.live_output = item
+            self.save(update_fields=['live_output', 'updated_at'])
+            return
+        self.progress.append(item)
+        self.save(update_fields=['progress', 'updated_at'])
+
+    def mark_succeeded(self, result=None):
+        self.status = self.SUCCEEDED
+        self.result = result
+        self.save(update_fields=['status', 'result', 'updated_at'])
+
+    def mark_failed(self, error):
+        self.status = self.FAILED
+        self.error = str(error)
+        self.save(update_fields=['status', 'error', 'updated_at'])
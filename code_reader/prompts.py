@@ -0,0 +1,159 @@
+# code_reader/prompts.py
+
+from functools import lru_cache
+
+import tiktoken
+from django.conf import settings
+
+TRUNCATION_MARKER = '\n...[truncated]...\n'
+# used when no tiktoken encoding can be loaded (they are downloaded on first use)
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    """tiktoken encoding of the model, None when it cannot be loaded; counting then falls back to an estimate."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        try:
+            return tiktoken.get_encoding('o200k_base')
+        except Exception as e:
+            print(f"No tiktoken encoding available, estimating token counts: {e}")
+    except Exception as e:
+        print(f"No tiktoken encoding available for {model}, estimating token counts: {e}")
+    return None
+
+
+def count_tokens(text, model='gpt-4o'):
+    encoding = get_encoding(model)
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens, model='gpt-4o', keep='head'):
+    """
+    Cuts text down to max_tokens (marker included), keeping its beginning (keep='head') or,
+    for things like conversation history where the latest part matters most, its end (keep='tail').
+    """
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    budget = max_tokens - count_tokens(TRUNCATION_MARKER, model)
+    if budget <= 0:
+        return ''
+    encoding = get_encoding(model)
+    if encoding is None:
+        size = budget * CHARS_PER_TOKEN
+        kept = text[:size] if keep == 'head' else text[-size:]
+    else:
+        tokens = encoding.encode(text, disallowed_special=())
+        kept = encoding.decode(tokens[:budget] if keep == 'head' else tokens[-budget:])
+    return kept + TRUNCATION_MARKER if keep == 'head' else TRUNCATION_MARKER + kept
+
+
+class PromptBuilder:
+    """
+    Fits the variable sections of a prompt (project summary, tree, code context, history...) into a
+    token budget.
+
+    Sections are filled in the order they are added, each up to min(its size, its share of the budget,
+    what is left); budget left over is then handed back, in the same order, to the sections that got
+    cut. Text sections are truncated, item sections (ranked lists, e.g. retrieved chunks) keep the
+    best items that fit. The outcome only depends on the inputs.
+
+    Usage:
+        builder = PromptBuilder(model='gpt-4o')
+        builder.add('summary', project.summary, share=0.2)
+        builder.add_items('code', chunks, render=lambda kept: str(group_by_file(kept)))
+        sections = builder.build()
+        prompt = f"...{sections['summary']}...{sections['code']}..."
+        builder.token_counts(prompt)  # per section, plus the total of the final prompt
+    """
+
+    def __init__(self, model='gpt-4o', max_tokens=None):
+        self.model = model
+        self.max_tokens = max_tokens or settings.CODE_READER_PROMPT_MAX_TOKENS
+        self.sections = []
+        self.required = {}
+        self.counts = {}
+
+    def require(self, name, text):
+        """A section always included as is (e.g. the user query), taken off the budget first."""
+        text = str(text)
+        self.required[name] = text
+        return self
+
+    def add(self, name, text, share=1.0, keep='head'):
+        self.sections.append({"name": name, "text": str(text or ''), "share": share, "keep": keep})
+        return self
+
+    def add_items(self, name, items, render=str, share=1.0):
+        """
+        Ranked items (best first), rendered together by render(kept_items). The best items fitting the
+        allowance are kept, a too big item is skipped for the smaller ones after it.
+        """
+        self.sections.append({"name": name, "items": list(items), "render": render, "share": share})
+        return self
+
+    def _fit(self, section, allowance):
+        """(rendered text, tokens) of the section within allowance tokens."""
+        if "items" not in section:
+            text = truncate_to_tokens(section["text"], allowance, self.model, section["keep"])
+            return text, count_tokens(text, self.model)
+        kept = []
+        rendered, tokens = section["render"]([]), count_tokens(section["render"]([]), self.model)
+        for item in section["items"]:
+            candidate = section["render"](kept + [item])
+            candidate_tokens = count_tokens(candidate, self.model)
+            if candidate_tokens <= allowance:
+                kept.append(item)
+                rendered, tokens = candidate, candidate_tokens
+        section["kept"] = len(kept)
+        return rendered, tokens
+
+    def _full_size(self, section):
+        if "items" in section:
+            return count_tokens(section["render"](section["items"]), self.model)
+        return count_tokens(section["text"], self.model)
+
+    def build(self):
+        """Returns section name -> text to put in the prompt."""
+        self.counts = {name: count_tokens(text, self.model) for name, text in self.required.items()}
+        remaining = max(self.max_tokens - sum(self.counts.values()), 0)
+        results = {}
+        cut = []
+        for section in self.sections:
+            full_size = self._full_size(section)
+            allowance = min(full_size, int(self.max_tokens * section["share"]), remaining)
+            results[section["name"]] = self._fit(section, allowance)
+            remaining -= results[section["name"]][1]
+            if results[section["name"]][1] < full_size:
+                cut.append((section, full_size))
+        # leftover budget goes back to the sections that were cut, in order
+        for section, full_size in cut:
+            if remaining <= 0:
+                break
+            previous_tokens = results[section["name"]][1]
+            results[section["name"]] = self._fit(section, min(full_size, previous_tokens + remaining))
+            remaining -= results[section["name"]][1] - previous_tokens
+
+        sections = dict(self.required)
+        for name, (text, tokens) in results.items():
+            sections[name] = text
+            self.counts[name] = tokens
+        return sections
+
+    def token_counts(self, prompt=None):
+        """
+        Tokens of every section as built, plus the total of the final prompt when given
+        (the template text around the sections included).
+        """
+        counts = dict(self.counts)
+        if prompt is not None:
+            counts["total"] = count_tokens(prompt, self.model)
+        for section in self.sections:
+            if "kept" in section:
+                counts[f"{section['name']}_items_kept"] = section["kept"]
+                counts[f"{section['name']}_items_total"] = len(section["items"])
+        return counts
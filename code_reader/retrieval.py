@@ -0,0 +1,264 @@
+# code_reader/retrieval.py
+
+import json
+import os
+import re
+import threading
+import zlib
+
+import numpy as np
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from code_reader.chunking import replace_file_chunks
+from code_reader.models import File, FileChunk
+
+# kinds of index entries
+SUMMARY = 'summary'
+CHUNK = 'chunk'
+
+# bumped when the entries change shape, an index saved by an older version is rebuilt
+INDEX_VERSION = 2
+MAX_EMBEDDING_CHARS = 8000
+
+
+class OpenAIEmbedder:
+    """Embeds texts with the OpenAI embeddings endpoint, in batches."""
+
+    def __init__(self, model=None, batch_size=100):
+        from code_reader.llm import client
+        self.client = client
+        self.model = model or settings.CODE_READER_EMBEDDING_MODEL
+        self.batch_size = batch_size
+
+    def __call__(self, texts):
+        vectors = []
+        for start in range(0, len(texts), self.batch_size):
+            response = self.client.embeddings.create(model=self.model, input=texts[start:start + self.batch_size])
+            vectors.extend(item.embedding for item in response.data)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+class HashingEmbedder:
+    """
+    Deterministic local embedder (feature hashing of identifiers and their sub-words), no network needed.
+    Useful offline and in tests; retrieval quality is keyword level.
+    """
+
+    def __init__(self, dimensions=1024):
+        self.dimensions = dimensions
+
+    @staticmethod
+    def tokens(text):
+        for word in re.findall(r'[A-Za-z_][A-Za-z0-9_]*|\d+', text):
+            yield word.lower()
+            # snake_case and camelCase parts
+            for part in re.findall(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+', word):
+                if part.lower() != word.lower():
+                    yield part.lower()
+
+    def __call__(self, texts):
+        vectors = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for token in self.tokens(text):
+                digest = zlib.crc32(token.encode('utf-8'))
+                vectors[row, digest % self.dimensions] += 1.0 if digest & 0x80000000 else -1.0
+        return vectors
+
+
+def get_embedder():
+    return import_string(settings.CODE_READER_EMBEDDER)()
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def file_entries(path, summary, chunks):
+    """Texts indexed for one file: its summary, then each of its FileChunk rows (as dicts)."""
+    entries = []
+    if summary:
+        entries.append(({"path": path, "kind": SUMMARY, "chunk_id": None, "symbol": '', "start_line": 0,
+                         "end_line": 0}, f"{path}\n{summary}"[:MAX_EMBEDDING_CHARS]))
+    for chunk in chunks:
+        entries.append(({"path": path, "kind": CHUNK, "chunk_id": chunk['id'], "symbol": chunk['symbol'],
+                         "start_line": chunk['start_line'], "end_line": chunk['end_line']},
+                        f"{path}:{chunk['start_line']}-{chunk['end_line']} {chunk['symbol']}\n"
+                        f"{chunk['content']}"[:MAX_EMBEDDING_CHARS]))
+    return entries
+
+
+class VectorIndex:
+    """
+    Cosine similarity index of a project: a normalized float32 matrix plus one metadata dict per row.
+    hashes keeps the content_hash of every indexed file so update() only re-embeds the files that changed.
+    """
+
+    def __init__(self, vectors=None, entries=None, hashes=None):
+        self.vectors = vectors if vectors is not None else np.zeros((0, 0), dtype=np.float32)
+        self.entries = entries or []
+        self.hashes = hashes or {}
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data['meta']))
+            if meta.get('version') != INDEX_VERSION:
+                return cls()
+            return cls(data['vectors'], meta['entries'], meta['hashes'])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        meta = json.dumps({"version": INDEX_VERSION, "entries": self.entries, "hashes": self.hashes})
+        np.savez(tmp_path, vectors=self.vectors, meta=np.array(meta))
+        os.replace(tmp_path, path)
+
+    def remove_paths(self, paths):
+        paths = set(paths)
+        if not paths:
+            return
+        keep = [i for i, entry in enumerate(self.entries) if entry["path"] not in paths]
+        self.vectors = self.vectors[keep] if len(self.vectors) else self.vectors
+        self.entries = [self.entries[i] for i in keep]
+        for path in paths:
+            self.hashes.pop(path, None)
+
+    def add(self, entries, vectors):
+        vectors = normalize(np.asarray(vectors, dtype=np.float32))
+        self.vectors = np.vstack([self.vectors, vectors]) if len(self.entries) else vectors
+        self.entries.extend(entries)
+
+    def search(self, query_vector, k=10, kind=None):
+        """Top-k entries by cosine similarity, as (score, entry) pairs."""
+        if not self.entries:
+            return []
+        query_vector = normalize(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+        scores = self.vectors @ query_vector
+        if kind:
+            scores = np.where([entry["kind"] == kind for entry in self.entries], scores, -np.inf)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]), self.entries[i]) for i in top if np.isfinite(scores[i])]
+
+
+_indexes = {}
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def index_path(project_id):
+    return os.path.join(settings.CODE_READER_INDEX_DIR, f"project_{project_id}.npz")
+
+
+def _project_lock(project_id):
+    with _locks_lock:
+        return _locks.setdefault(project_id, threading.Lock())
+
+
+def load_project_index(project_id):
+    """The persisted index of the project, cached in-process until the file on disk changes."""
+    path = index_path(project_id)
+    if not os.path.exists(path):
+        return VectorIndex()
+    mtime = os.stat(path).st_mtime
+    cached = _indexes.get(project_id)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    index = VectorIndex.load(path)
+    _indexes[project_id] = (mtime, index)
+    return index
+
+
+def update_project_index(project, embedder=None, stale_paths=()):
+    """
+    Brings the index of the project in line with its File rows: files whose content_hash changed are
+    re-embedded, deleted ones dropped. Only the changed rows are fetched with their chunks; files
+    read before chunks existed get theirs built on the way.
+    stale_paths are re-embedded whatever their hash, for files whose summary or chunks were rewritten.
+    """
+    with _project_lock(project.id):
+        index = load_project_index(project.id)
+        current = dict(File.objects.filter(project=project).values_list('path', 'content_hash'))
+        stale_paths = set(stale_paths)
+        changed = [path for path, digest in current.items()
+                   if path in stale_paths or path not in index.hashes or index.hashes[path] != digest]
+        removed = [path for path in index.hashes if path not in current]
+        if not changed and not removed:
+            return index
+
+        # work on a copy, searches may be reading the cached index meanwhile
+        index = VectorIndex(index.vectors, list(index.entries), dict(index.hashes))
+        index.remove_paths(changed + removed)
+        entries, texts, hashes = [], [], {}
+        for start in range(0, len(changed), 500):
+            rows = list(File.objects.filter(project=project, path__in=changed[start:start + 500]).values(
+                'id', 'path', 'summary', 'content_hash'))
+            chunks = {}
+            for chunk in FileChunk.objects.filter(file_id__in=[row['id'] for row in rows]).values(
+                    'id', 'file_id', 'symbol', 'start_line', 'end_line', 'content'):
+                chunks.setdefault(chunk['file_id'], []).append(chunk)
+            unchunked = [row['id'] for row in rows if row['id'] not in chunks]
+            if unchunked:
+                replace_file_chunks(list(File.objects.filter(id__in=unchunked).values_list('id', 'path', 'content')))
+                for chunk in FileChunk.objects.filter(file_id__in=unchunked).values(
+                        'id', 'file_id', 'symbol', 'start_line', 'end_line', 'content'):
+                    chunks.setdefault(chunk['file_id'], []).append(chunk)
+            for row in rows:
+                for entry, text in file_entries(row['path'], row['summary'], chunks.get(row['id'], [])):
+                    entries.append(entry)
+                    texts.append(text)
+                hashes[row['path']] = row['content_hash']
+        if texts:
+            index.add(entries, (embedder or get_embedder())(texts))
+        index.hashes.update(hashes)
+        path = index_path(project.id)
+        index.save(path)
+        _indexes[project.id] = (os.stat(path).st_mtime, index)
+        print(f"index of project {project.id}: {len(changed)} files embedded, {len(removed)} removed, "
+              f"{len(index.entries)} entries")
+        return index
+
+
+def retrieve_chunks(project, query, k=None, embedder=None):
+    """
+    The chunks most relevant to the query, best first.
+
+    Returns:
+    list: dicts {"path", "summary", "symbol", "lines", "content"}, "summary" being the one of the chunk's file.
+    """
+    k = k or settings.CODE_READER_RETRIEVAL_TOP_CHUNKS
+    embedder = embedder or get_embedder()
+    index = load_project_index(project.id)
+    if not index.entries:
+        index = update_project_index(project, embedder)
+    query_vector = embedder([query])[0]
+    chunk_ids = [entry["chunk_id"] for _, entry in index.search(query_vector, k=k, kind=CHUNK)]
+    rows = FileChunk.objects.filter(id__in=chunk_ids, file__project=project).values(
+        'id', 'file__path', 'file__summary', 'symbol', 'start_line', 'end_line', 'content')
+    by_id = {row['id']: row for row in rows}
+    # chunks missing from the table belong to files changed since the index was saved
+    return [{"path": by_id[chunk_id]['file__path'], "summary": by_id[chunk_id]['file__summary'],
+             "symbol": by_id[chunk_id]['symbol'], "start_line": by_id[chunk_id]['start_line'],
+             "lines": f"{by_id[chunk_id]['start_line']}-{by_id[chunk_id]['end_line']}",
+             "content": by_id[chunk_id]['content']}
+            for chunk_id in chunk_ids if chunk_id in by_id]
+
+
+def group_by_file(chunks):
+    """
+    Ranked chunks as prompt context: one dict per file in the order of its best chunk,
+    {"path", "summary", "chunks": [{"symbol", "lines", "content"}]} with the chunks in line order.
+    """
+    files = {}
+    for chunk in chunks:
+        files.setdefault(chunk["path"], {"path": chunk["path"], "summary": chunk["summary"], "chunks": []})
+        files[chunk["path"]]["chunks"].append(chunk)
+    for entry in files.values():
+        entry["chunks"] = [{"symbol": chunk["symbol"], "lines": chunk["lines"], "content": chunk["content"]}
+                           for chunk in sorted(entry["chunks"], key=lambda chunk: chunk["start_line"])]
+    return list(files.values())
+
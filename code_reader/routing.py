@@ -0,0 +1,154 @@
+# code_reader/routing.py
+
+import threading
+import time
+from functools import lru_cache
+
+from langchain_core.callbacks import BaseCallbackHandler
+from django.conf import settings
+
+from code_reader.llm import chat_model
+
+# Call sites of the models, each dispatched to the model CODE_READER_MODEL_ROUTES gives it
+PLANNING = 'planning'            # executor plan
+STEP = 'step'                    # executor agent running one plan step
+FEEDBACK = 'feedback'            # feedback analyzer after the steps
+CODE_EDIT = 'code_edit'          # code_editor tool
+SUMMARIZATION = 'summarization'  # file, project and conversation summaries
+ANSWER = 'answer'                # Q&A and supervisor answers shown to the user
+ROUTE_DEFAULTS = {
+    PLANNING: 'gpt-4o',
+    STEP: 'gpt-4o-mini',
+    FEEDBACK: 'gpt-4o-mini',
+    CODE_EDIT: 'gpt-4o',
+    SUMMARIZATION: 'gpt-4o-mini',
+    ANSWER: 'gpt-4o',
+}
+
+
+def parse_routes(value):
+    """'step=gpt-4o-mini,feedback=gpt-4o' -> {'step': 'gpt-4o-mini', 'feedback': 'gpt-4o'}"""
+    routes = {}
+    for item in value.split(','):
+        if '=' in item:
+            route, model = item.split('=', 1)
+            routes[route.strip()] = model.strip()
+    return routes
+
+
+def route_model(route, escalated=False):
+    """Name of the model the route is dispatched to, the escalation model once the route escalated."""
+    if escalated:
+        return settings.CODE_READER_ESCALATION_MODEL
+    return parse_routes(settings.CODE_READER_MODEL_ROUTES).get(route) or ROUTE_DEFAULTS.get(route) \
+        or settings.CODE_READER_ESCALATION_MODEL
+
+
+def can_escalate(route):
+    """False when the route already runs on the escalation model."""
+    return route_model(route) != settings.CODE_READER_ESCALATION_MODEL
+
+
+def low_confidence(result):
+    """Whether a structured answer rates itself below CODE_READER_ESCALATION_CONFIDENCE, see invoke_model."""
+    confidence = getattr(result, 'confidence', None)
+    return confidence is not None and confidence < settings.CODE_READER_ESCALATION_CONFIDENCE
+
+
+class RouteMetrics:
+    """Per route counters of this process: model calls, errors, escalations, latency and tokens."""
+
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def _counters(self, route):
+        return self._routes.setdefault(route, {"calls": 0, "errors": 0, "escalations": 0, "seconds": 0.0,
+                                               "prompt_tokens": 0, "completion_tokens": 0, "models": {}})
+
+    def record(self, route, model, seconds, prompt_tokens=0, completion_tokens=0, error=False):
+        with self._lock:
+            counters = self._counters(route)
+            counters["calls"] += 1
+            counters["errors"] += int(error)
+            counters["seconds"] += seconds
+            counters["prompt_tokens"] += prompt_tokens or 0
+            counters["completion_tokens"] += completion_tokens or 0
+            counters["models"][model] = counters["models"].get(model, 0) + 1
+
+    def escalated(self, route):
+        with self._lock:
+            self._counters(route)["escalations"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = {route: {**counters, "models": dict(counters["models"])}
+                     for route, counters in self._routes.items()}
+        for counters in stats.values():
+            calls = counters["calls"]
+            counters["avg_latency_ms"] = round(counters["seconds"] * 1000 / calls, 1) if calls else 0.0
+            counters["seconds"] = round(counters["seconds"], 3)
+        return stats
+
+
+route_metrics = RouteMetrics()
+
+
+def route_stats():
+    return route_metrics.stats()
+
+
+def token_usage(response):
+    """(prompt_tokens, completion_tokens) of a LangChain LLMResult."""
+    usage = (response.llm_output or {}).get('token_usage') or {}
+    if usage:
+        return usage.get('prompt_tokens', 0), usage.get('completion_tokens', 0)
+    prompt_tokens = completion_tokens = 0
+    for generations in response.generations:
+        for generation in generations:
+            metadata = getattr(getattr(generation, 'message', None), 'usage_metadata', None) or {}
+            prompt_tokens += metadata.get('input_tokens', 0)
+            completion_tokens += metadata.get('output_tokens', 0)
+    return prompt_tokens, completion_tokens
+
+
+class RouteMetricsHandler(BaseCallbackHandler):
+    """Records every call of a routed chat model on its route, whoever makes it: invoke_model, agents, chains, memory."""
+
+    def __init__(self, route, model):
+        self.route = route
+        self.model = model
+        self._started = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._started[run_id] = time.monotonic()
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._started[run_id] = time.monotonic()
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            route_metrics.record(self.route, self.model, time.monotonic() - started, *token_usage(response))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        started = self._started.pop(run_id, None)
+        if started is not None:
+            route_metrics.record(self.route, self.model, time.monotonic() - started, error=True)
+
+
+@lru_cache(maxsize=None)
+def route_chat_model(route, temperature=0.7, escalated=False):
+    """
+    The LangChain chat model of a route: the shared chat_model of its model (same pooled clients) with
+    the route's metrics callback attached.
+    """
+    model = route_model(route, escalated)
+    return chat_model(model, temperature).model_copy(update={"callbacks": [RouteMetricsHandler(route, model)]})
+
+
+def record_completion(route, model, started, response=None, error=False):
+    """Records a call made with the OpenAI client directly, response being its ChatCompletion (or last chunk)."""
+    usage = getattr(response, 'usage', None)
+    route_metrics.record(route, model, time.monotonic() - started,
+                         getattr(usage, 'prompt_tokens', 0), getattr(usage, 'completion_tokens', 0), error=error)
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Project, File
+from .models import Project, File, Job
 from django.contrib.auth.models import User
 
 class ProjectSerializer(serializers.ModelSerializer):
@@ -20,6 +20,16 @@ class FileSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 
+class JobSerializer(serializers.ModelSerializer):
+    """
+    Serializer for Job model, polled by the client to follow a background job.
+    """
+    class Meta:
+        model = Job
+        fields = ['id', 'project', 'kind', 'status', 'progress', 'live_output', 'result', 'error', 'created_at',
+                  'updated_at']
+
+
 class DocumentDetailFetchSerializer(serializers.Serializer):
     """
     Serializer for fetching document details based on project ID and specific fields.
@@ -0,0 +1,86 @@
+# code_reader/streaming.py
+
+import json
+import time
+
+from django.http import StreamingHttpResponse
+
+from code_reader.models import Job
+
+
+def sse_event(event, data):
+    """One server-sent event, data serialized as JSON."""
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+class StreamTimer:
+    """Milliseconds since the request came in, for the first byte, the first token and the end of a stream."""
+
+    def __init__(self, started_at=None):
+        self.started_at = started_at or time.monotonic()
+        self.timings = {}
+
+    def elapsed_ms(self):
+        return round((time.monotonic() - self.started_at) * 1000, 1)
+
+    def mark(self, name):
+        """Records the first occurrence of name only."""
+        self.timings.setdefault(name, self.elapsed_ms())
+
+
+def event_stream(events, timer, name):
+    """
+    Serializes (event, data) pairs as SSE. TTFB (ttfb_ms, the first event out) and the first 'token'
+    event (first_token_ms) are measured against timer and reported in the final 'done' event.
+    An exception ends the stream with an 'error' event.
+    """
+    try:
+        for event, data in events:
+            timer.mark('ttfb_ms')
+            if event == 'token':
+                timer.mark('first_token_ms')
+            yield sse_event(event, data)
+        timer.mark('total_ms')
+        print(f"{name} stream timings: {timer.timings}")
+        yield sse_event('done', {"timings": timer.timings})
+    except Exception as e:
+        print(f"{name} stream failed: {e}")
+        yield sse_event('error', {"error": str(e), "timings": timer.timings})
+
+
+def sse_response(events, timer, name):
+    response = StreamingHttpResponse(event_stream(events, timer, name), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # nginx would otherwise buffer the whole response
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def job_events(job_id, poll_interval=0.5, heartbeat_interval=15):
+    """
+    Yields the (event, data) progress of a job as its worker saves it, then ('job_finished', status and
+    result). A 'heartbeat' is sent during long silent steps so proxies keep the connection open.
+    """
+    seen = 0
+    live_seen = None
+    last_event_at = time.monotonic()
+    while True:
+        job = Job.objects.filter(id=job_id).values('status', 'progress', 'live_output', 'result', 'error').get()
+        for item in job['progress'][seen:]:
+            yield item['event'], item['data']
+            last_event_at = time.monotonic()
+        seen = len(job['progress'])
+        # only the latest output tail is kept, sent again whenever it was replaced
+        live = job['live_output']
+        if live and live != live_seen:
+            yield live['event'], live['data']
+            live_seen = live
+            last_event_at = time.monotonic()
+        if job['status'] in (Job.SUCCEEDED, Job.FAILED):
+            yield 'job_finished', {"job_id": job_id, "status": job['status'], "result": job['result'],
+                                   "error": job['error']}
+            return
+        if time.monotonic() - last_event_at > heartbeat_interval:
+            yield 'heartbeat', {}
+            last_event_at = time.monotonic()
+        time.sleep(poll_interval)
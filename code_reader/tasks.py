@@ -1,11 +1,102 @@
+import os
+
 from celery import shared_task
-from .utils import run_code_reader
-from .models import Project
+from celery.signals import worker_process_init
+from django.conf import settings
+from .archive import extract_archive
+from .utils import run_code_reader, refresh_changed_files
+from .executor.main import call_executor, get_graph
+from .executor.agent_functions import get_agent_executor
+from .models import Project, Job
+from .conversations import summarize_older_messages
+from conversation.models import Conversation
+
+@worker_process_init.connect
+def warm_up_executor(**kwargs):
+    """Compiles the executor graph and builds its agent as a worker process starts, not in its first run."""
+    get_graph()
+    get_agent_executor()
+
 
 @shared_task
 def start_code_reading(project_id):
+    """
+    Kept for the tasks queued before Project.save started ingestion jobs: hands the project over to
+    ingest_project_archive through a job instead of reading it here.
+    """
     try:
         project = Project.objects.get(id=project_id)
-        run_code_reader(project)
     except Project.DoesNotExist:
-        print(f'Project with id {project_id} does not exist')
\ No newline at end of file
+        print(f'Project with id {project_id} does not exist')
+        return
+    if not project.zip_file:
+        print(f'Project with id {project_id} has no archive to ingest')
+        return
+    job = project.start_ingestion()
+    print(f'Ingestion of project {project_id} moved to job {job.id}')
+
+
+@shared_task
+def ingest_project_archive(job_id):
+    """Extracts the uploaded zip of the project and feeds the extracted contents straight to the code reader."""
+    try:
+        job = Job.objects.select_related('project').get(id=job_id)
+    except Job.DoesNotExist:
+        print(f'Job with id {job_id} does not exist')
+        return
+    job.mark_running()
+    try:
+        project = job.project
+        destination = os.path.join(settings.MEDIA_ROOT, project.name)
+        repo_path, file_contents = extract_archive(project.zip_file.path, destination)
+        project.repo_path = repo_path
+        project.save(update_fields=['repo_path'])
+        stats = run_code_reader(project, file_contents=file_contents)
+        job.mark_succeeded(stats)
+    except Exception as e:
+        print(f'Ingestion job {job_id} failed: {e}')
+        job.mark_failed(e)
+
+
+@shared_task
+def run_executor_job(job_id, user_request, reference_file=''):
+    """
+    Runs the executor graph on the request outside of the web workers. The plan and step progress are
+    saved on the job as they happen, the size of the worker pool bounds the executor runs in parallel.
+    """
+    try:
+        job = Job.objects.select_related('project').get(id=job_id)
+    except Job.DoesNotExist:
+        print(f'Job with id {job_id} does not exist')
+        return
+    job.mark_running()
+    try:
+        project = job.project
+        result = call_executor(project.repo_path, user_request, project, reference_file, on_event=job.add_progress)
+        job.mark_succeeded({"result": result})
+    except Exception as e:
+        print(f'Executor job {job_id} failed: {e}')
+        job.mark_failed(e)
+
+
+@shared_task
+def refresh_project_files(project_id, paths):
+    """Brings the summaries, chunks, index and tree of the project up to date with the given changed paths."""
+    try:
+        project = Project.objects.get(id=project_id)
+    except Project.DoesNotExist:
+        print(f'Project with id {project_id} does not exist')
+        return
+    return refresh_changed_files(project, paths)
+
+
+@shared_task
+def summarize_conversation(conversation_id):
+    """Folds the older messages of a conversation into its summary, after the answer was sent."""
+    try:
+        conversation = Conversation.objects.get(id=conversation_id)
+    except Conversation.DoesNotExist:
+        print(f'Conversation with id {conversation_id} does not exist')
+        return
+    folded = summarize_older_messages(conversation)
+    print(f'{folded} messages of conversation {conversation.conversation_id} summarized')
@@ -0,0 +1,309 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import httpx
+from openai import APIConnectionError
+
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase
+
+from code_reader import llm
+from code_reader.executor import changes
+from code_reader.executor.changes import ChangeTracker
+from code_reader.executor.context import ExecutionContext, current_context, use_context
+from code_reader.executor.utils import with_sentinel
+from code_reader.ingestion import ADDED, CHANGED, EMPTY_FILE_SUMMARY, RateLimiter, call_with_retries, diff_files, \
+    file_fingerprint, summarize_files
+from code_reader.models import Job, Project
+from code_reader.streaming import job_events
+
+
+class ExecutionContextIsolationTests(SimpleTestCase):
+    """Two executor runs in parallel threads of one process never see each other's state."""
+
+    ROUNDS = 50
+
+    def setUp(self):
+        self.roots = {name: tempfile.mkdtemp(prefix=f"run_{name}_") for name in ("a", "b")}
+        for root in self.roots.values():
+            os.makedirs(os.path.join(root, "sub"))
+        self.events = {name: [] for name in self.roots}
+        self.contexts = {
+            name: ExecutionContext(name, root, on_event=lambda event, data, name=name: self.events[name].append(data))
+            for name, root in self.roots.items()
+        }
+
+    def tearDown(self):
+        for root in self.roots.values():
+            shutil.rmtree(root, ignore_errors=True)
+
+    def run_in_thread(self, name, barrier, errors):
+        context = self.contexts[name]
+        root = self.roots[name]
+        try:
+            with use_context(context):
+                for round_ in range(self.ROUNDS):
+                    # both runs act at the same time each round
+                    barrier.wait()
+                    self.assertIs(current_context(), context)
+                    context.change_directory("sub" if round_ % 2 == 0 else "..")
+                    expected = os.path.join(root, "sub") if round_ % 2 == 0 else root
+                    self.assertEqual(current_context().working_directory, expected)
+                    self.assertEqual(current_context().resolve("file.py"), os.path.join(expected, "file.py"))
+                    current_context().output_buffer.append(f"{name}:{round_}\n")
+                    current_context().emit("command_output", {"run": name, "round": round_})
+                    barrier.wait()
+                    self.assertEqual(current_context().take_output(), f"{name}:{round_}\n")
+        except Exception as e:
+            errors.append(e)
+            barrier.abort()
+
+    def test_parallel_runs_keep_their_own_state(self):
+        barrier = threading.Barrier(len(self.contexts))
+        errors = []
+        threads = [threading.Thread(target=self.run_in_thread, args=(name, barrier, errors)) for name in self.contexts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=30)
+        self.assertEqual(errors, [])
+        for name, events in self.events.items():
+            self.assertEqual(events, [{"run": name, "round": round_} for round_ in range(self.ROUNDS)])
+            self.assertEqual(len(self.contexts[name].output_buffer), 0)
+
+    def test_no_context_outside_a_run(self):
+        with use_context(self.contexts["a"]):
+            self.assertIs(current_context(), self.contexts["a"])
+            with use_context(self.contexts["b"]):
+                self.assertIs(current_context(), self.contexts["b"])
+            self.assertIs(current_context(), self.contexts["a"])
+        with self.assertRaises(RuntimeError):
+            current_context()
+
+    def test_new_thread_does_not_inherit_the_run(self):
+        seen = []
+
+        def probe():
+            try:
+                seen.append(current_context())
+            except RuntimeError:
+                seen.append(None)
+
+        with use_context(self.contexts["a"]):
+            thread = threading.Thread(target=probe)
+            thread.start()
+            thread.join()
+        self.assertEqual(seen, [None])
+
+
+@unittest.skipIf(changes.Inotify is None, "inotify is only available on Linux")
+class ChangeTrackerWatchTests(SimpleTestCase):
+    """The tracker watches the directories kept by the ignore rules, never the ignored trees."""
+
+    def setUp(self):
+        self.root = os.path.realpath(tempfile.mkdtemp(prefix="tracked_"))
+        for directory in ("src/pkg", "node_modules/lib/deep", ".git/objects"):
+            os.makedirs(os.path.join(self.root, directory))
+        self.tracker = ChangeTracker(self.root).start()
+
+    def tearDown(self):
+        self.tracker.stop()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def path(self, relative_path):
+        return os.path.join(self.root, relative_path)
+
+    def write(self, relative_path):
+        with open(self.path(relative_path), "w") as file:
+            file.write("x = 1\n")
+
+    def changed_paths(self):
+        # the events are read on the thread of the tracker
+        time.sleep(0.5)
+        return self.tracker.stop()
+
+    def test_ignored_directories_get_no_watch(self):
+        self.assertEqual(self.tracker.watched, {self.root, self.path("src"), self.path("src/pkg")})
+
+    def test_new_directories_are_watched_unless_ignored(self):
+        os.makedirs(self.path("src/new/inner"))
+        os.makedirs(self.path("node_modules/fresh"))
+        time.sleep(0.5)
+        self.write("src/new/inner/module.py")
+        self.write("node_modules/fresh/index.js")
+        changed = self.changed_paths()
+        self.assertIn(self.path("src/new/inner"), self.tracker.watched)
+        self.assertNotIn(self.path("node_modules/fresh"), self.tracker.watched)
+        self.assertEqual(changed, [self.path("src/new/inner/module.py")])
+
+    def test_files_of_a_directory_created_at_once_are_recorded(self):
+        os.makedirs(self.path("src/a/b/c"))
+        self.write("src/a/b/c/module.py")
+        self.assertEqual(self.changed_paths(), [self.path("src/a/b/c/module.py")])
+
+    def test_moved_and_deleted_directories_are_recorded(self):
+        self.write("src/pkg/module.py")
+        time.sleep(0.5)
+        os.rename(self.path("src/pkg"), self.path("src/renamed"))
+        shutil.rmtree(self.path("src/renamed"))
+        self.assertEqual(self.changed_paths(),
+                         [self.path("src/pkg"), self.path("src/pkg/module.py"), self.path("src/renamed"),
+                          self.path("src/renamed/module.py")])
+
+
+class SentinelTests(SimpleTestCase):
+    """The completion marker is printed whatever the end of the command looks like."""
+
+    MARKER = "__CMD_DONE_test"
+
+    def run_in_bash(self, command):
+        result = subprocess.run(["bash"], input=with_sentinel(command, self.MARKER) + "\n",
+                                capture_output=True, text=True, timeout=10)
+        return result.stdout
+
+    def assertMarker(self, command, status=0):
+        self.assertIn(f"{self.MARKER}:{status}", self.run_in_bash(command))
+
+    def test_plain_command(self):
+        self.assertMarker("true")
+        self.assertMarker("false", status=1)
+
+    def test_trailing_semicolon(self):
+        self.assertMarker("echo hi;")
+
+    def test_trailing_comment(self):
+        self.assertMarker("echo hi # say hi")
+
+    def test_trailing_line_continuation(self):
+        self.assertMarker("echo hi \\")
+        self.assertIn("a\\", self.run_in_bash("echo a\\\\"))
+
+    def test_background_command(self):
+        self.assertMarker("sleep 0 &")
+
+    def test_heredoc(self):
+        self.assertMarker("cat <<EOF\nhello\nEOF\n")
+
+
+class JobProgressTests(TestCase):
+    """Command output replaces the previous tail instead of growing the saved progress."""
+
+    def setUp(self):
+        user = User.objects.create(username="runner")
+        self.job = Job.objects.create(project=Project.objects.create(user=user, name="demo"), kind=Job.EXECUTOR)
+
+    def test_command_output_is_kept_out_of_progress(self):
+        self.job.add_progress("plan_created", {"plan": ["step"]})
+        for index in range(50):
+            self.job.add_progress("command_output", {"command": "pip install", "output": f"line {index}"})
+        self.job.refresh_from_db()
+        self.assertEqual([item["event"] for item in self.job.progress], ["plan_created"])
+        self.assertEqual(self.job.live_output["data"]["output"], "line 49")
+
+    def test_stream_sends_the_latest_output(self):
+        self.job.add_progress("plan_created", {"plan": ["step"]})
+        self.job.add_progress("command_output", {"command": "make", "output": "building"})
+        self.job.mark_succeeded({"result": "done"})
+        events = [event for event, _ in job_events(self.job.id, poll_interval=0)]
+        self.assertEqual(events, ["plan_created", "command_output", "job_finished"])
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    """An open circuit fails the call at once, neither the SDK nor call_with_retries retry it."""
+
+    MODEL = "breaker-test-model"
+
+    def setUp(self):
+        self.calls = 0
+        transport = llm.GatewayTransport()
+        transport._transport = httpx.MockTransport(self.server_error)
+        self.client = llm.GatewayOpenAI(api_key="x", base_url="http://llm.test/v1", max_retries=5,
+                                        http_client=httpx.Client(transport=transport))
+        self.gate = llm.get_gate(self.MODEL)
+        self.gate.breaker = llm.CircuitBreaker(threshold=2, cooldown=60)
+
+    def server_error(self, request):
+        self.calls += 1
+        return httpx.Response(500, json={"error": {"message": "down"}})
+
+    def create(self):
+        return self.client.chat.completions.create(model=self.MODEL, messages=[{"role": "user", "content": "hi"}])
+
+    def test_retries_stop_once_the_circuit_opens(self):
+        with self.assertRaises(llm.CircuitOpenError):
+            self.create()
+        self.assertEqual(self.calls, 2)
+        with self.assertRaises(llm.CircuitOpenError):
+            call_with_retries(self.create, max_retries=3)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(self.gate.stats()["circuit"], "open")
+        self.assertEqual(self.gate.stats()["in_flight"], 0)
+
+
+class SummarizeFilesTests(SimpleTestCase):
+    """The fan-out of the summaries on the event loop of the async client."""
+
+    def test_every_attempt_goes_through_the_rate_limiter(self):
+        attempts = {}
+
+        async def flaky_summary(path, content, tree_output):
+            attempts[path] = attempts.get(path, 0) + 1
+            if attempts[path] == 1:
+                raise APIConnectionError(request=httpx.Request("POST", "http://llm.test/v1/chat/completions"))
+            return f"summary of {path}"
+
+        acquire = mock.AsyncMock()
+        with mock.patch.object(RateLimiter, "acquire_async", acquire), \
+                mock.patch("code_reader.ingestion.backoff_delay", return_value=0):
+            summaries, stats = summarize_files({"a.py": "a = 1", "b.py": "b = 2"}, "tree", flaky_summary)
+        self.assertEqual(summaries, {"a.py": "summary of a.py", "b.py": "summary of b.py"})
+        self.assertEqual(stats["failed"], 0)
+        self.assertEqual(acquire.await_count, 4)
+
+
+class DiffFilesTests(SimpleTestCase):
+    """Empty files are fingerprinted like the others."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="diff_")
+        self.path = os.path.join(self.root, "__init__.py")
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def diff(self, fingerprints):
+        reads = []
+
+        def read_content(path):
+            reads.append(path)
+            with open(path) as file:
+                return file.read()
+        return list(diff_files([self.path], fingerprints, read_content)), reads
+
+    def test_empty_file_is_added_then_skipped(self):
+        open(self.path, "w").close()
+        changes, _ = self.diff({})
+        self.assertEqual([(status, content) for status, _, content, _ in changes], [(ADDED, "")])
+        fingerprint = changes[0][3]
+        changes, reads = self.diff({self.path: (fingerprint["content_hash"], fingerprint["size"], fingerprint["mtime"])})
+        self.assertEqual((changes, reads), ([], []))
+
+    def test_emptied_file_is_changed_not_deleted(self):
+        with open(self.path, "w") as file:
+            file.write("x = 1\n")
+        fingerprint = file_fingerprint(self.path, "x = 1\n")
+        open(self.path, "w").close()
+        changes, _ = self.diff({self.path: (fingerprint["content_hash"], fingerprint["size"], fingerprint["mtime"])})
+        self.assertEqual([(status, content) for status, _, content, _ in changes], [(CHANGED, "")])
+
+    def test_empty_file_is_summarized_without_a_model_call(self):
+        summarize = mock.AsyncMock()
+        summaries, _ = summarize_files({self.path: ""}, "tree", summarize)
+        self.assertEqual(summaries, {self.path: EMPTY_FILE_SUMMARY})
+        summarize.assert_not_awaited()
@@ -0,0 +1,197 @@
+# code_reader/tree.py
+
+import os
+import threading
+
+from code_reader.ignore import IgnoreMatcher
+
+# What `tree -I` used to exclude in get_filtered_tree
+TREE_IGNORE_PATTERNS = [
+    '.next', 'node_modules', '.git', 'venv', 'venv2', 'venv3', '__pycache__', 'postgres_data', 'static', '.idea',
+    'media', 'dist', 'build', '*.log', '*.tmp', 'public', '__MACOSX',
+]
+TREE_MAX_DEPTH = 4
+
+tree_matcher = IgnoreMatcher(TREE_IGNORE_PATTERNS)
+
+
+class RepoTree:
+    """
+    In-memory listing of a repo as nested dicts: directory name -> dict, file name -> None.
+    Built by scan_repo, kept up to date with add_path / remove_path.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.children = {}
+
+    def _split(self, path):
+        relative_path = os.path.relpath(path, self.root) if os.path.isabs(path) else path
+        return [part for part in relative_path.replace(os.sep, '/').split('/') if part and part != '.']
+
+    def add_path(self, path, is_dir=False):
+        parts = self._split(path)
+        if not parts or parts[0] == '..':
+            return
+        node = self.children
+        for part in parts[:-1]:
+            if node.get(part) is None:
+                node[part] = {}
+            node = node[part]
+        if is_dir:
+            node.setdefault(parts[-1], {})
+        else:
+            node[parts[-1]] = None
+
+    def remove_path(self, path):
+        parts = self._split(path)
+        if not parts:
+            return
+        node = self.children
+        for part in parts[:-1]:
+            node = node.get(part)
+            if node is None:
+                return
+        node.pop(parts[-1], None)
+
+    def files(self):
+        """Absolute paths of every file in the tree."""
+        paths = []
+        stack = [(self.root, self.children)]
+        while stack:
+            directory, node = stack.pop()
+            for name, child in node.items():
+                path = os.path.join(directory, name)
+                if child is None:
+                    paths.append(path)
+                else:
+                    stack.append((path, child))
+        return sorted(paths)
+
+    def render(self, max_depth=TREE_MAX_DEPTH):
+        """Same layout as `tree -L max_depth --dirsfirst --noreport`."""
+        lines = [self.root]
+
+        def render_node(node, prefix, depth):
+            names = sorted(node, key=lambda name: (node[name] is None, name.lower(), name))
+            for index, name in enumerate(names):
+                last = index == len(names) - 1
+                lines.append(f"{prefix}{'└── ' if last else '├── '}{name}")
+                if node[name] is not None and depth < max_depth:
+                    render_node(node[name], prefix + ('    ' if last else '│   '), depth + 1)
+
+        render_node(self.children, '', 1)
+        return '\n'.join(lines) + '\n'
+
+
+def scan_repo(repo_path, matchers):
+    """
+    One pruned os.scandir walk of the repo serving several views of it, e.g. the files to index and
+    the tree to render. A directory is only descended into if one of the views keeps it.
+
+    Args:
+    matchers (dict): view name -> IgnoreMatcher.
+
+    Returns:
+    tuple: (trees, dir_mtimes) where trees is view name -> RepoTree and dir_mtimes is
+    absolute directory -> mtime of every directory walked, the fingerprint used by TreeCache.
+    """
+    trees = {name: RepoTree(repo_path) for name in matchers}
+    dir_mtimes = {}
+    # (directory, relative directory, views still keeping this directory)
+    stack = [(repo_path, '', tuple(matchers))]
+    while stack:
+        directory, relative_directory, views = stack.pop()
+        try:
+            dir_mtimes[directory] = os.stat(directory).st_mtime
+            with os.scandir(directory) as entries:
+                entries = list(entries)
+        except OSError as e:
+            print(f"Skipping directory {directory}: {e}")
+            continue
+        for entry in entries:
+            relative_path = f'{relative_directory}/{entry.name}' if relative_directory else entry.name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            keeping = tuple(view for view in views if not matchers[view].matches(relative_path, is_dir=is_dir))
+            for view in keeping:
+                trees[view].add_path(relative_path, is_dir=is_dir)
+            if is_dir and keeping:
+                stack.append((entry.path, relative_path, keeping))
+    return trees, dir_mtimes
+
+
+class TreeCache:
+    """
+    Rendered trees per repo root, valid as long as the mtimes of the walked directories do not change
+    (adding, removing or renaming an entry bumps the mtime of its directory). Checking the fingerprint
+    costs one stat per directory instead of listing the whole repo.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, dir_mtimes):
+        for directory, mtime in dir_mtimes.items():
+            try:
+                if os.stat(directory).st_mtime != mtime:
+                    return False
+            except OSError:
+                return False
+        return True
+
+    def store(self, repo_path, tree, dir_mtimes):
+        rendered = tree.render()
+        with self._lock:
+            self._entries[os.path.realpath(repo_path)] = {
+                "repo_path": repo_path, "tree": tree, "dir_mtimes": dir_mtimes, "rendered": rendered
+            }
+        return rendered
+
+    def get(self, repo_path):
+        """Rendered tree of the repo, walking it again only when it changed on disk."""
+        key = os.path.realpath(repo_path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and self._is_fresh(entry["dir_mtimes"]):
+            return entry["rendered"]
+        trees, dir_mtimes = scan_repo(repo_path, {"tree": tree_matcher})
+        return self.store(repo_path, trees["tree"], dir_mtimes)
+
+    def _entry_for(self, path):
+        path = os.path.realpath(path)
+        roots = [root for root in self._entries if path.startswith(root + os.sep)]
+        if not roots:
+            return None, None
+        root = max(roots, key=len)
+        return root, self._entries[root]
+
+    def _update(self, path, change):
+        with self._lock:
+            root, entry = self._entry_for(path)
+            if entry is None:
+                return
+            relative_path = os.path.relpath(os.path.realpath(path), root).replace(os.sep, '/')
+            if tree_matcher.is_ignored_path(relative_path):
+                return
+            change(entry["tree"], relative_path)
+            # re-stat the parent directories so the entry stays fresh after our own change
+            parents = relative_path.split('/')[:-1]
+            for depth in range(len(parents) + 1):
+                directory = os.path.join(entry["repo_path"], *parents[:depth])
+                if os.path.isdir(directory):
+                    entry["dir_mtimes"][directory] = os.stat(directory).st_mtime
+            entry["rendered"] = entry["tree"].render()
+
+    def file_added(self, path):
+        """Adds a file written by the executor tools to the cached tree without walking the repo."""
+        self._update(path, lambda tree, relative_path: tree.add_path(relative_path))
+
+    def file_removed(self, path):
+        self._update(path, lambda tree, relative_path: tree.remove_path(relative_path))
+
+
+tree_cache = TreeCache()
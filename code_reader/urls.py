@@ -2,8 +2,8 @@ from rest_framework.routers import DefaultRouter
 from django.urls import path, include
 from .views import (ProjectViewSet, FileViewSet, login_view,
                     DocumentDetailFetch, QueryView, ExecutorView,
-                    ProjectDetailViewSet, ProjectListViewSet, QnAView,
-                    ProjectFilesView, UserDetailView)
+                    ProjectDetailViewSet, ProjectListViewSet, QnAView, QnAStreamView, ExecutorStreamView,
+                    ProjectFilesView, UserDetailView, JobDetailView, JobStreamView, LLMCacheStatsView)
 from conversation.views import MessagesDetailViewSet
 
 router = DefaultRouter()
@@ -19,7 +19,12 @@ urlpatterns = [
     path('projects/<int:project_id>/executor_query/', QueryView.as_view(), name='query_view'),
     path('projects/<int:project_id>/conversation/<str:conversation_id>/get_your_answer/', QnAView.as_view(), name='new_query_view'),
     path('projects/<int:project_id>/conversation/<str:conversation_id>/executor/', ExecutorView.as_view(), name='executor_view'),
+    path('projects/<int:project_id>/conversation/<str:conversation_id>/get_your_answer/stream/', QnAStreamView.as_view(), name='new_query_stream'),
+    path('projects/<int:project_id>/conversation/<str:conversation_id>/executor/stream/', ExecutorStreamView.as_view(), name='executor_stream'),
     path('conversation/<str:conversation_id>/', MessagesDetailViewSet.as_view(), name='get_messages'),
     path('projects/<int:project_id>/files/', ProjectFilesView.as_view(), name='project_files'),
-    path('user/details/', UserDetailView.as_view(), name='user-details')
+    path('user/details/', UserDetailView.as_view(), name='user-details'),
+    path('jobs/<int:job_id>/', JobDetailView.as_view(), name='job_detail'),
+    path('jobs/<int:job_id>/stream/', JobStreamView.as_view(), name='job_stream'),
+    path('llm_cache/stats/', LLMCacheStatsView.as_view(), name='llm_cache_stats'),
 ]
\ No newline at end of file
@@ -1,7 +1,6 @@
 import ast
+import asyncio
 import os
-import fnmatch
-import subprocess
 import time
 import base64
 
@@ -9,61 +8,48 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from openai import OpenAI
-from langchain.memory import ConversationSummaryBufferMemory
 from langchain.chains.summarize import load_summarize_chain
-from langchain_openai import ChatOpenAI
+from langchain.docstore.document import Document
 from code_reader.models import File, Project
+from code_reader.ignore import IgnoreMatcher, DEFAULT_IGNORE_PATTERNS, walk_repo
+from code_reader.tree import scan_repo, tree_cache, tree_matcher
+from code_reader.retrieval import update_project_index
+from code_reader.chunking import replace_file_chunks
+from code_reader.llm_cache import llm_cache, cache_key
+from code_reader.llm import client, async_client
+from code_reader import routing
+from code_reader.ingestion import summarize_files, call_with_retries, load_fingerprints, diff_files, \
+    file_fingerprint, FileBatchWriter, ADDED, CHANGED, TOUCHED, DELETED
 from django.conf import settings
 
-# Initialize OpenAI and memory
-client = OpenAI(api_key=settings.OPEN_AI_KEY)
-llm = ChatOpenAI(model='gpt-4o', temperature=0.7, api_key=settings.OPEN_AI_KEY)
-llm_mini = ChatOpenAI(model='gpt-4o-mini', temperature=0.4, api_key=settings.OPEN_AI_KEY)
-summary_memory = ConversationSummaryBufferMemory(llm=llm, max_token_limit=500)
+# the models of the routes share the pooled client of code_reader.llm
+llm_mini = routing.route_chat_model(routing.SUMMARIZATION, 0.4)
 summary_maker_chain = load_summarize_chain(llm=llm_mini, chain_type='map_reduce', token_max=10000)
 
 def get_filtered_tree(directory):
     """
-    Runs the 'tree' command with exclusions and captures the output in a variable.
+    Renders the tree of the directory (4 levels, hidden files included, directories first, the usual
+    build / dependency folders excluded), the way the 'tree' command used to.
+    The rendering is cached and only rebuilt when the directory changed on disk.
 
     Args:
-    directory (str): The directory to run the tree command on. Defaults to the current directory.
+    directory (str): The directory to render.
 
     Returns:
-    str: The output of the tree command.
+    str: The rendered tree.
     """
     try:
-        # Command to run `tree` with exclusions
-        command = [
-            "tree",
-            "-L", "4",  # Limit to 4 levels
-            "-I",
-            ".next|node_modules|.git|venv|venv2|venv3|__pycache__|postgres_data|static|.idea|media|dist|build|*.log|*.tmp|public|__MACOSX",
-            # Exclude more unnecessary items
-            "-a",  # Include hidden files and directories
-            "--noreport",  # Exclude summary info (e.g., file count) to keep the output clean
-            "--dirsfirst",  # Display directories before files
-            # "-f",  # Show full paths for files and directories
-            directory  # Target directory
-        ]
-        # Execute the command and capture the output
-        print(" ".join(command))
-        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        print(result)
-        # Check for errors
-        # if result.returncode != 0:
-        #     raise Exception(f"Error running tree command: {result.stderr}")
-
-        return result.stdout
+        return tree_cache.get(directory)
     except Exception as e:
         return str(e)
 
 
 # Helper Functions
-def list_files_in_repo(repo_path):
+def list_files_in_repo(repo_path, matcher=None):
+    """Files of the repo that are not ignored, ignored directories are pruned during the walk."""
+    matcher = matcher or get_ignore_matcher(repo_path)
     repo_files = []
-    for root, dirs, files in os.walk(repo_path):
+    for root, _, dirs, files in walk_repo(repo_path, matcher):
         for file in files:
             repo_files.append(os.path.join(root, file))
     return repo_files
@@ -83,6 +69,8 @@ def read_file_content(file_path):
 
 
 def call_openai_llm_with_image(prompt, base64_image):
+    model = routing.route_model(routing.ANSWER)
+    started = time.monotonic()
     try:
         response = client.chat.completions.create(
             messages=[
@@ -98,58 +86,138 @@ def call_openai_llm_with_image(prompt, base64_image):
                     }
                 ]}
             ],
-            model="gpt-4o",
+            model=model,
             temperature=0.7,
             stream=False
         )
+        routing.record_completion(routing.ANSWER, model, started, response)
         return response.choices[0].message.content.strip()
     except Exception as e:
+        routing.record_completion(routing.ANSWER, model, started, error=True)
         print(f"Error calling OpenAI API: {e}")
         return f"Error calling OpenAI API: {e}"
 
 
-def call_openai_llm_without_memory(prompt):
-    try:
-        response = client.chat.completions.create(
-            messages=[
-                {"role": "assistant", "content": f"You are an helpful assistant. and you try your best to help the user\n"},
-                {"role": "user", "content": prompt}
-            ],
-            model="gpt-4o",
-            temperature=0.7,
-            stream=False
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        print(f"Error calling OpenAI API: {e}")
-        return f"Error calling OpenAI API: {e}"
+def cached_chat_completion(messages, model=None, temperature=0.7, use_cache=True, route=routing.ANSWER):
+    """
+    Chat completion answered from llm_cache when the same messages were sent before. Errors are raised.
+    The model defaults to the one of the route, the call is counted in the route's metrics.
+    """
+    model = model or routing.route_model(route)
 
+    def call():
+        started = time.monotonic()
+        try:
+            response = client.chat.completions.create(
+                messages=messages,
+                model=model,
+                temperature=temperature,
+                stream=False
+            )
+        except Exception:
+            routing.record_completion(route, model, started, error=True)
+            raise
+        routing.record_completion(route, model, started, response)
+        return response.choices[0].message.content.strip()
+    return llm_cache.get_or_call(cache_key(model, temperature, messages), call, bypass=not use_cache)
 
 
-def call_openai_llm(prompt, model="gpt-4o"):
+async def acached_chat_completion(messages, model=None, temperature=0.7, use_cache=True, route=routing.ANSWER):
+    """
+    cached_chat_completion for async callers, on the async client of the same gateway. The cache is a
+    blocking SQLite / Redis client, so its lookups run in a worker thread instead of stalling the loop.
+    """
+    model = model or routing.route_model(route)
+    key = cache_key(model, temperature, messages)
+    cached = await asyncio.to_thread(llm_cache.get, key, bypass=not use_cache)
+    if cached is not None:
+        return cached
+    started = time.monotonic()
     try:
-        summary_var = summary_memory.load_memory_variables({})
-        if 'history' in summary_var:
-            context = summary_var.get('history')
-        else:
-            context = str(summary_var)
-        response = client.chat.completions.create(
-            messages=[
-                {"role": "assistant", "content": f"You are a code reader agent. Context so far:\n\n{context}\n\n"},
-                {"role": "user", "content": prompt}
-            ],
+        response = await async_client.chat.completions.create(
+            messages=messages,
             model=model,
-            temperature=0.7,
+            temperature=temperature,
             stream=False
         )
-        return response.choices[0].message.content.strip()
+    except Exception:
+        routing.record_completion(route, model, started, error=True)
+        raise
+    routing.record_completion(route, model, started, response)
+    content = response.choices[0].message.content.strip()
+    await asyncio.to_thread(llm_cache.set, key, content, bypass=not use_cache)
+    return content
+
+
+def chat_completion(prompt, model=None, system_prompt="You are an helpful assistant. and you try your best to help the user\n",
+                    use_cache=True, route=routing.ANSWER):
+    """
+    Single chat completion without memory. Unlike the call_openai_llm* helpers, errors are raised
+    to the caller so that rate limits can be retried.
+    """
+    messages = [
+        {"role": "assistant", "content": system_prompt},
+        {"role": "user", "content": prompt}
+    ]
+    return cached_chat_completion(messages, model, use_cache=use_cache, route=route)
+
+
+async def achat_completion(prompt, model=None, system_prompt="You are an helpful assistant. and you try your best to help the user\n",
+                           use_cache=True, route=routing.ANSWER):
+    """chat_completion for async callers, e.g. the summaries fanned out by ingestion.summarize_files."""
+    messages = [
+        {"role": "assistant", "content": system_prompt},
+        {"role": "user", "content": prompt}
+    ]
+    return await acached_chat_completion(messages, model, use_cache=use_cache, route=route)
+
+
+def stream_chat_completion(prompt, model=None, system_prompt="You are an helpful assistant. and you try your best to help the user\n",
+                           use_cache=True, route=routing.ANSWER):
+    """
+    chat_completion yielding the answer as it is generated. A cached answer is yielded in one piece,
+    a streamed one is cached once complete. Errors are raised.
+    """
+    messages = [
+        {"role": "assistant", "content": system_prompt},
+        {"role": "user", "content": prompt}
+    ]
+    model = model or routing.route_model(route)
+    key = cache_key(model, 0.7, messages)
+    cached = llm_cache.get(key, bypass=not use_cache)
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    started = time.monotonic()
+    response = client.chat.completions.create(
+        messages=messages,
+        model=model,
+        temperature=0.7,
+        stream=True,
+        # the last chunk carries the token usage of the answer
+        stream_options={"include_usage": True}
+    )
+    chunk = None
+    for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            parts.append(chunk.choices[0].delta.content)
+            yield chunk.choices[0].delta.content
+    routing.record_completion(route, model, started, chunk)
+    llm_cache.set(key, ''.join(parts).strip(), bypass=not use_cache)
+
+
+def call_openai_llm_without_memory(prompt, use_cache=True):
+    try:
+        return chat_completion(prompt, use_cache=use_cache)
     except Exception as e:
         print(f"Error calling OpenAI API: {e}")
         return f"Error calling OpenAI API: {e}"
 
 
-def summarize_file_content(file_path, content, file_structure):
-    prompt = f"""
+
+def file_summary_prompt(file_path, content, file_structure):
+    return f"""
     file structure from the project root
     $$
     {file_structure}
@@ -159,32 +227,45 @@ def summarize_file_content(file_path, content, file_structure):
     ##{content}##\n\n
     Provide a concise summary capturing the main components, the role of this file in the project, and any key functions or classes it contains. Also what are the import and export
     """
-    return call_openai_llm(prompt, model='gpt-4o-mini')
 
 
-def analyze_file_content(file_path, content, file_structure):
-    prompt = f"""
-    file structure from the project root
-    $$
-    {file_structure}
-    $$\n\n
-    Analyze the following code from **{file_path}**:\n
-
-    Content of the file\n
-    !!!{content}!!!
-
-    Please provide a detailed analysis with the foloowing details: \n
-    1. file summary - max in a paragraphs.\n
-    2. Dependency: based on the project structure, tell me the files its importing from.\n
-    3. if any classes, then classes name with one line summary of functioning and code snippet.\n
-    4. if any functions, then functions name with one line summary of functioning and code snippet.\n
-    5. if any components, then names with the one line summary of functioning for each and code snippet\n
-    6. if any schemas, then names with fields and code snippets.\n
-    7. if any contants, then list them all with one line summary.\n
-    8. if frontend framework, mention the page navigation based on component clicks or processing.\n
-    9. any security concerns.\n
+def summarize_file_content(file_path, content, file_structure):
+    return chat_completion(file_summary_prompt(file_path, content, file_structure),
+                           system_prompt="You are a code reader agent.\n", route=routing.SUMMARIZATION)
+
+
+async def asummarize_file_content(file_path, content, file_structure):
+    return await achat_completion(file_summary_prompt(file_path, content, file_structure),
+                                  system_prompt="You are a code reader agent.\n", route=routing.SUMMARIZATION)
+
+
+def build_project_summary(previous_summary, file_summaries, batch_chars=8000):
+    """
+    Rolls the file summaries up into the project summary once the per-file fan-out is done.
+    Summaries are packed into ~batch_chars documents so the map_reduce chain makes a handful of
+    calls instead of one per file. Returns the summary in the {'history': ...} format the views expect.
     """
-    return call_openai_llm(prompt, 'gpt-4o-mini')
+    texts = []
+    if previous_summary and 'history' in previous_summary:
+        history = ast.literal_eval(previous_summary).get('history')
+        if history:
+            texts.append(f"code reading history till now: {history}")
+    texts.extend(f"{path}: {summary}" for path, summary in file_summaries.items())
+
+    documents = []
+    batch = []
+    batch_len = 0
+    for text in texts:
+        if batch and batch_len + len(text) > batch_chars:
+            documents.append(Document(page_content="\n\n".join(batch)))
+            batch, batch_len = [], 0
+        batch.append(text)
+        batch_len += len(text)
+    if batch:
+        documents.append(Document(page_content="\n\n".join(batch)))
+
+    result = summary_maker_chain.invoke(documents)
+    return str({'history': result['output_text']})
 
 
 def read_ignore_patterns(repo_path):
@@ -202,12 +283,9 @@ def read_ignore_patterns(repo_path):
     return ignore_patterns
 
 
-def should_ignore_file(file_path, ignore_patterns):
-
-    for pattern in ignore_patterns:
-        if fnmatch.fnmatch(file_path, pattern) or pattern in file_path:
-            return True
-    return False
+def get_ignore_matcher(repo_path):
+    """Compiled matcher for the .gitignore / .dockerignore patterns of the repo plus the default ones."""
+    return IgnoreMatcher(read_ignore_patterns(repo_path) + DEFAULT_IGNORE_PATTERNS)
 
 
 def determine_connections(file_contents):
@@ -238,92 +316,164 @@ def run_file_summarizer(project_id, file_path):
     tree_output = get_filtered_tree(project.repo_path)
     project.tree_structure = tree_output
     project.save()
-    summary = summarize_file_content(file_path, file_content, tree_output)
+    summary = call_with_retries(summarize_file_content, file_path, file_content, tree_output)
     #FIXME: removing analysis, as we are not using it anywhere for now
-    # analysis = analyze_file_content(file_path, file_content, tree_output)
+    fingerprint = file_fingerprint(file_path, file_content)
+    previous_hash = File.objects.filter(path=file_path, project=project).values_list('content_hash', flat=True).first()
     file_obj, created = File.objects.get_or_create(
         path=file_path,
         project=project,
-        defaults={'analysis': summary, "summary": summary, "content": file_content}
+        defaults={'analysis': summary, "summary": summary, "content": file_content, **fingerprint}
     )
     if not created:
         file_obj.analysis = summary
         file_obj.summary = summary
         file_obj.content = file_content
+        for field, value in fingerprint.items():
+            setattr(file_obj, field, value)
         file_obj.save()
+    # unchanged content keeps its chunks, and their ids in the index
+    if created or previous_hash != file_obj.content_hash:
+        replace_file_chunks([(file_obj.id, file_path, file_content)])
+    # the summary is new in any case
+    refresh_project_index(project, stale_paths=[file_path])
     return file_obj
 
-def run_code_reader(project):
-    """First time reading the project"""
-    # Main Logic
-    repo_path = project.repo_path
 
-    local_files = list_files_in_repo(repo_path)
-    ignore_patterns = read_ignore_patterns(repo_path)
-    # files_to_ignore_patterns = [
-    #     '*.png', 'static', '*.json', '__pycache__', 'db.sqlite3', '.idea', '*.xlsx', 'media',
-    #     'venv*', '.env', '.idea/', '.git', '*.txt', '*.mp3', '/static/', '/postgres_data/',
-    #     '.DS_Store', 'node_modules', '.next', '*.ttf', '*.jpeg', '*.svg', '*.ico', '*.woff', '*.d.ts'
-    # ]
-    files_to_ignore_patterns = [
-        '*.png', 'static', 'staticFiles', '__MACOSX/', '*.json', '__pycache__', 'db.sqlite3', '.idea', '*.xlsx',
-        'venv*', '.env', '.idea/', '.git', '*.txt', '*.mp3', '/static/', '/postgres_data/', 'public/',
-        '.DS_Store', 'node_modules', '.next', '*.ttf', '*.jpeg', '*.svg', '*.ico', '*.woff', '*.d.ts'
-    ]
-    ignore_patterns.extend(files_to_ignore_patterns)
+def refresh_project_index(project, stale_paths=()):
+    """Re-embeds the changed files of the project, a failure only leaves the retrieval index stale."""
+    try:
+        update_project_index(project, stale_paths=stale_paths)
+    except Exception as e:
+        print(f"Failed to update the retrieval index of project {project.id}: {e}")
 
-    file_contents = {}
-    # print(ignore_patterns)
-    for file in local_files:
-        # print(file)
-        if should_ignore_file(file, ignore_patterns):
-            continue
-        content = read_file_content(file)
-        if content:
-            file_contents[file] = content
+def run_code_reader(project, file_contents=None):
+    """
+    First time reading the project.
+    file_contents: optional absolute path -> content of files already read, e.g. while extracting the
+    uploaded archive. The repo is then not walked nor read again.
+    """
+    # Main Logic
+    repo_path = project.repo_path
 
+    matcher = get_ignore_matcher(repo_path)
+    # a single walk gives both the files to index and the tree
+    trees, dir_mtimes = scan_repo(repo_path, {"index": matcher, "tree": tree_matcher})
+    tree_output = tree_cache.store(repo_path, trees["tree"], dir_mtimes)
+    if file_contents is None:
+        repo_files = trees["index"].files()
+        read_content = read_file_content
+    else:
+        repo_files = [path for path in file_contents
+                      if not matcher.is_ignored_path(os.path.relpath(path, repo_path).replace(os.sep, '/'))]
+        read_content = file_contents.get
 
-    file_analysis = {}
-    tree_output = get_filtered_tree(repo_path)
     project.tree_structure = str(tree_output)
     project.save()
     print(tree_output)
-    for path, _ in file_contents.items():
-        print(path)
 
-    # important condition for the history to be saved in project summary.
-    if 'history' in project.summary:
-        project_summary_till_now = ast.literal_eval(project.summary)
-        if 'history' in project_summary_till_now:
-            summary_memory.save_context({"input": "code_reading history till now"}, {"output": project_summary_till_now["history"]})
+    # only added/changed files are read in full and summarized, unchanged ones are matched on their fingerprint
+    changed_files = {}
+    fingerprints = {}
+    deleted_paths = []
+    with FileBatchWriter(project) as writer:
+        for status, path, content, fingerprint in diff_files(repo_files, load_fingerprints(project), read_content):
+            print(f"{status}: {path}")
+            if status in (ADDED, CHANGED):
+                changed_files[path] = content
+                fingerprints[path] = fingerprint
+            elif status == TOUCHED:
+                writer.touch(path, fingerprint)
+            elif status == DELETED:
+                deleted_paths.append(path)
+
+        if deleted_paths:
+            writer.delete(deleted_paths)
+            print(f"{len(deleted_paths)} deleted files removed from the index")
+
+        # summaries are produced concurrently, the db writes stay on this thread and go out in chunks
+        # FIXME: no separate analysis for now, so the summary is stored as the analysis too.
+        file_analysis, stats = summarize_files(
+            changed_files, tree_output, asummarize_file_content,
+            on_summary=lambda path, summary: writer.add(path, summary, changed_files[path], fingerprints[path])
+        )
+
+    # project rollup happens once, after the fan-out
+    if file_analysis:
+        project.summary = build_project_summary(project.summary, file_analysis)
+        project.save()
+    if file_analysis or deleted_paths:
+        refresh_project_index(project)
+    return stats
 
-    for path, content in file_contents.items():
-        # Print the captured output
-        print("preocessing file: " + path)
-        file_object = File.objects.filter(path=path, project=project).first()
-        # print(file_object.content)
-        # print(content)
-        if file_object and file_object.content == content:
-            print(f"file {file_object.path} skipped")
+
+def refresh_changed_files(project, paths):
+    """
+    Incremental counterpart of run_code_reader for a known list of changed paths, e.g. the files an
+    executor run wrote: only those are looked at, nothing else of the repo is walked. Changed files are
+    summarized, chunked and embedded again, deleted ones dropped, and the tree is patched in place.
+    A path that is a directory stands for the files under it.
+    """
+    repo_path = project.repo_path
+    matcher = get_ignore_matcher(repo_path)
+    root = os.path.realpath(repo_path)
+    fingerprints = load_fingerprints(project)
+
+    def ignored(path):
+        return matcher.is_ignored_path(os.path.relpath(path, repo_path).replace(os.sep, '/'))
+
+    candidates = set()
+    for path in paths:
+        real_path = os.path.realpath(path)
+        if not real_path.startswith(root + os.sep):
             continue
-        # print(path, )
-        summary = summarize_file_content(path, content, tree_output)
-        summary_memory.save_context({"input": path}, {"output": summary})
-        # FIXME: not using analyze_file_content for now, so replacing it with summary.
-        # analysis = analyze_file_content(path, content, tree_output)
-        file_analysis[path] = summary
-        file_obj, created = File.objects.update_or_create(
-            path=path,
-            project=project,
-            defaults={'analysis': summary, "summary": summary, "content": content}
-        )
-        if created:
-            print("File " + path + " created.")
+        # stored paths are the ones of the walk, under repo_path as given
+        path = os.path.join(repo_path, os.path.relpath(real_path, root))
+        if os.path.isdir(path):
+            candidates.update(file for file in list_files_in_repo(path, matcher) if not ignored(file))
+        elif os.path.exists(path):
+            if not ignored(path):
+                candidates.add(path)
         else:
-            print("File "+ path + " updated.")
+            # deleted, the file itself or a whole directory of indexed files
+            candidates.update(known for known in fingerprints if known == path or known.startswith(path + os.sep))
+
+    changed_files = {}
+    changed_fingerprints = {}
+    deleted_paths = []
+    known = {path: fingerprints[path] for path in candidates if path in fingerprints}
+    existing = sorted(path for path in candidates if os.path.isfile(path))
+    with FileBatchWriter(project) as writer:
+        for status, path, content, fingerprint in diff_files(existing, known, read_file_content):
+            print(f"{status}: {path}")
+            if status in (ADDED, CHANGED):
+                changed_files[path] = content
+                changed_fingerprints[path] = fingerprint
+                if status == ADDED:
+                    tree_cache.file_added(path)
+            elif status == TOUCHED:
+                writer.touch(path, fingerprint)
+            elif status == DELETED:
+                deleted_paths.append(path)
+                tree_cache.file_removed(path)
+        if deleted_paths:
+            writer.delete(deleted_paths)
+
+        tree_output = get_filtered_tree(repo_path)
+        file_analysis, stats = summarize_files(
+            changed_files, tree_output, asummarize_file_content,
+            on_summary=lambda path, summary: writer.add(path, summary, changed_files[path],
+                                                         changed_fingerprints[path])
+        )
 
-        project.summary = summary_memory.load_memory_variables({})
-        project.save()
+    project.tree_structure = str(tree_output)
+    if file_analysis:
+        project.summary = build_project_summary(project.summary, file_analysis)
+    project.save()
+    if file_analysis or deleted_paths:
+        refresh_project_index(project)
+    stats["deleted"] = len(deleted_paths)
+    return stats
 
 
 def encode_image(image_path):
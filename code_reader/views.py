@@ -1,16 +1,15 @@
-import os
-import zipfile
-import ast
 import time
 import base64
 from django.core.validators import validate_email
 from rest_framework import viewsets, permissions
 from django.conf import settings
 from django.contrib.auth.models import User
-from conversation.models import Conversation, Messages
-from .executor.utils import invoke_model
-from .executor.outputparser import FilepathResponse, SupervisorResponse
-from .serializers import ProjectSerializer, FileSerializer, DocumentDetailFetchSerializer
+from conversation.models import Conversation
+from .executor.utils import invoke_model, structured_output_stats
+from .llm import gateway_stats
+from .routing import route_stats
+from .executor.outputparser import SupervisorResponse
+from .serializers import ProjectSerializer, FileSerializer, DocumentDetailFetchSerializer, JobSerializer
 from django.contrib.auth import authenticate
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authtoken.models import Token
@@ -20,12 +19,14 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from django.shortcuts import get_object_or_404
-from .models import Project, File, ImageUpload
-from .tasks import start_code_reading
-from langchain.memory import ConversationSummaryBufferMemory
-from code_reader.utils import llm, call_openai_llm_without_memory, summary_maker_chain, encode_image, \
-    call_openai_llm_with_image
-from code_reader.executor.main import call_executor
+from .models import Project, File, ImageUpload, Job
+from .retrieval import retrieve_chunks, group_by_file
+from .prompts import PromptBuilder, count_tokens
+from .llm_cache import llm_cache
+from .streaming import StreamTimer, sse_response, job_events
+from .conversations import conversation_history, record_exchange
+from code_reader.utils import call_openai_llm_without_memory, summary_maker_chain, encode_image, \
+    call_openai_llm_with_image, stream_chat_completion
 from langchain.docstore.document import Document
 from code_reader.utils import call_openai_llm_without_memory
 
@@ -34,30 +35,16 @@ class ProjectViewSet(viewsets.ModelViewSet):
     queryset = Project.objects.all()
     serializer_class = ProjectSerializer
 
-    def perform_create(self, serializer):
-        if serializer.is_valid():
-            project = serializer.save()
-            zip_file = project.zip_file
-
-            if zip_file:
-                new_repo_path = os.path.join(settings.MEDIA_ROOT, project.name)
-                os.makedirs(new_repo_path, exist_ok=True)
-                print("extracting the zip archive")
-
-                with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-                    zip_ref.extractall(new_repo_path)
-
-                files = os.listdir(new_repo_path)
-                if len(files) == 1 and os.path.isdir(os.path.join(settings.MEDIA_ROOT, project.name, files[0])):
-                    new_repo_path = os.path.join(settings.MEDIA_ROOT, project.name, files[0])
-                if len(files) == 2 and os.path.isdir(os.path.join(new_repo_path, '__MACOSX')):
-                    new_repo_path = os.path.join(new_repo_path, files[0] if files[0] != '__MACOSX' else files[1])
-
-                project.repo_path = new_repo_path
-                project.save()
-                start_code_reading.delay(project.id)
-
-            return {"message": "Project created successfully", "id": project.id, "name": project.name}
+    def create(self, request, *args, **kwargs):
+        # the uploaded zip is extracted and read by a background job, its id is added to the project
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        data = dict(serializer.data)
+        job = getattr(serializer.instance, 'ingestion_job', None)
+        if job:
+            data["job_id"] = job.id
+        return Response(data, status=status.HTTP_201_CREATED, headers=self.get_success_headers(serializer.data))
 
 
 
@@ -148,6 +135,30 @@ class DocumentDetailFetch(APIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+def build_prompt_sections(project, user_query, chunks, history, tree=False):
+    """
+    Fits the project data of a Q&A / executor prompt in CODE_READER_PROMPT_MAX_TOKENS.
+    The conversation history, project summary and tree get a capped share, the retrieved chunks the
+    rest, best ranked first. chunks is None when the project has no files yet.
+
+    Returns:
+    dict: section name -> text, plus 'token_counts': tokens per section.
+    """
+    builder = PromptBuilder()
+    builder.require('query', user_query)
+    builder.add('history', history, share=0.1, keep='tail')
+    builder.add('project_summary', project.summary, share=0.15)
+    if tree:
+        builder.add('tree', project.tree_structure, share=0.15)
+    if chunks is None:
+        builder.require('code_context', "no files present, yet to build the project")
+    else:
+        builder.add_items('code_context', chunks, render=lambda kept: str(group_by_file(kept)))
+    sections = builder.build()
+    sections['token_counts'] = builder.token_counts()
+    return sections
+
+
 class QueryView(APIView):
     def post(self, request, project_id):
         # Retrieve the project instance
@@ -156,24 +167,28 @@ class QueryView(APIView):
         # Extract the user's query from the request
         user_query = request.data['query']
         files = list(File.objects.filter(project=project).values('path', 'summary'))
-        if len(str(files)) > 50000 and not project.files_summary:
-            documents = [Document(page_content=file['summary'], metadata={"path": file['path']}) for file in files]
-            result = summary_maker_chain.invoke(documents)
-            files = result
-            project.files_summary = files
-            project.save()
-            print("Summary Results of files: ", result)
-        else:
+        # too many file summaries for the prompt budget, fall back to their map-reduced summary
+        if count_tokens(str(files)) > settings.CODE_READER_PROMPT_MAX_TOKENS // 2:
+            if not project.files_summary:
+                documents = [Document(page_content=file['summary'], metadata={"path": file['path']}) for file in files]
+                result = summary_maker_chain.invoke(documents)
+                project.files_summary = result
+                project.save()
+                print("Summary Results of files: ", result)
             files = project.files_summary
 
         if user_query:
-            # Initialize the OpenAI API with your API key
+            builder = PromptBuilder()
+            builder.require('query', user_query)
+            builder.add('project_summary', project.summary, share=0.3)
+            builder.add('files_summary', files)
+            sections = builder.build()
 
             # Prepare the prompt or input for the LLM
             prompt = f"""
                 Project data: ##{project.name}##\n
-                Project summary: ##{project.summary}##\n
-                Files summary docs: ##{files}##\n\n
+                Project summary: ##{sections['project_summary']}##\n
+                Files summary docs: ##{sections['files_summary']}##\n\n
                 Based on the above given data, Answer the following questions:
                 User Query: ##{user_query}##\n\n
                 Notes for you answer: 
@@ -183,7 +198,8 @@ class QueryView(APIView):
                      in structured way for human to understand and in detail\n\n
                 Answer:
             """
-            print(prompt)
+            prompt_tokens = builder.token_counts(prompt)
+            print(f"prompt tokens: {prompt_tokens}")
 
             try:
 
@@ -191,10 +207,11 @@ class QueryView(APIView):
                 print("going to call for answer from llm")
                 answer = call_openai_llm_without_memory(prompt)
                 print(f"answer: {answer}")
-                # Extract the generated answer
-                call_executor(project.repo_path, answer, project, settings.BASE_DIR)
+                # Act on the generated answer in the background, the client follows the job
+                job = project.start_executor(answer)
                 # Return the answer as a JSON response
-                return Response({'answer': answer}, status=status.HTTP_200_OK)
+                return Response({'answer': answer, 'prompt_tokens': prompt_tokens, 'job_id': job.id},
+                                status=status.HTTP_200_OK)
 
             except Exception as e:
                 # Handle exceptions and return an error response
@@ -208,85 +225,16 @@ class QueryView(APIView):
 class QnAView(APIView):
 
     def post(self, request, project_id, conversation_id):
-        summary_memory = ConversationSummaryBufferMemory(llm=llm, max_token_limit=500)
-        # Retrieve the project instance
-        conv_summary = "nothing till now"
-        conversation_obj, created = Conversation.objects.get_or_create(
-            conversation_id=conversation_id,
-            # FIXME: change the user based on user after authentication
-            defaults={
-                'user': User.objects.get(username='aman'),
-                'conversation_summary': 'null'
-            }
-        )
-        # print(conversation_obj)
-        if 'history' in conversation_obj.conversation_summary:
-            conversation_summary = ast.literal_eval(conversation_obj.conversation_summary)
-            if 'history' in conversation_summary:
-                conv_summary = conversation_summary['history']
-
-        summary_memory.save_context({"input": "conversation till now"}, {"output": conv_summary})
+        conversation_obj = self.load_conversation(conversation_id)
         project = get_object_or_404(Project, id=project_id)
         print("here i was")
 
-
         # Extract the user's query from the request
         user_query = request.data['query']
         print(user_query)
-        files = list(File.objects.filter(project=project).values('path', 'summary'))
-        if len(str(files)) > 50000 and not project.files_summary:
-            documents = [Document(page_content=file['summary'], metadata={"path": file['path']}) for file in files]
-            result = summary_maker_chain.invoke(documents)
-            files = result
-            project.files_summary = files
-            project.save()
-            print("Summary Results of files: ", result)
-        else:
-            files = project.files_summary
-        code_context = "no files present, yet to build the project"
-        if user_query and files:
-            prompt = f"""
-                #   Project data: ##{project.name}##\n
-                #   Project summary: ##{project.summary}##\n
-                #   Files summary docs: ##{files}##\n
-                #   Summary of the conversation : ##{str(summary_memory.load_memory_variables({}))}##\n\n
-                #  Based on the above given data, Answer the following questions:
-                #  User Query: ##{user_query}##\n\n
-                #  Yours Instruction: 
-                     1. give me file paths of all the files that you need the content for giving better
-                      information for user query
-                    """
-            response = invoke_model(prompt, FilepathResponse)
-            file_paths = response.model_dump()['files']
-            print('file_paths')
-            print(file_paths)
-            code_context = File.objects.filter(path__in=file_paths).values('path', 'content', 'summary')
-            if len(str(code_context)) > 50000:
-                code_context = File.objects.filter(path__in=file_paths).values('path', 'content')
-            # parser = PydanticOutputParser(pydantic_object=response_model)
-        if code_context:
-            print('code_context')
-            print(code_context)
-
-            # Prepare the prompt or input for the LLM
-            prompt = f"""
-                Project data: ##{project.name}##\n
-                Project summary: ##{project.summary}##\n
-                Files summary and the content: ##{code_context}##\n
-                Summary of the conversation : ##{str(summary_memory.load_memory_variables({}))}##\n\n
-                Based on the above given data, Answer the following questions:
-                User Query: ##{user_query}##\n\n
-                Notes for you answer:
-                    1. if the question is about changing or adding something in the project's code,
-                     make the answer so that you will be telling what user needs to do in what all files. \n
-                    2. if the question is about some information of the code, answer it
-                     in structured way for human to understand and in detail\n\n
-                Answer:
-
-            """
-            #  parser = PydanticOutputParser(pydantic_object=response_model)
-            #         final_prompt = prompt + "\nOnly provide the output in JSON as specified. Do not add any text before or after.\n" + parser.get_format_instructions()
-            #
+        if user_query:
+            chunks = self.retrieve(project, user_query)
+            prompt, prompt_tokens = self.prepare_prompt(project, user_query, chunks, conversation_obj)
 
             try:
                 # Call the GPT-4o model
@@ -294,14 +242,11 @@ class QnAView(APIView):
                 answer = call_openai_llm_without_memory(prompt)
 
                 # Saving the data in databases
-                Messages.objects.create(conversation=conversation_obj, user_message=user_query, ai_response=answer)
-                summary_memory.save_context({"input": user_query}, {"output": answer})
-                conversation_obj.conversation_summary = summary_memory.load_memory_variables({})
-                conversation_obj.save()
+                self.save_interaction(conversation_obj, user_query, answer)
 
                 # Return the answer as a JSON response
                 print(answer)
-                return Response({'answer': answer}, status=status.HTTP_200_OK)
+                return Response({'answer': answer, 'prompt_tokens': prompt_tokens}, status=status.HTTP_200_OK)
 
             except Exception as e:
                 # Handle exceptions and return an error response
@@ -311,6 +256,85 @@ class QnAView(APIView):
             # Handle the case where 'query' is not provided in the request
             return Response({'error': 'No query provided.'}, status=400)
 
+    def load_conversation(self, conversation_id):
+        conversation_obj, created = Conversation.objects.get_or_create(
+            conversation_id=conversation_id,
+            # FIXME: change the user based on user after authentication
+            defaults={
+                'user': User.objects.get(username='aman'),
+                'conversation_summary': 'null'
+            }
+        )
+        return conversation_obj
+
+    def retrieve(self, project, user_query):
+        """Chunks relevant to the query, None when the project has no files yet."""
+        if not File.objects.filter(project=project).exists():
+            return None
+        # only the functions / classes relevant to the query, not the whole files
+        chunks = retrieve_chunks(project, user_query)
+        print('files in context')
+        print([chunk['path'] for chunk in chunks])
+        return chunks
+
+    def prepare_prompt(self, project, user_query, chunks, conversation_obj):
+        sections = build_prompt_sections(project, user_query, chunks, conversation_history(conversation_obj))
+        prompt_tokens = sections.pop('token_counts')
+
+        # Prepare the prompt or input for the LLM
+        prompt = f"""
+            Project data: ##{project.name}##\n
+            Project summary: ##{sections['project_summary']}##\n
+            Files summary and the relevant code (symbol, line range, content): ##{sections['code_context']}##\n
+            Summary of the conversation : ##{sections['history']}##\n\n
+            Based on the above given data, Answer the following questions:
+            User Query: ##{user_query}##\n\n
+            Notes for you answer:
+                1. if the question is about changing or adding something in the project's code,
+                 make the answer so that you will be telling what user needs to do in what all files. \n
+                2. if the question is about some information of the code, answer it
+                 in structured way for human to understand and in detail\n\n
+            Answer:
+
+        """
+        prompt_tokens['total'] = count_tokens(prompt)
+        print(f"prompt tokens: {prompt_tokens}")
+        return prompt, prompt_tokens
+
+    def save_interaction(self, conversation_obj, user_query, answer):
+        # the summary of older messages is updated in the background, not before answering
+        record_exchange(conversation_obj, user_query, answer)
+
+
+class QnAStreamView(QnAView):
+    """
+    QnAView as server-sent events: 'retrieval', 'prompt', one 'token' per generated piece of the answer,
+    'answer' and a final 'done' carrying ttfb_ms / first_token_ms / total_ms.
+    """
+
+    def post(self, request, project_id, conversation_id):
+        timer = StreamTimer()
+        project = get_object_or_404(Project, id=project_id)
+        user_query = request.data.get('query')
+        if not user_query:
+            return Response({'error': 'No query provided.'}, status=400)
+        return sse_response(self.events(project, conversation_id, user_query, timer), timer, 'qna')
+
+    def events(self, project, conversation_id, user_query, timer):
+        yield 'start', {"project_id": project.id}
+        conversation_obj = self.load_conversation(conversation_id)
+        chunks = self.retrieve(project, user_query)
+        yield 'retrieval', {"files": sorted({chunk['path'] for chunk in chunks or []}), "ms": timer.elapsed_ms()}
+        prompt, prompt_tokens = self.prepare_prompt(project, user_query, chunks, conversation_obj)
+        yield 'prompt', {"prompt_tokens": prompt_tokens}
+
+        parts = []
+        for text in stream_chat_completion(prompt):
+            parts.append(text)
+            yield 'token', {"text": text}
+        answer = ''.join(parts).strip()
+        self.save_interaction(conversation_obj, user_query, answer)
+        yield 'answer', {"answer": answer}
 
 
 class ExecutorView(APIView):
@@ -322,7 +346,7 @@ class ExecutorView(APIView):
         user_query, base64_image = self.process_user_inputs(request, project)
 
         # Prepare prompt
-        prompt, summary_memory = self.prepare_prompt(project, user_query, conversation_obj)
+        prompt, prompt_tokens = self.prepare_prompt(project, user_query, conversation_obj)
 
         # Call LLM and handle execution
         try:
@@ -336,19 +360,24 @@ class ExecutorView(APIView):
             print(answer['isExecutionRequired'])
             print(answer['aiReply'])
 
+            job = None
             if SupervisorResponse.determine_executor_need(user_query) or answer['isExecutionRequired']:
                 print("Executor needed based on user query.")
-                executor_prompt = f"""
-                                User Initial Request: \n```{user_query}``\n\n
-                                And Code Reader suggested: \n###{answer['aiReply']}###\n\n
-                            """
-                call_executor(project.repo_path, executor_prompt, project, settings.BASE_DIR, base64_image)
-
-            self.save_interaction(conversation_obj, summary_memory,user_query, answer['aiReply'])
-            return Response({'answer': answer}, status=200)
+                # runs in a Celery worker, poll or stream /api/jobs/<job_id>/
+                job = project.start_executor(self.executor_request(user_query, answer), base64_image)
+
+            self.save_interaction(conversation_obj, user_query, answer['aiReply'])
+            return Response({'answer': answer, 'prompt_tokens': prompt_tokens, 'job_id': job.id if job else None},
+                            status=200)
         except Exception as e:
             return Response({'error': str(e)}, status=500)
 
+    def executor_request(self, user_query, answer):
+        return f"""
+                User Initial Request: \n```{user_query}``\n\n
+                And Code Reader suggested: \n###{answer['aiReply']}###\n\n
+            """
+
     def retrieve_project_and_conversation(self, project_id, conversation_id):
         project = get_object_or_404(Project, id=project_id)
         conversation_obj, created = Conversation.objects.get_or_create(
@@ -367,50 +396,19 @@ class ExecutorView(APIView):
         return user_query, base64_image
 
     def prepare_prompt(self, project, user_query, conversation_obj):
-        # Prepare conversation history
-        summary_memory = ConversationSummaryBufferMemory(llm=llm, max_token_limit=500)
-        conv_summary = "No conversation yet\n"
-        if 'history' in conversation_obj.conversation_summary:
-
-            conv_summary = ast.literal_eval(conversation_obj.conversation_summary)['history']
-            summary_memory.save_context({"input": "conversation till now"}, {"output": conv_summary})
-
-        files = list(File.objects.filter(project=project).values('path', 'summary'))
-        if len(str(files)) > 50000 and not project.files_summary:
-            documents = [Document(page_content=file['summary'], metadata={"path": file['path']}) for file in files]
-            result = summary_maker_chain.invoke(documents)
-            files = result
-            project.files_summary = files
-            project.save()
-            print("Summary Results of files: ", result)
-        else:
-            files = project.files_summary
-        code_context = "no files present, yet to build the project"
-        if user_query and files:
-            prompt_for_fetching_file = f"""
-                #         Project data: ##{project.name}##\n
-                #         Project summary: ##{project.summary}##\n
-                #         Files summary docs: ##{files}##\n
-                #         Summary of the conversation : ##{str(conv_summary)}##\n\n
-                #         Based on the above given data, Answer the following questions:
-                #         User's Query: ##{user_query}##\n\n
-                #         Yours Instruction: 
-                            1. give me file paths of all the files that you need the content so that you can
-                            interpret user requests and provide actionable insights for a project's code.
-
-                    """
-            response = invoke_model(prompt_for_fetching_file, FilepathResponse)
-            file_paths = response.model_dump()['files']
-            print('file_paths retrieved: ')
-            print(file_paths)
-            code_context = File.objects.filter(path__in=file_paths).values('path', 'content', 'summary')
-            if len(str(code_context)) > 50000:
-                code_context = File.objects.filter(path__in=file_paths).values('path', 'content')
+        chunks = None
+        if user_query and File.objects.filter(project=project).exists():
+            # only the functions / classes relevant to the query, not the whole files
+            chunks = retrieve_chunks(project, user_query)
+            print('files retrieved: ')
+            print([chunk['path'] for chunk in chunks])
 
             print('code_context retrieved')
         else:
             print('no code_context before, yet to build the project')
-        # print(code_context)
+        sections = build_prompt_sections(project, user_query, chunks, conversation_history(conversation_obj),
+                                         tree=True)
+        prompt_tokens = sections.pop('token_counts')
 
         # Prepare the prompt or input for the LLM
         prompt = f"""
@@ -419,10 +417,10 @@ class ExecutorView(APIView):
     
             ### Project Information:
             - **Project Name**: {project.name}
-            - **File Structure**: {project.tree_structure}
-            - **Project Summary**: {project.summary}
-            - **Files Summary and Content**: {code_context}
-            - **Summary of the Conversation**: {str(summary_memory.load_memory_variables({}))}
+            - **File Structure**: {sections['tree']}
+            - **Project Summary**: {sections['project_summary']}
+            - **Files Summary and Relevant Code (symbol, line range, content)**: {sections['code_context']}
+            - **Summary of the Conversation**: {sections['history']}
     
             ### User Query:
             ``{user_query}``
@@ -435,18 +433,46 @@ class ExecutorView(APIView):
             ### Response:
         """
 
-        return prompt, summary_memory
+        prompt_tokens['total'] = count_tokens(prompt)
+        print(f"prompt tokens: {prompt_tokens}")
+        return prompt, prompt_tokens
 
     def call_llm(self, prompt, base64_image):
         if base64_image:
             return call_openai_llm_with_image(prompt, base64_image)
         return call_openai_llm_without_memory(prompt)
 
-    def save_interaction(self, conversation_obj, summary_memory, user_query, answer):
-        Messages.objects.create(conversation=conversation_obj, user_message=user_query, ai_response=answer)
-        summary_memory.save_context({"input": user_query}, {"output": answer})
-        conversation_obj.conversation_summary = summary_memory.load_memory_variables({})
-        conversation_obj.save()
+    def save_interaction(self, conversation_obj, user_query, answer):
+        record_exchange(conversation_obj, user_query, answer)
+
+
+class ExecutorStreamView(ExecutorView):
+    """
+    ExecutorView as server-sent events: 'prompt', 'answer' (the supervisor reply), then while the
+    executor job runs 'plan_created', 'step_started' and 'step_finished', 'job_finished' and a final
+    'done' with timings.
+    """
+
+    def post(self, request, project_id, conversation_id):
+        timer = StreamTimer()
+        project, conversation_obj = self.retrieve_project_and_conversation(project_id, conversation_id)
+        user_query, base64_image = self.process_user_inputs(request, project)
+        return sse_response(self.events(project, conversation_obj, user_query, base64_image), timer, 'executor')
+
+    def events(self, project, conversation_obj, user_query, base64_image):
+        yield 'start', {"project_id": project.id}
+        prompt, prompt_tokens = self.prepare_prompt(project, user_query, conversation_obj)
+        yield 'prompt', {"prompt_tokens": prompt_tokens}
+
+        answer = invoke_model(prompt, SupervisorResponse, image=base64_image).model_dump()
+        yield 'answer', {"answer": answer}
+
+        self.save_interaction(conversation_obj, user_query, answer['aiReply'])
+        if SupervisorResponse.determine_executor_need(user_query) or answer['isExecutionRequired']:
+            job = project.start_executor(self.executor_request(user_query, answer), base64_image)
+            yield 'executor_started', {"job_id": job.id}
+            # plan and step events as the worker saves them on the job
+            yield from job_events(job.id)
 
 
 class ProjectFilesView(APIView):
@@ -472,4 +498,31 @@ class UserDetailView(APIView):
             'first_name': user.first_name,
             'last_name': user.last_name
         }
-        return Response(user_details, status=status.HTTP_200_OK)
\ No newline at end of file
+        return Response(user_details, status=status.HTTP_200_OK)
+
+
+class JobDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        job = get_object_or_404(Job, id=job_id, project__user=request.user)
+        return Response(JobSerializer(job).data, status=status.HTTP_200_OK)
+
+
+class JobStreamView(APIView):
+    """Progress events of a job as server-sent events, ending with the job status once it is over."""
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id):
+        timer = StreamTimer()
+        job = get_object_or_404(Job, id=job_id, project__user=request.user)
+        return sse_response(job_events(job.id), timer, f'job {job.id}')
+
+
+class LLMCacheStatsView(APIView):
+    def get(self, request):
+        # counters of this process since it started
+        return Response({**llm_cache.stats(), "structured_output": structured_output_stats(), "gateway": gateway_stats(),
+                         "routes": route_stats()},
+                        status=status.HTTP_200_OK)
@@ -171,6 +171,8 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 OPEN_AI_KEY = os.getenv('OPEN_AI_KEY')
+# Point the OpenAI clients at another endpoint, e.g. a local fake LLM server while testing
+OPEN_AI_BASE_URL = os.getenv('OPEN_AI_BASE_URL') or None
 SERPAPI_API_KEY = os.getenv('SERPAPI_API_KEY')
 
 # Configure media settings for file uploads
@@ -190,3 +192,77 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'  # Set to your preferred timezone
 
+
+# Code reader ingestion
+CODE_READER_CONCURRENCY = int(os.getenv('CODE_READER_CONCURRENCY', 8))  # parallel file summaries
+CODE_READER_REQUESTS_PER_MINUTE = int(os.getenv('CODE_READER_REQUESTS_PER_MINUTE', 500))
+CODE_READER_TOKENS_PER_MINUTE = int(os.getenv('CODE_READER_TOKENS_PER_MINUTE', 200000))
+CODE_READER_MAX_RETRIES = int(os.getenv('CODE_READER_MAX_RETRIES', 5))  # retries on rate limit errors
+CODE_READER_WRITE_CHUNK_SIZE = int(os.getenv('CODE_READER_WRITE_CHUNK_SIZE', 200))  # File rows per transaction
+
+# Uploaded project archives
+CODE_READER_ARCHIVE_MAX_BYTES = int(os.getenv('CODE_READER_ARCHIVE_MAX_BYTES', 500 * 1024 * 1024))  # uncompressed
+CODE_READER_ARCHIVE_MAX_MEMBERS = int(os.getenv('CODE_READER_ARCHIVE_MAX_MEMBERS', 20000))
+CODE_READER_ARCHIVE_MAX_INDEXED_FILE_BYTES = int(os.getenv('CODE_READER_ARCHIVE_MAX_INDEXED_FILE_BYTES', 2 * 1024 * 1024))
+CODE_READER_ARCHIVE_WORKERS = int(os.getenv('CODE_READER_ARCHIVE_WORKERS', 4))  # parallel decompression
+
+# Retrieval index over file summaries and code chunks
+# any callable class turning a list of texts into vectors, e.g. 'code_reader.retrieval.HashingEmbedder' offline
+CODE_READER_EMBEDDER = os.getenv('CODE_READER_EMBEDDER', 'code_reader.retrieval.OpenAIEmbedder')
+CODE_READER_EMBEDDING_MODEL = os.getenv('CODE_READER_EMBEDDING_MODEL', 'text-embedding-3-small')
+CODE_READER_INDEX_DIR = os.getenv('CODE_READER_INDEX_DIR', os.path.join(BASE_DIR, 'indexes'))
+CODE_READER_RETRIEVAL_TOP_CHUNKS = int(os.getenv('CODE_READER_RETRIEVAL_TOP_CHUNKS', 12))  # chunks pulled into the prompts
+
+# Prompt assembly
+# tokens of project data (summaries, tree, code, history) put in one Q&A / executor prompt
+CODE_READER_PROMPT_MAX_TOKENS = int(os.getenv('CODE_READER_PROMPT_MAX_TOKENS', 24000))
+# tokens of the latest conversation messages put in the prompts as they are, the older ones are summarized
+# in a background task once the messages not summarized yet go beyond it
+CODE_READER_CONVERSATION_WINDOW_TOKENS = int(os.getenv('CODE_READER_CONVERSATION_WINDOW_TOKENS', 1500))
+
+# LLM response cache: 'sqlite', 'redis', 'memory' or '' to disable
+CODE_READER_LLM_CACHE = os.getenv('CODE_READER_LLM_CACHE', 'sqlite')
+CODE_READER_LLM_CACHE_PATH = os.getenv('CODE_READER_LLM_CACHE_PATH', os.path.join(BASE_DIR, 'llm_cache.sqlite3'))
+CODE_READER_LLM_CACHE_REDIS_URL = os.getenv('CODE_READER_LLM_CACHE_REDIS_URL', 'redis://localhost:6379/1')
+CODE_READER_LLM_CACHE_TTL = int(os.getenv('CODE_READER_LLM_CACHE_TTL', 7 * 24 * 3600))  # seconds, 0 for no expiry
+CODE_READER_LLM_CACHE_MAX_ENTRIES = int(os.getenv('CODE_READER_LLM_CACHE_MAX_ENTRIES', 10000))
+
+# Executor runs are Celery jobs, a worker consuming this queue with -c N runs at most N of them at once
+CODE_READER_EXECUTOR_QUEUE = os.getenv('CODE_READER_EXECUTOR_QUEUE', 'celery')
+CELERY_TASK_ROUTES = {'code_reader.tasks.run_executor_job': {'queue': CODE_READER_EXECUTOR_QUEUE}}
+
+# Executor commands: seconds a terminal command may run before its output so far is returned
+CODE_READER_COMMAND_TIMEOUT = int(os.getenv('CODE_READER_COMMAND_TIMEOUT', 120))
+# a service is considered up once it printed something and went quiet this long, or at the timeout
+CODE_READER_SERVICE_STARTUP_TIMEOUT = int(os.getenv('CODE_READER_SERVICE_STARTUP_TIMEOUT', 30))
+CODE_READER_SERVICE_IDLE_SECONDS = float(os.getenv('CODE_READER_SERVICE_IDLE_SECONDS', 2))
+# characters of tmux session output kept until a tool reads it, the oldest output is dropped beyond that
+CODE_READER_SESSION_OUTPUT_MAX_CHARS = int(os.getenv('CODE_READER_SESSION_OUTPUT_MAX_CHARS', 1024 * 1024))
+# independent plan steps the executor runs at the same time
+CODE_READER_EXECUTOR_MAX_PARALLEL_STEPS = int(os.getenv('CODE_READER_EXECUTOR_MAX_PARALLEL_STEPS', 4))
+# steps whose tools all succeeded go on without the feedback analyzer, which still runs every this many
+# steps and after the last one; 1 analyzes every step
+CODE_READER_FEEDBACK_EVERY_STEPS = int(os.getenv('CODE_READER_FEEDBACK_EVERY_STEPS', 3))
+# files of at least this many lines are edited with search / replace blocks instead of being rewritten whole
+CODE_READER_EDIT_BLOCKS_MIN_LINES = int(os.getenv('CODE_READER_EDIT_BLOCKS_MIN_LINES', 40))
+# corrections asked for a structured answer of the model that does not validate against its schema
+CODE_READER_STRUCTURED_OUTPUT_RETRIES = int(os.getenv('CODE_READER_STRUCTURED_OUTPUT_RETRIES', 2))
+
+# LLM gateway (code_reader/llm.py): one pooled HTTP client for every OpenAI call of the process
+CODE_READER_LLM_TIMEOUT = float(os.getenv('CODE_READER_LLM_TIMEOUT', 120))  # seconds per request, also the wait for a slot
+CODE_READER_LLM_CONNECT_TIMEOUT = float(os.getenv('CODE_READER_LLM_CONNECT_TIMEOUT', 10))
+CODE_READER_LLM_MAX_CONNECTIONS = int(os.getenv('CODE_READER_LLM_MAX_CONNECTIONS', 32))
+# calls in flight per model, 'model=limit,...'; other models get the default
+CODE_READER_LLM_MODEL_CONCURRENCY = os.getenv('CODE_READER_LLM_MODEL_CONCURRENCY', 'gpt-4o=8,gpt-4o-mini=16')
+CODE_READER_LLM_DEFAULT_CONCURRENCY = int(os.getenv('CODE_READER_LLM_DEFAULT_CONCURRENCY', 8))
+# consecutive failures (connection errors, timeouts, 5xx, 429) opening the circuit of a model, and how long it stays open
+CODE_READER_LLM_BREAKER_THRESHOLD = int(os.getenv('CODE_READER_LLM_BREAKER_THRESHOLD', 5))
+CODE_READER_LLM_BREAKER_COOLDOWN = float(os.getenv('CODE_READER_LLM_BREAKER_COOLDOWN', 30))
+
+# Model routing (code_reader/routing.py): model per call site, 'route=model,...' over the defaults of
+# planning, step, feedback, code_edit, summarization and answer
+CODE_READER_MODEL_ROUTES = os.getenv('CODE_READER_MODEL_ROUTES', '')
+# model a call is retried with when the routed one gives no valid answer, stops early or is unsure
+CODE_READER_ESCALATION_MODEL = os.getenv('CODE_READER_ESCALATION_MODEL', 'gpt-4o')
+# answers rating their confidence (0 to 1) below this are asked again to the escalation model
+CODE_READER_ESCALATION_CONFIDENCE = float(os.getenv('CODE_READER_ESCALATION_CONFIDENCE', 0.5))
@@ -0,0 +1,35 @@
+# Generated by Django 5.1.4 on 2026-10-18 05:14
+
+import ast
+
+from django.db import migrations, models
+
+
+def backfill_state(apps, schema_editor):
+    # the memory summary saved so far covers every message of the conversation
+    Conversation = apps.get_model('conversation', 'Conversation')
+    Messages = apps.get_model('conversation', 'Messages')
+    for conversation in Conversation.objects.exclude(conversation_summary__isnull=True).iterator():
+        try:
+            summary = ast.literal_eval(conversation.conversation_summary).get('history', '')
+        except (ValueError, SyntaxError, AttributeError):
+            continue
+        last = Messages.objects.filter(conversation=conversation).order_by('-id').values_list('id', flat=True).first()
+        conversation.state = {"summary": summary or '', "summarized_through": last or 0}
+        conversation.save(update_fields=['state'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conversation', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='state',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(backfill_state, migrations.RunPython.noop),
+    ]
@@ -4,7 +4,11 @@ from django.contrib.auth.models import User
 class Conversation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     conversation_id = models.CharField(max_length=255, unique=True)
+    # str({'history': summary}) of the older messages, kept up to date for the API clients reading it
     conversation_summary = models.TextField(null=True, blank=True)
+    # {"summary": summary of the messages up to the Messages id "summarized_through"}, the messages after
+    # it are put in the prompts as they are, see code_reader/conversations.py
+    state = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
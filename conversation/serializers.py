@@ -4,7 +4,7 @@ from .models import Conversation, Messages
 class ConversationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Conversation
-        fields = ['id', 'user', 'conversation_id', 'conversation_summary', 'created_at']
+        fields = ['id', 'user', 'conversation_id', 'conversation_summary', 'state', 'created_at']
 
 class MessagesSerializer(serializers.ModelSerializer):
     class Meta: